@@ -1,2 +1,2 @@
-from . import serve
-serve.main()
+from . import cli
+cli.main()
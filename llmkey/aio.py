@@ -0,0 +1,50 @@
+"An asyncio engine which runs every query stream on one event loop thread"
+import asyncio
+import threading
+
+from . import runner
+
+
+class AsyncEngine(runner.QueryPool):
+    "A QueryPool which runs queries as coroutines rather than threads"
+
+    def __init__(self, size=100, limits=None, connect_timeout=None):
+        super().__init__(size, limits, connect_timeout=connect_timeout)
+        self.futures = {}
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _start(self, query, done):
+        future = asyncio.run_coroutine_threadsafe(self._arun(query, done), self.loop)
+        self.futures[query.id] = future
+        future.add_done_callback(lambda _: self.futures.pop(query.id, None))
+
+    def _interrupt(self, query):
+        # Cancelling the task closes the response from inside the loop
+        future = self.futures.get(query.id)
+        if future is not None:
+            future.cancel()
+
+    async def _arun(self, query, done):
+        try:
+            await query.arun()
+        except asyncio.CancelledError:
+            if query.timed_out:
+                self._failed(query, done, self._timeout_error(query))
+            raise
+        except Exception as e: #pylint: disable=broad-except
+            self._failed(query, done, e)
+        else:
+            self._succeeded(query, done)
+
+
+def engine(conf, size=None):
+    "Make the query pool or engine chosen in conf. size overrides its size"
+    if conf.engine == "asyncio":
+        return AsyncEngine(
+            size or conf.async_pool_size, conf.backend_concurrency, connect_timeout=conf.connect_timeout)
+    else:
+        return runner.QueryPool(
+            size or conf.pool_size, conf.backend_concurrency, connect_timeout=conf.connect_timeout)
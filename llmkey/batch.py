@@ -0,0 +1,147 @@
+"Run a JSONL file of prompts without the gui, resuming where a previous run stopped"
+import json
+import logging
+import os
+import sys
+import threading
+import time
+
+from . import aio, config, timing
+from .queries import one_off, remember
+
+
+def read_prompts(path):
+    with open(path) as f:
+        for number, line in enumerate(f, 1):
+            if line.strip():
+                item = json.loads(line)
+                item.setdefault("id", number)
+                yield item
+
+
+def finished_ids(path):
+    "Ids of items already answered in the output. Drops a line left half written by a crash"
+    if not os.path.exists(path):
+        return set()
+
+    with open(path, "rb+") as f:
+        data = f.read()
+        end = data.rfind(b"\n") + 1
+        if end != len(data):
+            f.truncate(end)
+
+    ids = set()
+    for line in data[:end].splitlines():
+        result = json.loads(line)
+        # Items which can never run, such as those naming an unknown backend, are not tried again
+        if "reply" in result or result.get("retry") is False:
+            ids.add(result["id"])
+    return ids
+
+
+class Batch:
+    def __init__(self, output, pool, jobs, bypass_cache=False):
+        self.output = output
+        self.pool = pool
+        self.bypass_cache = bypass_cache
+        self.slots = threading.Semaphore(jobs * 2)
+        self.lock = threading.Lock()
+        self.timings = []
+        self.done = 0
+        self.failed = 0
+        self.in_flight = 0
+        self.all_done = threading.Condition(self.lock)
+
+    def run(self, items, skip):
+        start = time.time()
+        with open(self.output, "a") as out:
+            for item in items:
+                if item["id"] in skip:
+                    continue
+                # Do not read more prompts than we can run soon
+                self.slots.acquire()
+                self.submit(item, out)
+
+            with self.all_done:
+                self.all_done.wait_for(lambda: self.in_flight == 0)
+        return time.time() - start
+
+    def submit(self, item, out):
+        with self.lock:
+            self.in_flight += 1
+
+        try:
+            query = one_off(
+                item["prompt"], bypass_cache=self.bypass_cache,
+                backend=item.get("backend"), model=item.get("model"))
+        except Exception as e: #pylint: disable=broad-except
+            logging.warning("Could not run %s: %r", item["id"], e)
+            self.write(out, dict(
+                id=item["id"], backend=item.get("backend"), model=item.get("model"),
+                error=f"{type(e).__name__}: {e}", retry=False), failed=True)
+            return
+
+        if query.cached:
+            self.finish(item, query, out)
+        else:
+            self.pool.submit(query, lambda query: self.finish(item, query, out))
+
+    def finish(self, item, query, out):
+        result = dict(id=item["id"], backend=query.backend, model=query.model)
+        if query.error:
+            result["error"] = query.error
+        else:
+            remember(query)
+            result["reply"] = query.reply
+            result["timing"] = query.timing.as_dict()
+
+        self.write(out, result, failed=bool(query.error),
+                   record=None if query.error or query.cached else query.timing)
+
+    def write(self, out, result, failed, record=None):
+        "Write a result line. record is the timing to report"
+        with self.lock:
+            out.write(json.dumps(result) + "\n")
+            out.flush()
+            if failed:
+                self.failed += 1
+            else:
+                self.done += 1
+                if record is not None:
+                    self.timings.append(record)
+            self.in_flight -= 1
+            print(f"\r{self.done} done, {self.failed} failed", end="", file=sys.stderr)
+            self.all_done.notify_all()
+        self.slots.release()
+
+    def report(self, duration):
+        print(file=sys.stderr)
+        print(f"{self.done} done and {self.failed} failed in {duration:.1f}s")
+        if not self.timings:
+            return
+
+        tokens = sum(t.tokens for t in self.timings)
+        print(f"{self.done / duration:.2f} prompts/s, {tokens / duration:.1f} tokens/s")
+        durations = [t.finished - t.started for t in self.timings]
+        first_tokens = [t.time_to_first_token for t in self.timings if t.time_to_first_token is not None]
+        for label, values in [("latency", durations), ("time to first token", first_tokens)]:
+            if values:
+                percentiles = ", ".join(
+                    f"p{p} {timing.percentile(values, p):.2f}s" for p in (50, 90, 99))
+                print(f"{label}: {percentiles}")
+
+
+def main(args):
+    logging.basicConfig(level=logging.WARNING)
+    conf = config.Config()
+    conf.load()
+    pool = aio.engine(conf, args.jobs)
+
+    skip = finished_ids(args.output)
+    if skip:
+        print(f"Resuming. {len(skip)} prompts already done", file=sys.stderr)
+
+    batch = Batch(args.output, pool, args.jobs, bypass_cache=args.no_cache)
+    duration = batch.run(read_prompts(args.input), skip)
+    batch.report(duration)
+    return 1 if batch.failed else 0
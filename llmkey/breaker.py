@@ -0,0 +1,102 @@
+"Circuit breakers, so queries skip backends that are down"
+import logging
+import threading
+import time
+
+from . import llm
+
+# Consecutive failures before a backend is skipped
+THRESHOLD = 3
+PROBE_INTERVAL = 15
+
+BREAKERS = {}
+LOCK = threading.Lock()
+# Called with no arguments whenever a breaker opens or closes
+LISTENERS = []
+
+def get(backend):
+    with LOCK:
+        if backend not in BREAKERS:
+            BREAKERS[backend] = CircuitBreaker(backend)
+        return BREAKERS[backend]
+
+def healthy(backend):
+    with LOCK:
+        breaker = BREAKERS.get(backend)
+    return breaker is None or not breaker.open
+
+def summary():
+    with LOCK:
+        breakers = sorted(BREAKERS.values(), key=lambda b: b.backend)
+    if not breakers:
+        return "No backends used yet"
+    return "Backends: " + ", ".join(str(b) for b in breakers)
+
+def changed():
+    for listener in LISTENERS:
+        try:
+            listener()
+        except Exception: #pylint: disable=broad-except
+            logging.exception("Breaker listener failed")
+
+
+class CircuitBreaker:
+    "Opens after repeated failures. A background probe closes it again"
+
+    def __init__(self, backend, threshold=THRESHOLD, probe_interval=PROBE_INTERVAL):
+        self.backend = backend
+        self.threshold = threshold
+        self.probe_interval = probe_interval
+        self.lock = threading.Lock()
+        self.failures = 0
+        self.opened = None
+        self.probe_error = None
+
+    def __str__(self):
+        if self.open:
+            return f"{self.backend} down for {time.time() - self.opened:.0f}s"
+        return f"{self.backend} ok"
+
+    @property
+    def open(self):
+        return self.opened is not None
+
+    def success(self):
+        with self.lock:
+            self.failures = 0
+            was_open = self.open
+            self.opened = None
+        if was_open:
+            logging.info("%s is back", self.backend)
+            changed()
+
+    def failure(self):
+        with self.lock:
+            self.failures += 1
+            opening = not self.open and self.failures >= self.threshold
+            if opening:
+                self.opened = time.time()
+        if opening:
+            logging.warning("%s failed %d times in a row. Skipping it", self.backend, self.failures)
+            thread = threading.Thread(target=self.probe)
+            thread.daemon = True
+            thread.start()
+            changed()
+
+    def check(self):
+        "Raises if the backend is still down. Others are just tried again"
+        if self.backend in llm.MODEL_CLASSES:
+            llm.get(self.backend).fetch_models()
+
+    def probe(self):
+        "Check the backend in the background until it answers"
+        while self.open:
+            time.sleep(self.probe_interval)
+            try:
+                self.check()
+            except Exception as e: #pylint: disable=broad-except
+                self.probe_error = e
+                logging.info("%s is still down: %s", self.backend, e)
+            else:
+                self.probe_error = None
+                self.success()
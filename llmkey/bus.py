@@ -1,14 +1,55 @@
-from . import tk_tools
+import collections
+import logging
+import queue
+import time
+
+# How often the tk loop checks for events, and the most it handles in one go
+POLL_MS = 10
+BATCH_SIZE = 200
+
+
+class Event:
+    "Passed to bound callbacks. data is passed by reference"
+    def __init__(self, name, data):
+        self.name = name
+        self.data = data
+        self.sent = time.time()
+
 
 class Bus:
+    "Events can be sent from any thread. The tk loop drains them in batches"
+
     def __init__(self, tk_root):
         self.tk_root = tk_root
+        self.queue = queue.SimpleQueue()
+        self.callbacks = collections.defaultdict(list)
+        self.tk_root.after(POLL_MS, self.poll)
 
     def send(self, event, *, data=None):
-        self.tk_root.event_generate(event, data=data)
+        self.queue.put(Event(event, data))
 
     def bind(self, event, callback):
-        tk_tools.my_bind(self.tk_root, event, callback)
+        self.callbacks[event].append(callback)
+
+    def poll(self):
+        try:
+            self.dispatch()
+        finally:
+            # Come straight back if there is a backlog
+            self.tk_root.after(0 if not self.queue.empty() else POLL_MS, self.poll)
+
+    def dispatch(self):
+        for _ in range(BATCH_SIZE):
+            try:
+                event = self.queue.get_nowait()
+            except queue.Empty:
+                return
+
+            for callback in self.callbacks[event.name]:
+                try:
+                    callback(event)
+                except Exception: #pylint: disable=broad-except
+                    logging.exception("Handling %s failed", event.name)
 
 
 class MockBus:
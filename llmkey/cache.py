@@ -0,0 +1,102 @@
+"Cache of replies keyed on backend, model and prompt"
+import collections
+import hashlib
+import sqlite3
+import threading
+import time
+
+from . import config
+
+CACHE = None
+
+def get_cache():
+    global CACHE #pylint: disable=global-statement
+    if CACHE is None:
+        conf = config.Config()
+        conf.load()
+        conf.io.ensure_dir()
+        CACHE = ResponseCache(
+            config.ConfigIO.dir() / "cache.sqlite",
+            max_entries=conf.cache_entries,
+            max_age=conf.cache_max_age)
+    return CACHE
+
+
+def normalise(prompt):
+    "Ignore line endings, trailing whitespace and surrounding blank lines"
+    lines = [line.rstrip() for line in prompt.replace("\r\n", "\n").split("\n")]
+    return "\n".join(lines).strip("\n")
+
+
+def cache_key(backend, model, prompt):
+    data = "\0".join([backend or "", model or "", normalise(prompt)])
+    return hashlib.sha256(data.encode("utf8")).hexdigest()
+
+
+class ResponseCache:
+    "An in-memory LRU in front of an sqlite store with size and age based eviction"
+
+    def __init__(self, path, memory_entries=256, max_entries=5000, max_age=7 * 24 * 3600):
+        self.memory_entries = memory_entries
+        self.max_entries = max_entries
+        self.max_age = max_age
+        self.memory = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(str(path), check_same_thread=False)
+        self.db.execute(
+            "create table if not exists replies "
+            "(key text primary key, backend text, model text, reply text, created real, used real)")
+        self.db.execute("create index if not exists replies_used on replies (used)")
+        self.db.commit()
+
+    def get(self, backend, model, prompt):
+        key = cache_key(backend, model, prompt)
+        now = time.time()
+        with self.lock:
+            entry = self.memory.get(key)
+            if entry is None:
+                row = self.db.execute(
+                    "select reply, created from replies where key = ?", (key,)).fetchone()
+                if row is not None:
+                    entry = row
+                    self.db.execute("update replies set used = ? where key = ?", (now, key))
+                    self.db.commit()
+
+            if entry is None or now - entry[1] > self.max_age:
+                self.memory.pop(key, None)
+                self.misses += 1
+                return None
+
+            self._remember(key, entry)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, backend, model, prompt, reply):
+        key = cache_key(backend, model, prompt)
+        now = time.time()
+        with self.lock:
+            self.db.execute(
+                "insert or replace into replies values (?, ?, ?, ?, ?, ?)",
+                (key, backend, model, reply, now, now))
+            self._evict(now)
+            self.db.commit()
+            self._remember(key, (reply, now))
+
+    def _remember(self, key, entry):
+        self.memory[key] = entry
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.memory_entries:
+            self.memory.popitem(last=False)
+
+    def _evict(self, now):
+        self.db.execute("delete from replies where created < ?", (now - self.max_age,))
+        self.db.execute(
+            "delete from replies where key in "
+            "(select key from replies order by used desc limit -1 offset ?)",
+            (self.max_entries,))
+
+    @property
+    def stats(self):
+        return f"Cache: {self.hits} hits, {self.misses} misses"
@@ -0,0 +1,115 @@
+"Model lists for each backend, stored on disk and refreshed in the background"
+import json
+import logging
+import threading
+import time
+
+from . import config
+
+FILE_LOCK = threading.Lock()
+# Seconds before a failed fetch is retried
+RETRY_DELAY = 60
+# How long to wait for the first model list of a backend nothing is known about
+FIRST_FETCH_WAIT = 10
+
+def catalog_file():
+    return config.ConfigIO.dir() / "models.json"
+
+def load_all():
+    with FILE_LOCK:
+        path = catalog_file()
+        if not path.exists():
+            return {}
+        with open(path) as f:
+            return json.load(f)
+
+def save(name, models, updated):
+    with FILE_LOCK:
+        config.ConfigIO().ensure_dir()
+        path = catalog_file()
+        data = {}
+        if path.exists():
+            with open(path) as f:
+                data = json.load(f)
+
+        data[name] = dict(models=models, updated=updated)
+        with open(path, "w") as f:
+            json.dump(data, f)
+
+
+class ModelCatalog:
+    "Answers model lists from memory. Stale lists are refetched in a thread"
+
+    def __init__(self, name, fetch, ttl=3600):
+        self.name = name
+        self.fetch = fetch
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.refreshing = False
+        self.refresh_again = False
+        self.error = None
+        # Clear while a fetch is running
+        self.fetched = threading.Event()
+        self.fetched.set()
+
+        entry = load_all().get(name, {})
+        self._models = entry.get("models", [])
+        self.updated = entry.get("updated", 0)
+
+    @property
+    def stale(self):
+        return time.time() - self.updated > self.ttl
+
+    @property
+    def models(self):
+        if self.stale and not self.refreshing:
+            self.refresh()
+        return self._models
+
+    def wait(self, timeout=FIRST_FETCH_WAIT):
+        "The models, waiting up to timeout for a fetch if none are known yet"
+        models = self.models
+        if not models:
+            self.fetched.wait(timeout)
+        return self._models
+
+    def invalidate(self):
+        "Drop the model list, for example after a key change or a pull"
+        self._models = []
+        self.updated = 0
+        self.refresh()
+
+    def refresh(self):
+        with self.lock:
+            if self.refreshing:
+                # The running fetch may have used an old key
+                self.refresh_again = True
+                return
+            self.refreshing = True
+            self.fetched.clear()
+
+        thread = threading.Thread(target=self._refresh)
+        thread.daemon = True
+        thread.start()
+
+    def _refresh(self):
+        try:
+            models = sorted(self.fetch())
+        except Exception as e: #pylint: disable=broad-except
+            logging.exception("Could not fetch models for %s", self.name)
+            self.error = e
+            # Do not retry a failing backend on every read
+            self.updated = time.time() - self.ttl + RETRY_DELAY
+        else:
+            self.error = None
+            self._models = models
+            self.updated = time.time()
+            save(self.name, models, self.updated)
+        finally:
+            with self.lock:
+                self.refreshing = False
+                again, self.refresh_again = self.refresh_again, False
+                if not again:
+                    self.fetched.set()
+            if again:
+                self.refresh()
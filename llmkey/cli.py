@@ -0,0 +1,83 @@
+"The llm-key command. Imports are done late so that llm-key ask starts quickly"
+import argparse
+import subprocess
+import sys
+import time
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="llm-key", description="Use LLMs throughout your desktop")
+    commands = parser.add_subparsers(dest="command")
+    commands.add_parser("daemon", help="Run without a gui, answering queries over a unix socket")
+    ask_parser = commands.add_parser("ask", help="Ask the running llm-key a question")
+    ask_parser.add_argument("prompt", nargs="?", help="Read from stdin if not given")
+    ask_parser.add_argument("--backend")
+    ask_parser.add_argument("--model")
+    ask_parser.add_argument("--no-cache", action="store_true", help="Do not use a cached reply")
+    batch_parser = commands.add_parser("batch", help="Run a JSONL file of prompts")
+    batch_parser.add_argument("input", help="JSONL with a prompt and optional id, backend and model on each line")
+    batch_parser.add_argument("output", help="JSONL results. Prompts already answered here are skipped")
+    batch_parser.add_argument("--jobs", "-j", type=int, default=4, help="Prompts to run at once")
+    batch_parser.add_argument("--no-cache", action="store_true", help="Do not use cached replies")
+    args = parser.parse_args()
+
+    if args.command == "batch":
+        from . import batch
+        sys.exit(batch.main(args))
+    elif args.command == "daemon":
+        from . import daemon
+        sys.exit(daemon.main())
+    elif args.command == "ask":
+        sys.exit(ask(args))
+    else:
+        gui()
+
+
+def gui():
+    from . import ipc
+    if ipc.running():
+        # Hand off to the running instance rather than starting cold
+        reply = ipc.call(dict(op="menu"))
+        if "error" in reply:
+            print("llm-key daemon is already running. Stop it to start the gui", file=sys.stderr)
+            sys.exit(1)
+        return
+
+    from . import serve
+    serve.main()
+
+
+def ask(args):
+    from . import ipc
+    prompt = args.prompt if args.prompt is not None else sys.stdin.read()
+    if not ipc.running():
+        start_daemon()
+
+    message = dict(op="ask", prompt=prompt, backend=args.backend, model=args.model, no_cache=args.no_cache)
+    for reply in ipc.request(message):
+        if "chunk" in reply:
+            sys.stdout.write(reply["chunk"])
+            sys.stdout.flush()
+        elif "error" in reply:
+            print()
+            print(reply["error"], file=sys.stderr)
+            return 1
+        elif reply.get("done"):
+            print()
+            return 0
+    print()
+    print("llm-key daemon stopped without finishing the reply", file=sys.stderr)
+    return 1
+
+
+def start_daemon(timeout=10):
+    from . import ipc
+    subprocess.Popen(
+        [sys.executable, "-m", "llmkey", "daemon"],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, start_new_session=True)
+    end = time.time() + timeout
+    while time.time() < end:
+        if ipc.running():
+            return
+        time.sleep(0.05)
+    raise Exception("llm-key daemon did not start")
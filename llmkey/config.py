@@ -61,6 +61,40 @@ class Config:
         self.backend_models: O[dict[str, str]] = {}
         self.backend_keys: O[dict[str, str]] = {}
         self.first_run: O[bool] = True
+        self.pool_size: int = 4
+        self.backend_concurrency: dict[str, int] = {"ollama": 1}
+        self.cache_entries: int = 5000
+        self.cache_max_age: int = 7 * 24 * 3600
+        self.models_ttl: int = 3600
+        self.warm_up: bool = True
+        self.engine: str = "threads"
+        self.async_pool_size: int = 100
+        self.fast_stream: bool = False
+        # off, race or hedge. Candidates are [backend, model] pairs
+        self.race_mode: str = "off"
+        self.race_candidates: list[list[str]] = []
+        self.hedge_percentile: int = 90
+        # [backend, model] pairs to try in order when the configured backend fails
+        self.failover: list[list[str]] = []
+        self.connect_timeout: float = 30
+        # Sent first with every query
+        self.system_prompt: O[str] = None
+        # Clipboards longer than this are split up and mapped over
+        self.chunk_tokens: int = 4000
+        # Clipboards which would need more parts than this are refused
+        self.max_chunks: int = 16
+        # Lines packed into each request when running a command on each line
+        self.micro_batch_size: int = 20
+        # Offer replies to earlier prompts which are this similar, using a local ollama embedding model
+        self.semantic_cache: bool = False
+        self.embedding_model: str = "nomic-embed-text"
+        self.semantic_threshold: float = 0.95
+        # Clipboard queries include the most relevant parts of the files in these directories
+        self.retrieval_directories: list[str] = []
+        self.retrieval_chunks: int = 4
+        self.retrieval_interval: int = 600
+        # Reply windows kept open. Past this the least recently viewed are closed and built again when cycled to
+        self.reply_windows: int = 20
         self.configIO = ConfigIO()
 
 
@@ -72,6 +106,31 @@ class Config:
                 self.backend_models = data["backend_models"]
                 self.backend_keys = data["backend_keys"]
                 self.first_run = data["first_run"]
+                self.pool_size = data.get("pool_size", self.pool_size)
+                self.backend_concurrency = data.get("backend_concurrency", self.backend_concurrency)
+                self.cache_entries = data.get("cache_entries", self.cache_entries)
+                self.cache_max_age = data.get("cache_max_age", self.cache_max_age)
+                self.models_ttl = data.get("models_ttl", self.models_ttl)
+                self.warm_up = data.get("warm_up", self.warm_up)
+                self.engine = data.get("engine", self.engine)
+                self.async_pool_size = data.get("async_pool_size", self.async_pool_size)
+                self.fast_stream = data.get("fast_stream", self.fast_stream)
+                self.race_mode = data.get("race_mode", self.race_mode)
+                self.race_candidates = data.get("race_candidates", self.race_candidates)
+                self.hedge_percentile = data.get("hedge_percentile", self.hedge_percentile)
+                self.failover = data.get("failover", self.failover)
+                self.connect_timeout = data.get("connect_timeout", self.connect_timeout)
+                self.system_prompt = data.get("system_prompt", self.system_prompt)
+                self.chunk_tokens = data.get("chunk_tokens", self.chunk_tokens)
+                self.max_chunks = data.get("max_chunks", self.max_chunks)
+                self.micro_batch_size = data.get("micro_batch_size", self.micro_batch_size)
+                self.semantic_cache = data.get("semantic_cache", self.semantic_cache)
+                self.embedding_model = data.get("embedding_model", self.embedding_model)
+                self.semantic_threshold = data.get("semantic_threshold", self.semantic_threshold)
+                self.retrieval_directories = data.get("retrieval_directories", self.retrieval_directories)
+                self.retrieval_chunks = data.get("retrieval_chunks", self.retrieval_chunks)
+                self.retrieval_interval = data.get("retrieval_interval", self.retrieval_interval)
+                self.reply_windows = data.get("reply_windows", self.reply_windows)
 
 
     def save(self):
@@ -80,7 +139,32 @@ class Config:
             backend=self.backend,
             backend_models=self.backend_models,
             backend_keys=self.backend_keys,
-            first_run=self.first_run,)
+            first_run=self.first_run,
+            pool_size=self.pool_size,
+            backend_concurrency=self.backend_concurrency,
+            cache_entries=self.cache_entries,
+            cache_max_age=self.cache_max_age,
+            models_ttl=self.models_ttl,
+            warm_up=self.warm_up,
+            engine=self.engine,
+            async_pool_size=self.async_pool_size,
+            fast_stream=self.fast_stream,
+            race_mode=self.race_mode,
+            race_candidates=self.race_candidates,
+            hedge_percentile=self.hedge_percentile,
+            failover=self.failover,
+            connect_timeout=self.connect_timeout,
+            system_prompt=self.system_prompt,
+            chunk_tokens=self.chunk_tokens,
+            max_chunks=self.max_chunks,
+            micro_batch_size=self.micro_batch_size,
+            semantic_cache=self.semantic_cache,
+            embedding_model=self.embedding_model,
+            semantic_threshold=self.semantic_threshold,
+            retrieval_directories=self.retrieval_directories,
+            retrieval_chunks=self.retrieval_chunks,
+            retrieval_interval=self.retrieval_interval,
+            reply_windows=self.reply_windows,)
         self.io.save_data(data)
 
 
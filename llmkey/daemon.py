@@ -0,0 +1,120 @@
+"Serve queries over a unix socket, so scripts can reuse warm backends"
+import json
+import logging
+import os
+import queue
+import socketserver
+import threading
+
+from . import aio, config, ipc, llm
+from .queries import one_off, remember
+
+# Operations handed on to the tk app
+GUI_EVENTS = {"one_off": "<<one_off>>", "clipboard": "<<clipboard>>", "menu": "<<menu>>"}
+
+
+class Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        message = json.loads(self.rfile.readline())
+        op = message.get("op")
+        try:
+            if op == "ping":
+                self.reply(ok=True, gui=self.server.bus is not None)
+            elif op == "ask":
+                self.ask(message)
+            elif op in GUI_EVENTS and self.server.bus is not None:
+                self.server.bus.send(GUI_EVENTS[op])
+                self.reply(ok=True)
+            else:
+                self.reply(error=f"Cannot {op}")
+        except BrokenPipeError:
+            logging.info("Client went away")
+        except Exception as e: #pylint: disable=broad-except
+            logging.exception("Could not %s", op)
+            try:
+                self.reply(error=f"{type(e).__name__}: {e}")
+            except BrokenPipeError:
+                pass
+
+    def reply(self, **data):
+        self.wfile.write(json.dumps(data).encode("utf8") + b"\n")
+        self.wfile.flush()
+
+    def ask(self, message):
+        query = one_off(
+            message["prompt"],
+            bypass_cache=message.get("no_cache", False),
+            backend=message.get("backend"),
+            model=message.get("model"))
+
+        if not query.cached:
+            chunks = queue.SimpleQueue()
+            query.on_chunk = chunks.put
+            self.server.pool.submit(query, lambda _: chunks.put(None))
+            try:
+                while (chunk := chunks.get()) is not None:
+                    self.reply(chunk=chunk)
+            except BrokenPipeError:
+                self.server.pool.cancel(query)
+                raise
+            remember(query)
+        else:
+            self.reply(chunk=query.reply)
+
+        if query.error:
+            self.reply(error=query.error)
+        elif not query.finished and not query.cached:
+            self.reply(error="The query was cancelled")
+        else:
+            self.reply(done=True, cached=query.cached, timing=query.timing.summary())
+
+
+class Server(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, pool, bus=None):
+        self.pool = pool
+        self.bus = bus
+        path = ipc.socket_path()
+        if path.exists():
+            # Left behind by an instance which did not shut down cleanly
+            path.unlink()
+        path.parent.mkdir(parents=True, exist_ok=True)
+        super().__init__(str(path), Handler)
+        os.chmod(path, 0o600)
+
+    def server_close(self):
+        super().server_close()
+        ipc.socket_path().unlink(missing_ok=True)
+
+
+def start(pool, bus=None):
+    "Serve the socket from a thread"
+    server = Server(pool, bus)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+def main():
+    "Run without a gui, keeping backends warm"
+    logging.basicConfig(level=logging.INFO)
+    if ipc.running():
+        logging.error("llm-key is already running")
+        return 1
+
+    conf = config.Config()
+    conf.load()
+    if conf.backend:
+        llm.get(conf.backend).catalog.refresh()
+
+    server = Server(aio.engine(conf))
+    logging.info("Listening on %s", ipc.socket_path())
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
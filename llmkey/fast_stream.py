@@ -0,0 +1,71 @@
+"Read streamed replies straight from the wire without building model objects"
+import json
+
+try:
+    import orjson
+    loads = orjson.loads
+except ImportError:
+    loads = json.loads
+
+
+def sse_line(line, stats):
+    "The content of a line of an openai server sent event stream, and whether the stream is done"
+    if not line.startswith("data:"):
+        return None, False
+
+    data = line[5:].strip()
+    if data == "[DONE]":
+        return None, True
+
+    chunk = loads(data)
+    if stats is not None and chunk.get("usage"):
+        stats["usage"] = chunk["usage"]
+    choices = chunk.get("choices")
+    if not choices:
+        return None, False
+    return choices[0].get("delta", {}).get("content"), False
+
+
+def ndjson_line(line, stats):
+    "The content of a line of an ollama NDJSON stream, and whether the stream is done"
+    if not line:
+        return None, False
+
+    chunk = loads(line)
+    if "error" in chunk:
+        raise Exception(chunk["error"])
+
+    done = chunk.get("done")
+    if done and stats is not None:
+        stats.update(chunk)
+    return chunk.get("message", {}).get("content"), done
+
+
+def contents(lines, parse, stats=None):
+    "Content from lines parsed with parse"
+    for line in lines:
+        content, done = parse(line, stats)
+        if content:
+            yield content
+        if done:
+            return
+
+
+async def acontents(lines, parse, stats=None):
+    "contents for an async iterator of lines"
+    async for line in lines:
+        content, done = parse(line, stats)
+        if content:
+            yield content
+        if done:
+            return
+
+
+def sse_content(lines, stats=None):
+    "Content from the lines of an openai server sent event stream. Token usage is put in stats"
+    return contents(lines, sse_line, stats)
+
+
+def ndjson_content(lines, stats=None):
+    "Content from the lines of an ollama NDJSON stream. The final counters are put in stats"
+    return contents(lines, ndjson_line, stats)
@@ -6,7 +6,7 @@ from tkhtmlview import HTMLLabel
 from . import tk_tools
 
 def first_run():
-    window = tk.Tk()
+    window = tk_tools.window()
     window.title("LLM Key")
     frame = tk.Frame(window, borderwidth=25)
     frame.pack(expand=True, fill="both")
@@ -59,4 +59,4 @@ If you find this tool useful, you can:
     return window
 
 if __name__ == '__main__':
-    first_run().mainloop()
+    tk_tools.wait(first_run())
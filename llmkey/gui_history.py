@@ -0,0 +1,74 @@
+"A window to search past prompts and replies and reopen them"
+import time
+import tkinter as tk
+
+from . import history, tk_tools
+
+# Wait for typing to pause before searching
+SEARCH_MS = 50
+
+def describe(entry):
+    when = time.strftime("%Y-%m-%d %H:%M", time.localtime(entry.created))
+    prompt = " ".join(entry.prompt.split())
+    return f"{when} {entry.model}: {prompt[:100]}"
+
+def search(bus):
+    "Enter or double click opens the reply, by sending <<history_open>> with the entry id"
+    store = history.get_history()
+    window = tk_tools.window()
+    window.title("LLM history")
+    window.minsize(600, 400)
+
+    query = tk.Entry(window)
+    query.pack(fill="x", padx=10, pady=(10, 0))
+    results = tk.Listbox(window, activestyle="dotbox")
+    results.pack(fill="both", expand=1, padx=10, pady=10)
+    status = tk.Label(window, anchor="w")
+    status.pack(fill="x", padx=10, pady=(0, 10))
+    state = dict(entries=[], pending=None)
+
+    def update():
+        state["pending"] = None
+        start = time.time()
+        state["entries"] = store.search(query.get())
+        duration = time.time() - start
+        results.delete(0, "end")
+        for entry in state["entries"]:
+            results.insert("end", describe(entry))
+        if state["entries"]:
+            results.selection_set(0)
+        status["text"] = f"{len(state['entries'])} results in {duration * 1000:.0f}ms"
+
+    def typed(_):
+        if state["pending"] is not None:
+            window.after_cancel(state["pending"])
+        state["pending"] = window.after(SEARCH_MS, update)
+
+    def move(step):
+        def inner(_):
+            if not state["entries"]:
+                return "break"
+            current = results.curselection()
+            index = min(max((current[0] if current else -1) + step, 0), len(state["entries"]) - 1)
+            results.selection_clear(0, "end")
+            results.selection_set(index)
+            results.see(index)
+            return "break"
+        return inner
+
+    def open_entry(*_):
+        selected = results.curselection()
+        if selected:
+            bus.send("<<history_open>>", data=state["entries"][selected[0]].id)
+            window.destroy()
+
+    query.bind("<KeyRelease>", typed)
+    query.bind("<Down>", move(1))
+    query.bind("<Up>", move(-1))
+    window.bind("<Return>", open_entry)
+    results.bind("<Double-Button-1>", open_entry)
+    window.bind("<Escape>", tk_tools.drop_args(window.destroy))
+
+    update()
+    query.focus_force()
+    return window
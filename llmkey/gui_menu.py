@@ -1,12 +1,12 @@
 import tkinter as tk
 
-from . import tk_tools, llm, gui_settings
+from . import breaker, tk_tools, llm, gui_settings, cache
 from .gui_status import show_errors
 
 def menu(bus, running, conf):
     #pylint: disable=too-many-locals,too-many-statements
     conf.load()
-    window = tk.Tk()
+    window = tk_tools.window()
     window.title("LLM Popup")
 
     frame = tk.Frame(window, borderwidth=25)
@@ -17,9 +17,42 @@ def menu(bus, running, conf):
         bus.send("<<cancel>>")
         window.destroy()
 
-    tk.Label(frame, text="Running..." if running else "No query running").pack(anchor="w")
+    if not running:
+        summary = "No query running"
+    elif len(running) == 1:
+        summary = "1 query running"
+    else:
+        summary = f"{len(running)} queries running"
+    tk.Label(frame, text=summary).pack(anchor="w")
 
-    b = tk.Button(frame, text="Cancel current query (x)")
+    @show_errors
+    def send(event, query_id):
+        bus.send(event, data=query_id)
+        window.destroy()
+
+    # Latest first, as the keys below act on the latest query
+    for query in reversed(running):
+        row = tk.Frame(frame)
+        row.pack(fill="x")
+        prompt = " ".join(query.prompt.split())
+        tk.Label(row, text=f"{query.backend} {query.model}: {prompt[:40]}").pack(side=tk.LEFT)
+        for text, event in [("Cancel", "<<cancel>>"), ("Peek", "<<peek>>")]:
+            b = tk.Button(row, text=text)
+            b.pack(side=tk.RIGHT)
+            tk_tools.bind_click(b, lambda _, event=event, query_id=query.id: send(event, query_id))
+    tk.Label(frame, text=cache.get_cache().stats).pack(anchor="w")
+    tk.Label(frame, text=breaker.summary()).pack(anchor="w")
+
+    @show_errors
+    def status(*_):
+        bus.send("<<status>>")
+        window.destroy()
+    b = tk.Button(frame, text="Status of running queries (r)")
+    b.pack(fill="both")
+    tk_tools.bind_click(b, status)
+    window.bind("r", status)
+
+    b = tk.Button(frame, text="Cancel latest query (x)")
     b.pack(fill="both")
     tk_tools.bind_click(b, cancel)
     window.bind("c", cancel)
@@ -52,6 +85,33 @@ def menu(bus, running, conf):
     tk_tools.bind_click(p, close_last)
     window.bind("d", close_last)
 
+    @show_errors
+    def search_history(*_):
+        bus.send("<<history>>")
+        window.destroy()
+    p = tk.Button(frame, text="Search past replies (h)")
+    p.pack(fill="both")
+    tk_tools.bind_click(p, search_history)
+    window.bind("h", search_history)
+
+    @show_errors
+    def each_line(*_):
+        bus.send("<<each_line>>")
+        window.destroy()
+    p = tk.Button(frame, text="Run a command on each line of the clipboard (e)")
+    p.pack(fill="both")
+    tk_tools.bind_click(p, each_line)
+    window.bind("e", each_line)
+
+    @show_errors
+    def export_timings(*_):
+        bus.send("<<export_timings>>")
+        window.destroy()
+    p = tk.Button(frame, text="Export query timings (t)")
+    p.pack(fill="both")
+    tk_tools.bind_click(p, export_timings)
+    window.bind("t", export_timings)
+
     @show_errors
     def change_backend(*_):
         conf.load()
@@ -61,7 +121,7 @@ def menu(bus, running, conf):
         update_model()
 
     def update_model():
-        model_label["text"] = "Model: " + get_model(conf)
+        model_label["text"] = f"Model: {get_model(conf)}"
 
     @show_errors
     def format_backend():
@@ -108,7 +168,7 @@ def menu(bus, running, conf):
 
     @show_errors
     def quit_app(*_):
-        root.event_generate("<<quit>>")
+        bus.send("<<quit>>")
     b = tk.Button(frame, text="Quit app (Q)")
     b.pack(fill="both")
     tk_tools.bind_click(b, quit_app)
@@ -124,10 +184,11 @@ def menu(bus, running, conf):
     ok = tk.Button(ok_button_frame, takefocus=tk.YES, text="OK")
     ok.pack(side=tk.LEFT, pady=10, padx=10)
     tk_tools.bind_click(ok, lambda *_: window.destroy())
+    return window
 
 def get_model(conf):
     backend = get_backend(conf)
-    return conf.backend_models.get(backend.name, backend.default_model)
+    return conf.backend_models.get(backend.name) or backend.default_model
 
 def get_backend(conf):
     return llm.get(conf.backend or "openai")
@@ -136,13 +197,8 @@ if __name__ == '__main__':
     from . import config
     from . import bus
     def main():
-        root = tk.Tk()
-        root.withdraw()
-
         conf = {}
         store = config.mock_config(conf)
-        bus = bus.MockBus()
-        menu(bus, False, store)
-        root.mainloop()
+        tk_tools.wait(menu(bus.MockBus(), [], store))
 
     main()
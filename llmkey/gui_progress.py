@@ -0,0 +1,48 @@
+"A window showing how far a job of several queries has got"
+import tkinter as tk
+
+from . import tk_tools
+
+POLL_MS = 250
+
+def progress(job):
+    "job has progress() lines, finished and cancel()"
+    window = tk_tools.window()
+    window.title("LLM reading in parts")
+    window.closed = False
+
+    label = tk.Label(window, justify="left", anchor="w", font="TkFixedFont")
+    label.pack(fill="both", expand=1, padx=10, pady=10)
+
+    buttons = tk.Frame(window)
+    buttons.pack(pady=(0, 10))
+    hide = tk.Button(buttons, takefocus=tk.YES, text="Hide")
+    hide.pack(side="left")
+    cancel = tk.Button(buttons, text="Cancel (x)")
+    cancel.pack(side="left", padx=(10, 0))
+
+    def close(*_):
+        window.closed = True
+        window.destroy()
+
+    def cancel_job(*_):
+        job.cancel()
+        close()
+
+    tk_tools.bind_click(hide, close)
+    tk_tools.bind_click(cancel, cancel_job)
+    window.bind("<Return>", close)
+    window.bind("x", cancel_job)
+    window.protocol("WM_DELETE_WINDOW", close)
+
+    def poll():
+        if window.closed:
+            return
+        label["text"] = "\n".join(job.progress())
+        if job.finished:
+            close()
+            return
+        window.after(POLL_MS, poll)
+
+    poll()
+    return window
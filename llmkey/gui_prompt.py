@@ -10,7 +10,8 @@ Version |release|
 import tkinter as tk  # python 3
 import tkinter.font as tk_Font
 
-import pyperclip
+from . import tk_tools
+
 
 STANDARD_SELECTION_EVENTS = ["Return", "space"]
 STANDARD_SELECTION_EVENTS_MOUSE = ["Enter", "Leave", "ButtonRelease-1"]
@@ -109,6 +110,7 @@ class TextBox(object):
         """
 
         self.callback = callback
+        self.bypass_cache = False
         self.ui = GUItk(msg, title, text, codebox, self.callback_ui)
         self.text = text
         if pos:
@@ -127,8 +129,9 @@ class TextBox(object):
     def callback_ui(self, ui, command, text):
         """ This method is executed when ok, cancel, or x is pressed in the ui.
         """
-        if command == 'update':  # OK was pressed
+        if command in ('update', 'update_bypass_cache'):  # OK was pressed
             self._text = text
+            self.bypass_cache = command == 'update_bypass_cache'
             if self.callback:
                 # If a callback was set, call main process
                 self.callback(self)
@@ -220,7 +223,7 @@ class GUItk(object):
 
         self.callback = callback
 
-        self.boxRoot = tk.Tk()
+        self.boxRoot = tk_tools.window()
         # self.boxFont = tk_Font.Font(
         #     family=global_state.PROPORTIONAL_FONT_FAMILY,
         #     size=global_state.PROPORTIONAL_FONT_SIZE)
@@ -250,13 +253,13 @@ class GUItk(object):
     # Run and stop methods ---------------------------------------
 
     def run(self):
-        self.boxRoot.mainloop()
-        self.boxRoot.destroy()
+        # Other windows keep working while we wait
+        tk_tools.wait(self.boxRoot)
 
     def stop(self):
         # Get the current position before quitting
         self.get_pos()
-        self.boxRoot.quit()
+        self.boxRoot.destroy()
 
     # Methods to change content ---------------------------------------
 
@@ -266,10 +269,10 @@ class GUItk(object):
         self.messageArea.insert(tk.END, msg)
         self.messageArea.config(state=tk.DISABLED)
         # Adjust msg height
-        self.messageArea.update()
+        self.messageArea.update_idletasks()
         numlines = self.get_num_lines(self.messageArea)
         self.set_msg_height(numlines)
-        self.messageArea.update()
+        self.messageArea.update_idletasks()
 
     def set_msg_height(self, numlines):
         self.messageArea.configure(height=numlines)
@@ -307,6 +310,10 @@ class GUItk(object):
     def ok_button_pressed(self, event):
         self.callback(self, command='update', text=self.get_text())
 
+    def bypass_cache_pressed(self, event):
+        self.callback(self, command='update_bypass_cache', text=self.get_text())
+        return "break"
+
     # Auxiliary methods -----------------------------------------------
     def calc_character_width(self):
         char_width = self.boxFont.measure('W')
@@ -392,6 +399,7 @@ class GUItk(object):
         self.boxRoot.bind("<Up>", self.textArea.yview_scroll(-1, tk.UNITS))
 
         self.textArea.bind("<Shift-Return>", self.ok_button_pressed)
+        self.textArea.bind("<Control-Shift-Return>", self.bypass_cache_pressed)
 
         # add a vertical scrollbar to the frame
         rightScrollbar = tk.Scrollbar(
@@ -453,24 +461,109 @@ class GUItk(object):
         for selectionEvent in STANDARD_SELECTION_EVENTS_MOUSE:
             self.okButton.bind("<%s>" % selectionEvent, mouse_handlers[selectionEvent])
 
-def prompt_one_off(backend, model):
+class Dialog:
+    "A prompt window which is built once, then hidden after each prompt and shown again for the next"
+
+    def __init__(self):
+        self.on_result = None
+        # Escape is bound on both the window and the cancel button, so one press can finish twice
+        self.free = True
+        self.ui = GUItk("", "", "", False, self.callback_ui)
+        self.ui.boxRoot.withdraw()
+
+    def show(self, msg, title, text, on_result, pos=None):
+        self.free = False
+        self.on_result = on_result
+        self.ui.boxRoot.title(title)
+        self.ui.set_msg(msg)
+        self.ui.set_text(text)
+        self.ui.textArea.mark_set("insert", pos or "end")
+        self.ui.textArea.see("insert")
+        self.ui.boxRoot.deiconify()
+        self.ui.textArea.focus_force()
+
+    def callback_ui(self, ui, command, text):
+        del ui
+        if self.free:
+            return
+        self.free = True
+        if command in ('update', 'update_bypass_cache'):
+            result = text, command == 'update_bypass_cache'
+        else:
+            result = None
+        self.ui.boxRoot.withdraw()
+        on_result, self.on_result = self.on_result, None
+        FREE_DIALOGS.append(self)
+        if on_result:
+            on_result(result)
+
+
+# Hidden dialogs ready to be shown. More are built if several prompts are open at once
+FREE_DIALOGS = []
+
+def prebuild():
+    "Build a dialog ahead of the first hotkey"
+    if not FREE_DIALOGS:
+        FREE_DIALOGS.append(Dialog())
+
+def prompt(msg, title, text, on_result, pos=None):
+    "Calls on_result with (text, bypass_cache), or None if cancelled"
+    dialog = FREE_DIALOGS.pop() if FREE_DIALOGS else Dialog()
+    dialog.show(msg, title, text, on_result, pos)
+    return dialog
+
+
+def prompt_one_off(backend, model, on_result):
     title = "One-off LLM Prompt"
     text = ""
     msg = \
-f"""Using {model} on {backend}
+f"""Using {model or "the first model"} on {backend}
 
 Enter a one-off LLM prompt then press shift-enter.
-Esc to cancel.
+Ctrl-shift-enter skips the cache. Esc to cancel.
+"""
+    return prompt(msg, title, text, on_result)
+
+
+def prompt_follow_up(query, on_result):
+    title = "Follow up LLM Prompt"
+    msg = \
+f"""Following up with {query.model} on {query.backend}. This is turn {len(query.history) + 2}.
+
+Enter a prompt then press shift-enter. Esc to cancel.
+"""
+    return prompt(msg, title, "", on_result)
+
+
+def prompt_clipboard_chunked(clipboard, chunks, on_result):
+    title = "Clipboard one-off LLM Prompt"
+    msg = \
+f"""The clipboard is too long for one prompt ({len(clipboard)} characters).
+Your command will be run on {chunks} parts of it at once, and the answers combined.
+
+Type a command then press shift-enter. Esc to cancel.
+"""
+    return prompt(msg, title, "", on_result)
+
+
+def prompt_each_line(count, on_result):
+    title = "LLM Prompt for each line"
+    msg = \
+f"""Type a command to run on each of the {count} lines of the clipboard.
+The answers are copied to the clipboard, one line for each.
+
+Press shift-enter when done. Esc to cancel.
 """
-    return textbox(msg, title, text)
+    return prompt(msg, title, "", on_result)
 
 
-def prompt_clipboard():
+def prompt_clipboard(clipboard, on_result):
     title = "Clipboard one-off LLM Prompt"
-    text = "\n\n" + pyperclip.paste()
-    msg = "Type a command to run against the clipboard"
-    return textbox(msg, title, text, pos="1.0")
+    text = "\n\n" + clipboard
+    msg = "Type a command to run against the clipboard.\nCtrl-shift-enter skips the cache."
+    return prompt(msg, title, text, on_result, pos="1.0")
 
 
 if __name__ == '__main__':
-    prompt_one_off("MODEL")
+    prompt_one_off("BACKEND", "MODEL", lambda result: (print(result), tk_tools.root().quit()))
+    tk_tools.root().mainloop()
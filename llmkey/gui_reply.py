@@ -1,29 +1,114 @@
-import textwrap
+import time
 import tkinter as tk
 import uuid
 
 from . import tk_tools
 
-def reply(bus, duration, s):
-    s = textwrap.fill(s, 120, replace_whitespace=False)
-    s = f"This query took {duration:.1f}s.\nThis answer has been written to the clipboard.\n\n" + s
+# Write streamed chunks into the window at most once per frame
+FRAME_MS = 16
 
-    window = tk.Tk()
+def finished_header(query):
+    if query.cached:
+        took = "This answer came from the cache."
+    else:
+        took = f"This query took {query.duration:.1f}s: {query.timing.summary()}."
+    return f"{took}\nThis answer has been written to the clipboard."
+
+def peek_header(query):
+    return f"Peeking after {query.duration:.1f}s: {query.timing.summary()}."
+
+def reply(bus, header, s, query=None, id_=None):
+    window = reply_window(bus, query, id_)
+    window.header["text"] = header
+    append_text(window, s)
+    return window
+
+def stream_reply(bus, query):
+    "A reply window which shows the query as it streams in"
+    window = reply_window(bus, query)
+    window.streaming = True
+    window.header["text"] = "Streaming reply..."
+    state = dict(index=0, done=False)
+
+    def flush():
+        end = len(query.reply_buffer)
+        if end > state["index"]:
+            new = "".join(query.reply_buffer[state["index"]:end])
+            state["index"] = end
+            append_text(window, new)
+
+    def poll():
+        if window.closed or state["done"]:
+            return
+
+        flush()
+        if query.cancelled:
+            window.streaming = False
+            window.header["text"] = "This query was cancelled."
+            window.title("LLM reply")
+            bus.send("<<reply_streamed>>", data=dict(id=window.id))
+            return
+
+        duration = time.time() - query.start if query.start else 0
+        if duration:
+            window.title(f"LLM reply - {query.bytes / duration:.0f} bytes/s")
+        window.after(FRAME_MS, poll)
+
+    def finish(header):
+        if window.closed:
+            return
+        state["done"] = True
+        window.streaming = False
+        flush()
+        window.header["text"] = header
+        window.title("LLM reply")
+        # It can be hibernated now
+        bus.send("<<reply_streamed>>", data=dict(id=window.id))
+
+    window.finish = finish
+    poll()
+    return window
+
+def append_text(window, s):
+    following = window.reply_text.yview()[1] == 1.0
+    window.reply_text.configure(state="normal")
+    window.reply_text.insert("end", s)
+    window.reply_text.configure(state="disabled")
+    if following:
+        window.reply_text.see("end")
+
+def reply_window(bus, query=None, id_=None):
+    "query is the query shown, so that it can be followed up"
+    window = tk_tools.window()
     window.closed = False
-    window.id = str(uuid.uuid4())
+    window.streaming = False
+    window.id = id_ or str(uuid.uuid4())
+    window.query = query
     window.title("LLM reply")
     window.minsize(400, 400)
 
     frame = tk.Frame(window, width=600)
     frame.pack(expand=1, fill="both")
 
-    reply_text = tk.Text(frame)
-    reply_text.pack(expand=1, fill="both", padx=10, pady=10)
-    reply_text.insert("1.0", s)
-    reply_text.configure(state="disabled")
+    window.header = tk.Label(frame, justify="left", anchor="w")
+    window.header.pack(fill="x", padx=10, pady=(10, 0))
+
+    window.reply_text = tk.Text(frame, width=120, wrap="word")
+    window.reply_text.pack(expand=1, fill="both", padx=10, pady=10)
+    window.reply_text.configure(state="disabled")
+
+    buttons = tk.Frame(frame)
+    buttons.pack()
+    ok = tk.Button(buttons, takefocus=tk.YES, text="OK")
+    ok.pack(side="left")
 
-    ok = tk.Button(frame, takefocus=tk.YES, text="OK")
-    ok.pack()
+    if query is not None:
+        def follow_up(*_):
+            bus.send("<<follow_up>>", data=query)
+        follow = tk.Button(buttons, text="Follow up (f)")
+        follow.pack(side="left", padx=(10, 0))
+        tk_tools.bind_click(follow, follow_up)
+        window.bind("f", follow_up)
 
     def destroy(*_):
         bus.send("<<reply_closed>>", data=dict(id=window.id))
@@ -33,11 +118,12 @@ def reply(bus, duration, s):
     tk_tools.bind_click(ok, destroy)
     window.bind("<Return>", destroy)
     window.bind("<Shift-Return>", destroy)
+    window.protocol("WM_DELETE_WINDOW", destroy)
     return window
 
 
 if __name__ == "__main__":
     def main():
         from . import bus
-        reply(bus.MockBus(), 10, "This is a message").mainloop()
+        tk_tools.wait(reply(bus.MockBus(), "header", "This is a message"))
     main()
@@ -22,7 +22,7 @@ def settings():
 
 class Settings:
     def __init__(self):
-        self.window: O[tk.Tk]   = None
+        self.window: O[tk.Toplevel]   = None
         self.conf: O[Conf]  = None
         self.state: O[State]   = None
         self.gui: O[Gui] = None
@@ -33,7 +33,7 @@ class Settings:
         self.conf.load()
         self.conf.backend = self.conf.backend or llm.Backends.default
 
-        self.window = tk.Tk()
+        self.window = tk_tools.window()
         self.state = State(self.window)
         self.state.load(self.conf)
 
@@ -56,6 +56,8 @@ class Logic:
         self.gui = gui
         self.state = state
         self.conf = conf
+        # The after call filling the model menu again once a refresh is done
+        self.pending = None
 
     def bind(self):
         tk_tools.bind_click(self.gui.ok, self.close)
@@ -90,19 +92,26 @@ class Logic:
         self.conf.load()
 
         backend = llm.get(self.conf.backend)
-
-        try:
-            models = backend.models
-        except errors.NoKey:
-            logging.exception("no key")
-            models = ["no key provided"]
-        except openai.AuthentificationError:
-            logging.exception("Key is wrong")
-            models = ["key is incorrect"]
+        models = backend.models
+        if self.pending is not None:
+            self.window.after_cancel(self.pending)
+            self.pending = None
+        if backend.catalog.refreshing:
+            # Fill the menu again once the background refresh is done
+            self.pending = self.window.after(500, self.update_models)
+        model = self.conf.backend_models.get(backend.name) or backend.default_model
+
+        if not models:
+            error = backend.catalog.error
+            if backend.catalog.refreshing:
+                models = ["loading..."]
+            elif isinstance(error, errors.NoKey):
+                models = ["no key provided"]
+            elif isinstance(error, openai.AuthenticationError):
+                models = ["key is incorrect"]
 
         fill_menu(self.gui.model, self.state.model_var, models, self.model_changed)
-        model = self.conf.backend_models.get(backend.name, backend.default_model)
-        self.state.model_var.set(model)
+        self.state.model_var.set(model or "")
 
 
     def key_changed(self, *_):
@@ -111,6 +120,7 @@ class Logic:
 
         self.conf.backend_keys[self.conf.backend] = self.state.key_variable.get()
         self.conf.save()
+        llm.get(self.conf.backend).invalidate()
         self.update_models()
 
 
@@ -124,6 +134,9 @@ class Logic:
     def close(self, *_):
         global SETTINGS #pylint: disable=global-statement
         SETTINGS = None
+        if self.pending is not None:
+            self.window.after_cancel(self.pending)
+            self.pending = None
         self.window.destroy()
 
     def assert_backend_unchanged(self):
@@ -206,4 +219,5 @@ class Gui:
 
 
 if __name__ == "__main__":
-    settings().mainloop()
+    settings()
+    tk_tools.wait(SETTINGS.window)
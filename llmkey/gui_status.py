@@ -7,7 +7,7 @@ from .tk_tools import drop_args
 
 
 def private_status_window(title, text):
-    window = tk.Tk()
+    window = tk_tools.window()
     window.title(title)
     window.geometry("400x200")
 
@@ -27,16 +27,25 @@ def private_status_window(title, text):
     return window
 
 
-def running(count, duration):
+def running(queries, queued=0):
+    if not queries:
+        return not_running()
+
+    lines = [f"{q.backend} {q.model} for {q.duration:.1f}s: {q.timing.summary()}" for q in queries]
+    if queued:
+        lines.append(f"{queued} queued")
     return private_status_window(
         "LLM already running",
-        f"A query is already running.\n{count} bytes in {duration:.1f}s")
+        f"{len(queries)} queries running.\n" + "\n".join(lines))
 
 
 def not_running():
     return private_status_window("LLM is not running",
                           "No query is running")
 
+def info(title, s):
+    return private_status_window(title, s)
+
 def warn(s):
     return private_status_window("Warning", s)
 
@@ -60,4 +69,4 @@ def show_errors(f: Callable[P, T]) -> Callable[P, T]:
     return inner
 
 if __name__ == '__main__':
-    running().mainloop()
+    tk_tools.wait(running([]))
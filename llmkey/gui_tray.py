@@ -3,21 +3,27 @@ import pathlib
 import pystray
 from pystray import MenuItem
 import PIL.Image
-import tkinter as tk
 
 HERE = (pathlib.Path(__file__) / "..").resolve()
 
 class Tray:
-    def __init__(self, tk_root:tk.Tk):
-        self.tk_root = tk_root
+    def __init__(self, bus):
+        self.bus = bus
         self._icon = None
         self.status = "No query Running"
+        self.health = ""
         self._menu = None
 
     def set_status(self, s):
         self.status = s
         self._icon.update_menu()
 
+    def set_health(self, s):
+        "Show which backends are down"
+        self.health = s
+        if self._icon:
+            self._icon.update_menu()
+
     def run(self):
         image = PIL.Image.open(HERE / "icon.ico")
 
@@ -27,6 +33,7 @@ class Tray:
 
         menu = (
             MenuItem(status, lambda: None),
+            MenuItem(lambda *_: self.health, lambda: None, visible=lambda *_: bool(self.health)),
             MenuItem('Ctrl-Alt-O runs a one-off query', lambda: None),
             MenuItem('Ctrl-Alt-C runs a one-off query on what is in the clipboard', lambda: None),
             MenuItem('Ctrl-Alt-M opens a menu of other commands with keybindings', lambda: None),
@@ -37,4 +44,4 @@ class Tray:
         self._icon.run()
 
     def send_event(self, event):
-        self.tk_root.event_generate(event)
+        self.bus.send(event)
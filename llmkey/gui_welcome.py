@@ -1,6 +1,8 @@
 
 import tkinter as tk
 
+from . import tk_tools
+
 TEXT = """
 
 This is LLM Popup. A desktop integration of LLMs designed for linux.
@@ -13,7 +15,7 @@ To configure and control click on the "L" icon in the system tray. This will rem
 """
 
 def welcome():
-    window = tk.Tk()
+    window = tk_tools.window()
     window.title("About LLMPopup")
 
 
@@ -25,4 +27,4 @@ def welcome():
 
 
 if __name__ == '__main__':
-    welcome().mainloop()
+    tk_tools.wait(welcome())
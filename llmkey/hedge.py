@@ -0,0 +1,181 @@
+"Race or hedge a prompt across several backends and stream whichever answers first"
+import logging
+import queue
+import time
+
+from . import llm, timing
+
+# Used until we have enough timings to learn when to hedge
+HEDGE_DELAY = 2.0
+MIN_RECORDS = 10
+
+def ttft_percentile(backend, model, p):
+    "p-th percentile of recent times to first token for model. None without enough timings"
+    values = [
+        record.time_to_first_token for record in list(timing.RECORDS)
+        if record.backend == backend and record.model == model and record.race is None
+        and record.time_to_first_token is not None]
+    if len(values) < MIN_RECORDS:
+        return None
+    return timing.percentile(values, p)
+
+def hedge_delay(backend, model, p):
+    "How long to wait for a first token before starting a backup"
+    learned = ttft_percentile(backend, model, p)
+    return HEDGE_DELAY if learned is None else learned
+
+
+class Candidate:
+    def __init__(self, backend, model, prompt):
+        self.name = f"{backend.name}/{model}"
+        self.query = backend.query(model, prompt)
+        self.expected = ttft_percentile(backend.name, model, 50)
+        self.started = None
+        self.state = "not started"
+
+    def stop(self, pool):
+        pool.cancel(self.query)
+
+
+class RaceStream(llm.ResponseStream):
+    """Streams the first candidate to produce a token and cancels the rest.
+    Candidate i is only sent delays[i] seconds in, so all zeros is a race.
+    Candidates go through the pool, so its limits apply to them"""
+    runs_queries = True
+
+    def __init__(self, candidates, delays, mode):
+        self.candidates = candidates
+        self.delays = delays
+        self.mode = mode
+        self.events = queue.SimpleQueue()
+        self.winner = None
+        # The query made from this stream, which takes the winner's backend and model
+        self.query = None
+
+    def __iter__(self):
+        start = time.time()
+        waiting = list(zip(self.delays, self.candidates))
+        running = 0
+        try:
+            while True:
+                timeout = None
+                if self.winner is None:
+                    while waiting and start + waiting[0][0] <= time.time():
+                        self.send(waiting.pop(0)[1], start)
+                        running += 1
+                    if waiting:
+                        timeout = max(start + waiting[0][0] - time.time(), 0)
+
+                try:
+                    kind, candidate, value = self.events.get(timeout=timeout)
+                except queue.Empty:
+                    continue
+
+                if self.hung_up:
+                    return
+
+                if self.winner is None:
+                    if kind == "chunk":
+                        self.won(candidate, start)
+                    else:
+                        # Lost before it started. Send the next one now rather than waiting
+                        candidate.state = "failed" if kind == "failed" else "empty"
+                        running -= 1
+                        if waiting:
+                            self.send(waiting.pop(0)[1], start)
+                            running += 1
+                        elif not running:
+                            if kind == "failed":
+                                raise value
+                            return
+                        continue
+
+                if candidate is not self.winner:
+                    continue
+                if kind == "chunk":
+                    yield value
+                elif kind == "failed":
+                    raise value
+                else:
+                    return
+        finally:
+            for candidate in self.candidates:
+                if candidate is not self.winner or self.hung_up:
+                    candidate.stop(self.pool)
+
+    def send(self, candidate, start):
+        candidate.started = time.time() - start
+        candidate.state = "running"
+        candidate.query.on_chunk = lambda chunk: self.events.put(("chunk", candidate, chunk))
+        self.pool.submit(candidate.query, lambda query: self.events.put(self.outcome(candidate)))
+
+    @staticmethod
+    def outcome(candidate):
+        query = candidate.query
+        if query.error is not None:
+            return ("failed", candidate, RuntimeError(f"{candidate.name} failed: {query.error}"))
+        if query.cancelled and not query.finished:
+            return ("failed", candidate, RuntimeError(f"{candidate.name} was cancelled"))
+        return ("done", candidate, None)
+
+    def won(self, candidate, start):
+        self.winner = candidate
+        candidate.state = "won"
+        first_token = time.time() - start
+        for loser in self.candidates:
+            if loser is not candidate and loser.state == "running":
+                loser.state = "cancelled"
+                loser.stop(self.pool)
+
+        if self.query is not None:
+            # Cache and history should have who actually answered
+            winner = candidate.query
+            self.query.backend = self.query.timing.backend = winner.backend
+            self.query.model = self.query.timing.model = winner.model
+        self.connected(candidate.query.stream.headers)
+        # The losers never answered, so compare with how fast they usually are
+        margins = [
+            loser.started + loser.expected - first_token for loser in self.candidates
+            if loser.state == "cancelled" and loser.expected is not None]
+        if self.timing:
+            self.timing.race = dict(
+                mode=self.mode,
+                winner=candidate.name,
+                time_to_first_token=first_token,
+                margin=min(margins, default=None),
+                candidates=[
+                    dict(name=c.name, started=c.started, state=c.state, expected=c.expected)
+                    for c in self.candidates])
+        logging.info("%s won the %s after %.2fs", candidate.name, self.mode, first_token)
+
+    def hang_up(self):
+        self.hung_up = True
+        self.events.put(("hung_up", None, None))
+
+    def close(self):
+        self.hang_up()
+
+
+def query(primary, model, prompt, others, mode, percentile=90):
+    """Query model on the primary backend and the (backend, model) pairs in others.
+    mode is race or hedge"""
+    candidates = [Candidate(primary, model, prompt)]
+    candidates += [Candidate(backend, m, prompt) for backend, m in others]
+    if mode == "race":
+        delays = [0] * len(candidates)
+    else:
+        delay = hedge_delay(primary.name, model, percentile)
+        delays = [i * delay for i in range(len(candidates))]
+    stream = RaceStream(candidates, delays, mode)
+    stream.query = llm.LlmQuery(stream, backend=primary.name, model=model, prompt=prompt)
+    return stream.query
+
+def others(conf, backend, model):
+    "The race candidates in conf other than backend and model"
+    result = []
+    for name, other_model in conf.race_candidates:
+        if name not in llm.MODEL_CLASSES:
+            logging.warning("Unknown backend %s in race_candidates", name)
+        elif (name, other_model) != (backend.name, model):
+            result.append((llm.get(name), other_model))
+    return result
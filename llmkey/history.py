@@ -0,0 +1,131 @@
+"""Every prompt and reply, kept in sqlite with a full text index so past answers
+can be found and reopened without asking again"""
+import collections
+import json
+import logging
+import queue
+import sqlite3
+import threading
+import time
+
+from . import config
+
+HISTORY = None
+
+# Search results shown at once
+LIMIT = 50
+
+Entry = collections.namedtuple("Entry", "id created backend model prompt reply timing")
+
+def get_history():
+    global HISTORY #pylint: disable=global-statement
+    if HISTORY is None:
+        conf = config.Config()
+        conf.io.ensure_dir()
+        HISTORY = HistoryStore(config.ConfigIO.dir() / "history.sqlite")
+    return HISTORY
+
+def match_expression(text):
+    "Each word the user typed as a quoted prefix, so punctuation is not read as query syntax"
+    words = text.split()
+    return " ".join('"' + word.replace('"', '""') + '"*' for word in words)
+
+
+class HistoryStore:
+    "Append only. Writes are queued to a thread of their own so they never hold up the tk thread"
+
+    def __init__(self, path):
+        self.path = str(path)
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(self.path, check_same_thread=False)
+        # Readers are not blocked by the writer
+        self.db.execute("pragma journal_mode=wal")
+        self.db.execute(
+            "create table if not exists entries "
+            "(id integer primary key, created real, backend text, model text, "
+            "prompt text, reply text, timing text)")
+        try:
+            self.db.execute(
+                "create virtual table if not exists entries_fts using fts5"
+                "(prompt, reply, content='entries', content_rowid='id')")
+            self.fts = True
+        except sqlite3.OperationalError:
+            logging.warning("This sqlite has no full text search. Searching history will be slow")
+            self.fts = False
+        self.db.commit()
+
+        self.writes = queue.SimpleQueue()
+        thread = threading.Thread(target=self.write_loop)
+        thread.daemon = True
+        thread.start()
+
+    def add(self, query):
+        "Queue a finished query to be written"
+        self.writes.put((
+            time.time(), query.backend, query.model, str(query.prompt), query.reply,
+            json.dumps(query.timing.as_dict())))
+
+    def flush(self):
+        "Wait for queued writes"
+        written = threading.Event()
+        self.writes.put(written)
+        written.wait()
+
+    def write_loop(self):
+        db = sqlite3.connect(self.path)
+        while True:
+            items = [self.writes.get()]
+            # Write whatever else has queued up in the same transaction
+            while True:
+                try:
+                    items.append(self.writes.get_nowait())
+                except queue.Empty:
+                    break
+
+            rows = [item for item in items if not isinstance(item, threading.Event)]
+            try:
+                with db:
+                    for row in rows:
+                        cursor = db.execute(
+                            "insert into entries (created, backend, model, prompt, reply, timing) "
+                            "values (?, ?, ?, ?, ?, ?)", row)
+                        if self.fts:
+                            db.execute(
+                                "insert into entries_fts (rowid, prompt, reply) values (?, ?, ?)",
+                                (cursor.lastrowid, row[3], row[4]))
+            except sqlite3.Error:
+                logging.exception("Could not write %d history entries", len(rows))
+
+            for item in items:
+                if isinstance(item, threading.Event):
+                    item.set()
+
+    def search(self, text, limit=LIMIT):
+        "The most recent entries matching every word in text, without their replies"
+        columns = "e.id, e.created, e.backend, e.model, e.prompt, null, e.timing"
+        with self.lock:
+            if not text.strip():
+                rows = self.db.execute(
+                    f"select {columns} from entries e order by e.id desc limit ?", (limit,))
+            elif self.fts:
+                rows = self.db.execute(
+                    f"select {columns} from entries_fts f join entries e on e.id = f.rowid "
+                    "where entries_fts match ? order by f.rowid desc limit ?",
+                    (match_expression(text), limit))
+            else:
+                like = f"%{text.strip()}%"
+                rows = self.db.execute(
+                    f"select {columns} from entries e where e.prompt like ? or e.reply like ? "
+                    "order by e.id desc limit ?", (like, like, limit))
+            return [Entry(*row) for row in rows.fetchall()]
+
+    def get(self, id_):
+        with self.lock:
+            row = self.db.execute(
+                "select id, created, backend, model, prompt, reply, timing from entries where id = ?",
+                (id_,)).fetchone()
+        return Entry(*row) if row else None
+
+    def count(self):
+        with self.lock:
+            return self.db.execute("select count(*) from entries").fetchone()[0]
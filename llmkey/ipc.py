@@ -0,0 +1,44 @@
+"Talk to a running llm-key over its unix socket. Kept light so clients start quickly"
+import json
+import os
+import socket
+from pathlib import Path
+
+from . import config
+
+def socket_path():
+    runtime_dir = os.environ.get("XDG_RUNTIME_DIR")
+    if runtime_dir:
+        return Path(runtime_dir) / "llmkey.sock"
+    return config.ConfigIO.dir() / "llmkey.sock"
+
+
+class NotRunning(Exception):
+    pass
+
+
+def request(message):
+    "Send message to the running instance and yield each reply"
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(str(socket_path()))
+    except (FileNotFoundError, ConnectionRefusedError) as e:
+        sock.close()
+        raise NotRunning() from e
+
+    with sock, sock.makefile("rwb") as f:
+        f.write(json.dumps(message).encode("utf8") + b"\n")
+        f.flush()
+        for line in f:
+            yield json.loads(line)
+
+def call(message):
+    "Send message and return the single reply"
+    replies = list(request(message))
+    return replies[-1] if replies else {}
+
+def running():
+    try:
+        return call(dict(op="ping")).get("ok", False)
+    except NotRunning:
+        return False
@@ -1,36 +1,109 @@
-
-
 from __future__ import annotations
 
 import abc
+import asyncio
+import os
+import socket
+import threading
 import time
+import uuid
 from typing import Type
 
 
+import httpx
 import ollama
 import openai
 
-from . import credentials, errors
+from . import catalog, config, credentials, errors, fast_stream, prompts, timing
 
 
 class Backend(abc.ABC):
     Stream: Type[ResponseStream]
+    FastStream: Type[ResponseStream]
     name: str
     needs_credentials: bool
+    fast_stream = False
+    # For the clients. Set from the settings by get
+    timeout = None
+    _catalog = None
 
     @abc.abstractmethod
     def next_model(self, current):
         raise NotImplementedError()
 
+    @abc.abstractmethod
+    def fetch_models(self) -> list[str]:
+        "Fetch the model list from the backend. Slow"
+        raise NotImplementedError()
+
+    @property
+    def catalog(self):
+        if self._catalog is None:
+            conf = config.Config()
+            conf.load()
+            self._catalog = catalog.ModelCatalog(self.name, self.fetch_models, conf.models_ttl)
+        return self._catalog
+
+    @property
+    def models(self):
+        return self.catalog.models
+
+    def invalidate(self):
+        "Call when the key changes or models are pulled"
+        self.catalog.invalidate()
+
+    def warm(self, model):
+        "Get ready to answer a query for model soon"
+
+    def cool(self, model):
+        "Undo warm. Used for benchmarks"
+
     @property
     def default_model(self):
+        "Answered at once, so it can be used on the tk thread. None until the models are known"
         raise NotImplementedError()
 
+    def wait_default_model(self):
+        "default_model, waiting for the first model list if need be. Not on the tk thread"
+        return self.default_model
+
     @abc.abstractmethod
-    def query(self, model, message) -> ResponseStream:
+    def query(self, model, message, history=()) -> LlmQuery:
+        "history is the (prompt, reply) turns of the conversation so far"
         raise NotImplementedError()
 
 class ResponseStream(abc.ABC):
+    timing = None
+    headers = None
+    http_response = None
+    hung_up = False
+    # Called with the stream once the headers arrive
+    on_connected = None
+    # Streams made from queries of their own send them to pool, which is set on submit
+    runs_queries = False
+    pool = None
+    # The backend sends its headers before it starts generating, so no headers means it is stuck
+    headers_first = True
+
+    def connected(self, headers=None, http_response=None):
+        "Call once the backend has accepted the request"
+        self.headers = headers
+        self.http_response = http_response
+        if http_response is not None:
+            no_read_timeout(http_response)
+        if self.timing:
+            self.timing.connect()
+        if self.on_connected:
+            self.on_connected(self)
+        if self.hung_up and http_response is not None:
+            hang_up(http_response)
+
+    def hang_up(self):
+        "Cancel from another thread. A blocked read returns at once rather than at the next chunk"
+        self.hung_up = True
+        if self.http_response is not None:
+            hang_up(self.http_response)
+
     @abc.abstractmethod
     def __iter__(self) -> str:
         raise NotImplementedError()
@@ -39,52 +112,214 @@ class ResponseStream(abc.ABC):
     def close():
         raise NotImplementedError()
 
+    async def __aiter__(self):
+        "Streams without an async client read the blocking stream in a thread"
+        chunks = iter(self)
+        done = object()
+        while (chunk := await asyncio.to_thread(next, chunks, done)) is not done:
+            yield chunk
+
+    async def aclose(self):
+        self.close()
+
+# How long ollama keeps a warmed model loaded
+KEEP_ALIVE = "10m"
+# Longer during a conversation, so the model and its cache of the conversation are kept for the next turn
+CONVERSATION_KEEP_ALIVE = "30m"
+
+def hang_up(response):
+    """Shut the socket under an httpx response. Unlike close this is safe
+    from another thread. Ollama stops generating when the client goes away"""
+    stream = response.extensions.get("network_stream")
+    sock = stream.get_extra_info("socket") if stream is not None else None
+    if sock is None:
+        return
+    try:
+        sock.shutdown(socket.SHUT_RDWR)
+    except OSError:
+        pass
+
+def no_read_timeout(response):
+    """Let the rest of response take as long as it likes between chunks.
+    httpx reads the timeout again when it starts on the body"""
+    timeout = response.request.extensions.get("timeout")
+    if timeout is not None:
+        timeout["read"] = None
+
+def http_timeout(conf):
+    "Only connecting is limited. A model can take minutes to load or to think before it answers"
+    return httpx.Timeout(None, connect=conf.connect_timeout or None)
+
 model_cache = {}
 def get(backend):
     if backend not in model_cache:
+        conf = config.Config()
+        conf.load()
         model_cache[backend] = MODEL_CLASSES[backend]()
+        model_cache[backend].fast_stream = conf.fast_stream
+        model_cache[backend].timeout = http_timeout(conf)
 
     return model_cache[backend]
 
+def ollama_host():
+    host = os.environ.get("OLLAMA_HOST", "127.0.0.1:11434")
+    return host if "://" in host else "http://" + host
+
 
 class OllamaBackend(Backend):
     name = "ollama"
     needs_credentials = False
     class Stream(ResponseStream):
-        def __init__(self, model, query):
+        # The headers only come with the first chunk, once the model is loaded and the prompt read
+        headers_first = False
+
+        def __init__(self, model, query, backend, history=()):
             self.query = query
             self._stream = None
             self.model = model
+            self.backend = backend
+            self.history = history
+            self.keep_alive = CONVERSATION_KEEP_ALIVE if history else KEEP_ALIVE
 
-        def __iter__(self):
-            self._stream = ollama.chat(model=self.model, messages=[
-            {
-                'role': 'user',
-                'content': self.query,
-            },
-            ], stream=True)
+        def messages(self):
+            return prompts.messages(self.history, self.query)
 
+        def done(self, chunk):
+            "Record the counters from the last chunk"
+            if self.timing and chunk.get("prompt_eval_duration") is not None:
+                self.timing.prefilled(chunk["prompt_eval_count"], chunk["prompt_eval_duration"] / 1e9)
 
-            for chunk in self._stream:
-                yield chunk['message']['content']
+        def __iter__(self):
+            # The request is only sent on the first next, and the client's hook hands us the response
+            self.backend.opening.stream = self
+            try:
+                self._stream = self.backend.client.chat(
+                    model=self.model, messages=self.messages(), stream=True, keep_alive=self.keep_alive)
+                for chunk in self._stream:
+                    if chunk['done']:
+                        self.done(chunk)
+                    if chunk['message']['content']:
+                        yield chunk['message']['content']
+            finally:
+                self.backend.opening.stream = None
+
+        async def __aiter__(self):
+            self._stream = await self.backend.async_client.chat(
+                model=self.model, messages=self.messages(), stream=True, keep_alive=self.keep_alive)
+            async for chunk in self._stream:
+                if self.timing and self.timing.connected is None:
+                    # The async client does not show us the response
+                    self.connected()
+                if chunk['done']:
+                    self.done(chunk)
+                if chunk['message']['content']:
+                    yield chunk['message']['content']
 
         def close(self):
             if self._stream:
                 self._stream.close()
 
+        async def aclose(self):
+            if self._stream:
+                await self._stream.aclose()
+
+    class FastStream(Stream):
+        "Reads the NDJSON stream directly"
+        def __iter__(self):
+            request = dict(
+                model=self.model, messages=self.messages(), stream=True, keep_alive=self.keep_alive)
+            stats = {}
+            with self.backend.http_client.stream("POST", "/api/chat", json=request) as response:
+                self._stream = response
+                response.raise_for_status()
+                self.connected(response.headers, response)
+                yield from fast_stream.ndjson_content(response.iter_lines(), stats)
+            self.done(stats)
+
+        async def __aiter__(self):
+            request = dict(
+                model=self.model, messages=self.messages(), stream=True, keep_alive=self.keep_alive)
+            stats = {}
+            async with self.backend.async_http_client.stream("POST", "/api/chat", json=request) as response:
+                self._stream = response
+                response.raise_for_status()
+                self.connected(response.headers)
+                async for content in fast_stream.acontents(response.aiter_lines(), fast_stream.ndjson_line, stats):
+                    yield content
+            self.done(stats)
+
+    _client = None
+    _async_client = None
+    _http_client = None
+    _async_http_client = None
+
+    def __init__(self):
+        self.opening = threading.local()
+
+    @property
+    def client(self):
+        if self._client is None:
+            self._client = ollama.Client(timeout=self.timeout, event_hooks={"response": [self._opened]})
+        return self._client
+
+    def _opened(self, response):
+        stream = getattr(self.opening, "stream", None)
+        if stream is not None:
+            stream.connected(response.headers, response)
+
+    @property
+    def async_client(self):
+        if self._async_client is None:
+            self._async_client = ollama.AsyncClient(timeout=self.timeout)
+        return self._async_client
+
+    @property
+    def http_client(self):
+        if self._http_client is None:
+            self._http_client = httpx.Client(base_url=ollama_host(), timeout=self.timeout)
+        return self._http_client
+
+    @property
+    def async_http_client(self):
+        "For the asyncio engine's fast streams. Only use it from the engine's event loop"
+        if self._async_http_client is None:
+            self._async_http_client = httpx.AsyncClient(base_url=ollama_host(), timeout=self.timeout)
+        return self._async_http_client
+
     def next_model(self, current):
         return list_next(self.models, current)
 
-    @property
-    def models(self):
-        return sorted([x["model"] for x in ollama.list()["models"]])
+    def fetch_models(self):
+        return [x["model"] for x in ollama.list()["models"]]
+
+    def warm(self, model):
+        # An empty prompt loads the model into memory
+        ollama.generate(model=model, keep_alive=KEEP_ALIVE)
+
+    def cool(self, model):
+        ollama.generate(model=model, keep_alive=0)
+
+    def embed(self, model, texts):
+        "A vector for each of texts"
+        response = self.http_client.post(
+            "/api/embed", json=dict(model=model, input=list(texts), keep_alive=KEEP_ALIVE))
+        response.raise_for_status()
+        return response.json()["embeddings"]
 
     @property
     def default_model(self):
-        return self.models[0]
+        models = self.models
+        return models[0] if models else None
+
+    def wait_default_model(self):
+        models = self.catalog.wait()
+        return models[0] if models else None
 
-    def query(self, model, query):
-        return LlmQuery(self.Stream(model, query))
+    def query(self, model, query, history=()):
+        stream = self.FastStream if self.fast_stream else self.Stream
+        return LlmQuery(
+            stream(model, query, self, history),
+            backend=self.name, model=model, prompt=query, history=history)
 
 
 class OpenaiBackend(Backend):
@@ -92,23 +327,58 @@ class OpenaiBackend(Backend):
     needs_credentials = True
     base_url = None
     class Stream(ResponseStream):
-        def __init__(self, model, query, connection):
+        def __init__(self, model, query, backend, history=()):
             self.model = model
             self.query = query
-            self.client = None
-            self.connection = connection
+            self.backend = backend
+            self.history = history
             self.response = None
 
+        def messages(self):
+            return prompts.messages(self.history, self.query)
+
+        def used(self, usage):
+            "Record the token counts sent at the end of the stream"
+            if self.timing and usage:
+                details = usage.get("prompt_tokens_details") or {}
+                self.timing.prompt_usage(usage.get("prompt_tokens"), details.get("cached_tokens") or 0)
+
         def __iter__(self):
-            self.response = self.connection.chat.completions.create(
+            self.response = self.backend.connection.chat.completions.create(
                 model=self.model,
-                messages=[
-                    {'role': 'user', 'content': self.query}
-                ],
-                stream=True  # this time, we set stream=True
+                messages=self.messages(),
+                stream=True,  # this time, we set stream=True
+                stream_options={"include_usage": True},
+                timeout=self.backend.headers_timeout,
             )
+            self.connected(self.response.response.headers, self.response.response)
 
             for chunk in self.response:
+                if chunk.usage:
+                    self.used(chunk.usage.model_dump())
+                if not chunk.choices:
+                    continue
+                content = chunk.choices[0].delta.content
+                if content is None:
+                    continue
+                yield content
+
+        async def __aiter__(self):
+            self.response = await self.backend.async_connection.chat.completions.create(
+                model=self.model,
+                messages=self.messages(),
+                stream=True,
+                stream_options={"include_usage": True},
+                timeout=self.backend.headers_timeout,
+            )
+            no_read_timeout(self.response.response)
+            self.connected(self.response.response.headers)
+
+            async for chunk in self.response:
+                if chunk.usage:
+                    self.used(chunk.usage.model_dump())
+                if not chunk.choices:
+                    continue
                 content = chunk.choices[0].delta.content
                 if content is None:
                     continue
@@ -118,36 +388,95 @@ class OpenaiBackend(Backend):
             if self.response:
                 self.response.close()
 
+        async def aclose(self):
+            if self.response:
+                await self.response.close()
+
+    class FastStream(Stream):
+        "Reads the server sent events directly rather than making ChatCompletionChunks"
+        def __iter__(self):
+            create = self.backend.connection.chat.completions.with_streaming_response.create
+            stats = {}
+            with create(
+                    model=self.model, messages=self.messages(), stream=True,
+                    stream_options={"include_usage": True},
+                    timeout=self.backend.headers_timeout) as response:
+                self.response = response
+                self.connected(response.headers, response.http_response)
+                yield from fast_stream.sse_content(response.iter_lines(), stats)
+            self.used(stats.get("usage"))
+
+        async def __aiter__(self):
+            create = self.backend.async_connection.chat.completions.with_streaming_response.create
+            stats = {}
+            async with create(
+                    model=self.model, messages=self.messages(), stream=True,
+                    stream_options={"include_usage": True},
+                    timeout=self.backend.headers_timeout) as response:
+                self.response = response
+                no_read_timeout(response.http_response)
+                self.connected(response.headers)
+                async for content in fast_stream.acontents(response.iter_lines(), fast_stream.sse_line, stats):
+                    yield content
+            self.used(stats.get("usage"))
+
 
     def __init__(self, ):
         self._connection = None
-        self._models = []
-
-    @property
-    def connection(self):
-        if self._connection is not None:
-            return self._connection
+        self._async_connection = None
 
+    def key(self):
         key = credentials.get_key(self.name)
         if key is None:
             raise errors.NoKey()
-        else:
-             self._connection = openai.OpenAI(
-                 api_key=key,
-                 base_url=self.base_url)
-             return self._connection
+        return key
+
+    @property
+    def connection(self):
+        if self._connection is None:
+            # Retries on 429 are left to the rate limiter in the query pool
+            self._connection = openai.OpenAI(
+                api_key=self.key(), base_url=self.base_url, max_retries=0, timeout=self.timeout)
+        return self._connection
+
+    @property
+    def async_connection(self):
+        "Client for the asyncio engine. Only use it from the engine's event loop"
+        if self._async_connection is None:
+            self._async_connection = openai.AsyncOpenAI(
+                api_key=self.key(), base_url=self.base_url, max_retries=0, timeout=self.timeout)
+        return self._async_connection
 
     def next_model(self, current):
         return list_next(self.models, current)
 
     @property
-    def models(self):
-        if not self._models:
-            self._models = sorted([x.id for x in self.connection.models.list()])
-        return self._models
+    def headers_timeout(self):
+        """For streams. The headers come before the reply is generated, so they
+        must also arrive within the connect timeout. A worker blocked waiting for
+        them gives up rather than waiting for a hung backend"""
+        connect = self.timeout.connect if self.timeout is not None else None
+        if connect is None:
+            return openai.NOT_GIVEN
+        return httpx.Timeout(None, connect=connect, read=connect)
+
+    def fetch_models(self):
+        return [x.id for x in self.connection.models.list()]
+
+    def invalidate(self):
+        self._connection = None
+        self._async_connection = None
+        super().invalidate()
+
+    def warm(self, model):
+        # Opens a pooled connection, so the query can skip the TLS handshake
+        self.connection.models.retrieve(model)
 
-    def query(self, model, query):
-        return LlmQuery(self.Stream(model, query, self.connection))
+    def query(self, model, query, history=()):
+        stream = self.FastStream if self.fast_stream else self.Stream
+        return LlmQuery(
+            stream(model, query, self, history),
+            backend=self.name, model=model, prompt=query, history=history)
 
     @property
     def default_model(self):
@@ -161,6 +490,9 @@ class XaiBackend(OpenaiBackend):
     class Stream(OpenaiBackend.Stream):
         pass
 
+    class FastStream(OpenaiBackend.FastStream):
+        pass
+
     @property
     def default_model(self):
         return "grok-base"
@@ -168,13 +500,40 @@ class XaiBackend(OpenaiBackend):
 
 class LlmQuery:
     "Tracks a query"
-    def __init__(self, stream):
+    def __init__(self, stream, backend=None, model=None, prompt=None, history=()):
+        self.id = str(uuid.uuid4())
         self.stream = stream
+        self.backend = backend
+        self.model = model
+        self.prompt = prompt
+        # Earlier (prompt, reply) turns. Shared with the queries of those turns rather than copied
+        self.history = history
+        self.cached = False
         self.cancelled = False
+        self.error = None
+        self.on_first_chunk = None
+        self.on_chunk = None
+        self.attempts = 0
+        # (backend, model) pairs to fail over to, in order
+        self.fallbacks = []
+        self.timed_out = False
         self.reply_buffer = []
         self.finished = False
         self.start = None
         self.finished_time = None
+        self.timing = timing.Timing(backend, model)
+        if stream is not None:
+            stream.timing = self.timing
+
+    @classmethod
+    def from_reply(cls, reply, backend=None, model=None, prompt=None):
+        "A finished query for a reply we already have"
+        query = cls(None, backend=backend, model=model, prompt=prompt)
+        query.reply_buffer = [reply]
+        query.finished = True
+        query.cached = True
+        query.start = query.finished_time = time.time()
+        return query
 
     @property
     def duration(self):
@@ -185,7 +544,7 @@ class LlmQuery:
 
     @property
     def bytes(self):
-        return sum(len(x) for x in self.reply_buffer)
+        return self.timing.bytes
 
     @property
     def reply(self):
@@ -199,20 +558,79 @@ class LlmQuery:
     def peek(self):
         return "".join(self.reply_buffer)
 
+    def follow_up(self, prompt):
+        "A query continuing the conversation after this reply"
+        history = self.history + ((self.prompt, self.reply),)
+        return get(self.backend).query(self.model, prompt, history)
+
+    def switch(self, backend, model):
+        "Send the query to another backend instead. Only before anything has arrived"
+        self.stream = backend.query(model, self.prompt, self.history).stream
+        self.stream.timing = self.timing
+        self.backend = self.timing.backend = backend.name
+        self.model = self.timing.model = model
+        self.timed_out = False
+
     def cancel(self):
+        "Mark the query cancelled. The pool hangs up the stream"
         self.cancelled = True
+        self.timing.cancel()
 
     def run(self):
-        self.start = time.time()
+        self._choose_model()
+        self._begin()
+        try:
+            for chunk in self.stream: #pylint: disable=not-an-iterable
+                if not self._add(chunk):
+                    self.stream.close()
+                    return None
+        finally:
+            self._end()
+
+        if self.cancelled or self.timed_out:
+            # Hanging up can look like the end of the stream
+            return None
+        self.finished = True
+        return "".join(self.reply_buffer)
 
-        for chunk in self.stream: #pylint: disable=not-an-iterable
+    async def arun(self):
+        "run for the asyncio engine"
+        if self.model is None:
+            await asyncio.to_thread(self._choose_model)
+        self._begin()
+        try:
+            async for chunk in self.stream:
+                if not self._add(chunk):
+                    await self.stream.aclose()
+                    return None
+        finally:
+            self._end()
+
+        self.finished = True
+        return "".join(self.reply_buffer)
 
-            self.reply_buffer.append(chunk)
-            if self.cancelled:
-                self.stream.close()
-                return None
+    def _choose_model(self):
+        "Queries made before the backend's models were known use its default model"
+        if self.model is None:
+            self.model = self.timing.model = self.stream.model = get(self.backend).wait_default_model()
 
-        return "".join(self.reply_buffer)
+    def _begin(self):
+        self.start = time.time()
+        self.timing.start()
+
+    def _add(self, chunk):
+        "Record chunk. Returns False if the query was cancelled"
+        self.reply_buffer.append(chunk)
+        self.timing.chunk(chunk)
+        if len(self.reply_buffer) == 1 and self.on_first_chunk:
+            self.on_first_chunk(self)
+        if self.on_chunk:
+            self.on_chunk(chunk)
+        return not self.cancelled
+
+    def _end(self):
+        self.finished_time = time.time()
+        self.timing.finish()
 
 
 class Backends:
@@ -224,7 +642,9 @@ class Backends:
         return list_next(cls.backends, backend)
 
 def list_next(members, x):
-    if x is None:
+    if not members:
+        return x
+    elif x is None or x not in members:
         return members[0]
     else:
         return members[(members.index(x) + 1) % len(members)]
@@ -0,0 +1,126 @@
+"""Run a command over text too big for one prompt. The command is run on each
+chunk in parallel (map), then the answers are combined in a streamed query (reduce)"""
+import logging
+import threading
+
+from . import prompts
+
+# Rough, but close enough for English text
+CHARS_PER_TOKEN = 4
+
+def tokens(text):
+    return len(text) // CHARS_PER_TOKEN
+
+def oversized(text, chunk_tokens):
+    return tokens(text) > chunk_tokens
+
+def split(text, chunk_tokens):
+    """Split text into chunks of at most chunk_tokens, breaking at paragraphs, then lines,
+    then sentences"""
+    limit = chunk_tokens * CHARS_PER_TOKEN
+    chunks = []
+    start = 0
+    while start < len(text):
+        end = min(start + limit, len(text))
+        if end < len(text):
+            for separator in ("\n\n", "\n", ". ", " "):
+                cut = text.rfind(separator, start + limit // 2, end)
+                if cut != -1:
+                    end = cut + len(separator)
+                    break
+        chunks.append(text[start:end])
+        start = end
+    return chunks
+
+def map_prompt(command, chunk, index, count, system=None):
+    # The chunk goes first so a retry can reuse the provider's prompt cache
+    instruction = (
+        f"{command}\n\nThis is part {index + 1} of {count} of a longer text. "
+        "Answer for this part only and be brief. Your answer will be combined with the others.")
+    return prompts.Prompt(instruction, [chunk], system)
+
+def reduce_prompt(command, answers, system=None):
+    parts = [
+        f"Answer for part {i + 1}:\n{answer}" if answer is not None
+        else f"Part {i + 1} could not be read."
+        for i, answer in enumerate(answers)]
+    instruction = (
+        f"{command}\n\nThe text was too long to read at once, so it was split into "
+        f"{len(answers)} parts and answered part by part above. Combine these into one answer.")
+    return prompts.Prompt(instruction, ["\n\n".join(parts)], system)
+
+
+class MapReduce:
+    """Maps command over chunks in pool, then hands over the reduce query.
+    The pool's size limits how many chunks are read at once"""
+
+    def __init__(self, pool, backend, model, command, chunks, system=None):
+        self.pool = pool
+        self.backend = backend
+        self.model = model
+        self.command = command
+        self.system = system
+        self.chunks = chunks
+        self.maps = [
+            backend.query(model, map_prompt(command, chunk, i, len(self.chunks), system))
+            for i, chunk in enumerate(self.chunks)]
+        self.lock = threading.Lock()
+        self.remaining = len(self.maps)
+        self.reduce = None
+        self.error = None
+        self.cancelled = False
+        self.on_reduce = None
+
+    def start(self, on_reduce):
+        "on_reduce(query) is called from a worker thread with the reduce query, or None if every chunk failed"
+        self.on_reduce = on_reduce
+        logging.info("Mapping over %d chunks", len(self.maps))
+        for query in self.maps:
+            self.pool.submit(query, self.mapped)
+
+    def cancel(self):
+        self.cancelled = True
+        for query in self.maps:
+            self.pool.cancel(query)
+        if self.reduce is not None:
+            self.pool.cancel(self.reduce)
+
+    def mapped(self, _):
+        with self.lock:
+            self.remaining -= 1
+            if self.remaining or self.cancelled:
+                return
+
+        answers = [q.reply if q.finished else None for q in self.maps]
+        if all(answer is None for answer in answers):
+            self.error = next((q.error for q in self.maps if q.error), "Every chunk failed")
+            self.on_reduce(None)
+            return
+        self.reduce = self.backend.query(
+            self.model, reduce_prompt(self.command, answers, self.system))
+        self.on_reduce(self.reduce)
+
+    @property
+    def finished(self):
+        if self.cancelled or self.error:
+            return True
+        return self.reduce is not None and (self.reduce.finished or self.reduce.error is not None)
+
+    def progress(self):
+        "A line for each chunk"
+        lines = []
+        for i, query in enumerate(self.maps):
+            if query.finished:
+                state = f"done in {query.duration:.1f}s"
+            elif query.error:
+                state = "failed"
+            elif query.cancelled:
+                state = "cancelled"
+            elif query.start:
+                state = f"running for {query.duration:.1f}s, {query.bytes} bytes"
+            else:
+                state = "queued"
+            lines.append(f"Part {i + 1} ({tokens(self.chunks[i])} tokens): {state}")
+        if self.reduce is not None:
+            lines.append("Combining the answers...")
+        return lines
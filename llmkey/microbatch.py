@@ -0,0 +1,186 @@
+"""Run a command on many small items, such as the lines of the clipboard, by packing
+several items into each request and splitting the streamed reply back into items"""
+import logging
+import re
+import threading
+
+# Items per request, and the most characters of items in one request
+BATCH_SIZE = 20
+BATCH_CHARS = 8000
+
+MARKER = re.compile(r"^###\s*(\d+)\s*$")
+
+def batches(items, size=BATCH_SIZE, chars=BATCH_CHARS):
+    "Indexes of items, grouped into requests"
+    result = []
+    current = []
+    length = 0
+    for i, item in enumerate(items):
+        if current and (len(current) >= size or length + len(item) > chars):
+            result.append(current)
+            current = []
+            length = 0
+        current.append(i)
+        length += len(item)
+    if current:
+        result.append(current)
+    return result
+
+def one_line(text):
+    "text with its lines joined, so answers stay one line per item"
+    return " ".join(line.strip() for line in text.splitlines() if line.strip())
+
+def pack(command, items):
+    "A prompt for several items. The command goes first as it is the same in every batch"
+    numbered = "\n".join(f"### {i + 1}\n{item}" for i, item in enumerate(items))
+    return (
+        f"{command}\n\n"
+        f"Do this separately for each of the {len(items)} items below. Before each answer "
+        "write ### and the item's number on a line by itself, in order. Keep each answer "
+        "to one line. Write nothing else.\n\n"
+        f"{numbered}")
+
+
+class Splitter:
+    "Splits a streamed reply to a packed prompt into answers as they arrive"
+
+    def __init__(self, count, on_answer):
+        self.count = count
+        self.on_answer = on_answer
+        self.buffer = ""
+        self.current = None
+        self.lines = []
+        self.seen = set()
+
+    def feed(self, chunk):
+        self.buffer += chunk
+        *complete, self.buffer = self.buffer.split("\n")
+        for line in complete:
+            self.line(line)
+
+    def line(self, line):
+        match = MARKER.match(line)
+        if match:
+            self.answered()
+            self.current = int(match.group(1)) - 1
+            self.lines = []
+        elif self.current is not None:
+            self.lines.append(line)
+
+    def answered(self):
+        answer = "\n".join(self.lines).strip()
+        index = self.current
+        # Out of range, repeated and empty answers are malformed. They are retried on their own
+        if index is not None and 0 <= index < self.count and index not in self.seen and answer:
+            self.seen.add(index)
+            self.on_answer(index, answer)
+
+    def finish(self):
+        if self.buffer:
+            self.line(self.buffer)
+            self.buffer = ""
+        self.answered()
+        self.current = None
+
+
+class MicroBatch:
+    "Runs command on each of items in pool, in batches. Items a batch misses are retried alone"
+
+    def __init__(self, pool, backend, model, command, items, size=BATCH_SIZE):
+        self.pool = pool
+        self.backend = backend
+        self.model = model
+        self.command = command
+        self.items = items
+        self.answers = [None] * len(items)
+        self.errors = {}
+        self.lock = threading.Lock()
+        self.queries = []
+        self.remaining = 0
+        self.retried = 0
+        self.cancelled = False
+        self.batches = batches(items, size)
+        self.on_done = None
+
+    @property
+    def finished(self):
+        return self.cancelled or bool(self.queries and not self.remaining)
+
+    def start(self, on_done):
+        "on_done(job) is called from a worker thread when every item is answered or has failed"
+        self.on_done = on_done
+        with self.lock:
+            self.remaining = len(self.batches)
+        logging.info("Running %d items in %d requests", len(self.items), len(self.batches))
+        for indexes in self.batches:
+            self.submit_batch(indexes)
+
+    def submit_batch(self, indexes):
+        if len(indexes) == 1:
+            self.submit_single(indexes[0])
+            return
+
+        def answer(position, text):
+            self.answers[indexes[position]] = text
+
+        splitter = Splitter(len(indexes), answer)
+        query = self.backend.query(self.model, pack(self.command, [self.items[i] for i in indexes]))
+        query.on_chunk = splitter.feed
+
+        def done(query):
+            if not query.error and not query.cancelled:
+                splitter.finish()
+            missing = [i for i in indexes if self.answers[i] is None]
+            if missing and not self.cancelled:
+                logging.info("Retrying %d items alone", len(missing))
+                with self.lock:
+                    self.retried += len(missing)
+                    self.remaining += len(missing)
+                for i in missing:
+                    self.submit_single(i)
+            self.finish_one()
+
+        self.submit(query, done)
+
+    def submit_single(self, index):
+        query = self.backend.query(self.model, f"{self.command}\n\n{self.items[index]}")
+
+        def done(query):
+            if query.finished:
+                self.answers[index] = query.reply.strip()
+            else:
+                self.errors[index] = query.error or "cancelled"
+            self.finish_one()
+
+        self.submit(query, done)
+
+    def submit(self, query, done):
+        with self.lock:
+            self.queries.append(query)
+        self.pool.submit(query, done)
+
+    def finish_one(self):
+        with self.lock:
+            self.remaining -= 1
+            if self.remaining or self.cancelled:
+                return
+        self.on_done(self)
+
+    def cancel(self):
+        self.cancelled = True
+        for query in list(self.queries):
+            self.pool.cancel(query)
+
+    @property
+    def reply(self):
+        "The answers, a line for each item in order"
+        return "\n".join(one_line(answer) if answer is not None else "" for answer in self.answers)
+
+    def progress(self):
+        answered = sum(1 for answer in self.answers if answer is not None)
+        lines = [f"{answered} of {len(self.items)} items answered in {len(self.batches)} requests"]
+        if self.retried:
+            lines.append(f"{self.retried} items retried on their own")
+        if self.errors:
+            lines.append(f"{len(self.errors)} items failed")
+        return lines
@@ -0,0 +1,43 @@
+"""Assemble prompts so that their start stays the same from query to query.
+Providers cache the longest prefix they have seen, so the parts that change go last"""
+
+
+class Prompt(str):
+    """System instructions, then documents, then the instruction.
+    As a str it is the whole prompt, which is what the cache and logs use"""
+
+    def __new__(cls, instruction, documents=(), system=None):
+        self = super().__new__(cls, "\n\n".join(p for p in [system, *documents, instruction] if p))
+        self.instruction = instruction
+        self.documents = tuple(documents)
+        self.system = system
+        return self
+
+    def user_messages(self):
+        return [{'role': 'user', 'content': s} for s in [*self.documents, self.instruction] if s]
+
+
+def from_clipboard(text, clipboard, system=None):
+    "The clipboard goes before the command typed above it, so commands on the same clipboard share a prefix"
+    body = clipboard.strip()
+    if body and text.rstrip().endswith(body):
+        instruction = text.rstrip()[:-len(body)].strip()
+        return Prompt(instruction, [body], system)
+    # The clipboard was edited, so it is not the same document
+    return Prompt(text, system=system)
+
+def user_messages(prompt):
+    if isinstance(prompt, Prompt):
+        return prompt.user_messages()
+    return [{'role': 'user', 'content': prompt}]
+
+def messages(history, prompt):
+    "Chat messages for a conversation. Earlier turns are sent word for word so servers can reuse their cache"
+    turns = [*history, (prompt, None)]
+    system = next((p.system for p, _ in turns if isinstance(p, Prompt) and p.system), None)
+    result = [{'role': 'system', 'content': system}] if system else []
+    for turn_prompt, reply in turns:
+        result.extend(user_messages(turn_prompt))
+        if reply is not None:
+            result.append({'role': 'assistant', 'content': reply})
+    return result
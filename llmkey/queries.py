@@ -0,0 +1,55 @@
+"Make queries for prompts. Shared by the tk app and the daemon"
+import logging
+
+from . import cache, config, hedge, history, llm, prompts, semantic
+from .config import Config
+
+@config.with_config
+def one_off(conf, query, bypass_cache=False, backend=None, model=None):
+    backend, model = get_model_and_backend(conf, backend, model)
+    if not isinstance(query, prompts.Prompt):
+        query = prompts.Prompt(query, system=conf.system_prompt)
+    if not bypass_cache:
+        reply = cache.get_cache().get(backend.name, model, query)
+        if reply is not None:
+            logging.info("Cache hit for %s %r", model, query)
+            return llm.LlmQuery.from_reply(reply, backend=backend.name, model=model, prompt=query)
+
+    others = hedge.others(conf, backend, model) if conf.race_mode != "off" else []
+    if others:
+        logging.info("Sending one-off to %s %r with a %s", model, query, conf.race_mode)
+        return hedge.query(backend, model, query, others, conf.race_mode, conf.hedge_percentile)
+
+    logging.info("Sending one-off to %s %r", model, query)
+    result = backend.query(model=model, query=query)
+    result.fallbacks = fallbacks(conf, backend, model)
+    return result
+
+def get_model_and_backend(conf: Config, backend_name=None, model=None):
+    conf.load()
+    backend = llm.get(backend_name or conf.backend)
+    # The default model may not be known yet. The query then picks it when it runs
+    model = model or conf.backend_models.get(backend.name) or backend.default_model
+    return backend, model
+
+def fallbacks(conf, backend, model):
+    "The failover chain in conf after backend and model"
+    result = []
+    for name, other_model in conf.failover:
+        if name not in llm.MODEL_CLASSES:
+            logging.warning("Unknown backend %s in failover", name)
+        elif (name, other_model) != (backend.name, model):
+            result.append((llm.get(name), other_model))
+    return result
+
+def remember(query):
+    "Cache the reply of a finished query and add it to the history"
+    if not query.finished or query.cached or query.prompt is None:
+        return
+    history.get_history().add(query)
+    # Follow ups depend on the conversation as well as the prompt
+    if not query.history:
+        cache.get_cache().put(query.backend, query.model, query.prompt, query.reply)
+        similar = semantic.get_semantic()
+        if similar:
+            similar.add(query)
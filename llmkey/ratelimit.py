@@ -0,0 +1,195 @@
+"Per backend rate limiting: request and token budgets, 429 back off and an AIMD concurrency window"
+import collections
+import os
+import random
+import re
+import threading
+import time
+
+# Give up on a query after being throttled this many times
+MAX_ATTEMPTS = 6
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 60
+# Requests sent while we do not know the budget: before the first reply, and once a budget has reset
+PROBES = 4
+
+DURATION_PART = re.compile(r"([\d.]+)(ms|s|m|h)")
+DURATION_UNITS = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+
+def parse_duration(value):
+    "Parse reset durations like 1s, 6m0s or 20ms"
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parts = DURATION_PART.findall(value)
+    if not parts:
+        return None
+    return sum(float(number) * DURATION_UNITS[unit] for number, unit in parts)
+
+def parse_int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+def estimate_tokens(prompt):
+    # Roughly four characters a token, plus room for the reply
+    return len(prompt or "") // 4 + 256
+
+
+def throttled(error):
+    "Returns the response headers if error means we are sending too much, otherwise None"
+    response = getattr(error, "response", None)
+    status = getattr(error, "status_code", None) or getattr(response, "status_code", None)
+    if status not in (429, 503):
+        return None
+    return getattr(response, "headers", None) or {}
+
+
+class RateLimiter:
+    "Limits for one backend, learned from rate limit headers and 429s"
+
+    def __init__(self, window=64, min_window=1, max_window=64, probes=PROBES):
+        self.lock = threading.Lock()
+        self.window = float(window)
+        self.min_window = min_window
+        self.max_window = max_window
+        self.probes = probes
+        self.heard = False
+        self.blocked_until = 0
+        self.last_throttle = 0
+        self.failures = 0
+        self.throttles = 0
+        self.requests_remaining = None
+        self.requests_reset_at = 0
+        self.tokens_remaining = None
+        self.tokens_reset_at = 0
+        # (time, tokens) of requests started since the request whose headers we last used
+        self.recent = collections.deque()
+        self.updated_from = 0
+
+    def ready(self, running):
+        now = time.time()
+        if self.probing(now) and len(self.recent) >= self.probes:
+            return False
+        return running < int(self.window) and now >= self.unblocked_at()
+
+    def probing(self, now):
+        "True while we do not know how many requests the backend will take"
+        if not self.heard:
+            return True
+        requests_reset = self.requests_remaining is not None and now >= self.requests_reset_at
+        tokens_reset = self.tokens_remaining is not None and now >= self.tokens_reset_at
+        return requests_reset or tokens_reset
+
+    def wait(self):
+        "Seconds until a blocked backend can be tried again"
+        return max(0, self.unblocked_at() - time.time())
+
+    def unblocked_at(self):
+        "When a request may next be sent. A spent budget waits for its reset"
+        at = self.blocked_until
+        if self.requests_remaining is not None and self.requests_remaining <= 0:
+            at = max(at, self.requests_reset_at)
+        if self.tokens_remaining is not None and self.tokens_remaining <= 0:
+            at = max(at, self.tokens_reset_at)
+        return at
+
+    def started(self, prompt):
+        with self.lock:
+            tokens = estimate_tokens(prompt)
+            self.recent.append((time.time(), tokens))
+            if self.requests_remaining is not None:
+                self.requests_remaining -= 1
+            if self.tokens_remaining is not None:
+                self.tokens_remaining -= tokens
+
+    def success(self, headers, sent):
+        "A request sent at time sent got a reply with headers"
+        with self.lock:
+            self.failures = 0
+            # Additive increase: about one more slot per window of successes
+            self.window = min(self.max_window, self.window + 1 / self.window)
+            self._update(headers or {}, sent)
+
+    def connected(self, headers, sent):
+        "The request sent at time sent was accepted with headers"
+        with self.lock:
+            self._update(headers or {}, sent)
+
+    def throttle(self, headers, sent):
+        "We got a 429 for a request sent at time sent"
+        with self.lock:
+            self.throttles += 1
+            # Requests sent before we last backed off were sent too fast for the old window.
+            # Only count one back off for them
+            if sent >= self.last_throttle:
+                self.last_throttle = time.time()
+                self.failures += 1
+                # Multiplicative decrease
+                self.window = max(self.min_window, self.window / 2)
+
+            retry_after = parse_duration(headers.get("retry-after"))
+            if retry_after is None:
+                retry_after = min(BACKOFF_MAX, BACKOFF_BASE * 2 ** self.failures)
+            # Jitter so waiting queries do not all come back at once
+            delay = retry_after * random.uniform(1, 1.2)
+            self.blocked_until = max(self.blocked_until, time.time() + delay)
+            self._update(headers, sent)
+
+    def _update(self, headers, sent):
+        """Headers count the requests up to the one sent at time sent. Those
+        started since are still to be taken off. Replies arrive out of the order
+        the server counted them in, so until a budget resets keep the lowest estimate"""
+        if sent is None:
+            return
+        now = time.time()
+        stale = sent < self.updated_from
+        if not stale:
+            self.updated_from = sent
+            self.heard = True
+            while self.recent and self.recent[0][0] <= sent:
+                self.recent.popleft()
+
+        requests = parse_int(headers.get("x-ratelimit-remaining-requests"))
+        if requests is not None:
+            self.requests_remaining, self.requests_reset_at = budget(
+                self.requests_remaining, self.requests_reset_at, requests - len(self.recent),
+                headers.get("x-ratelimit-reset-requests"), stale, now)
+
+        tokens = parse_int(headers.get("x-ratelimit-remaining-tokens"))
+        if tokens is not None:
+            self.tokens_remaining, self.tokens_reset_at = budget(
+                self.tokens_remaining, self.tokens_reset_at, tokens - sum(t for _, t in self.recent),
+                headers.get("x-ratelimit-reset-tokens"), stale, now)
+
+    @property
+    def stats(self):
+        return f"window {self.window:.1f}, {self.throttles} throttled"
+
+
+def budget(remaining, reset_at, estimate, reset, stale, now):
+    "The budget left and when it resets, given an estimate from headers"
+    if now < reset_at:
+        # Still the same budget, which only goes down
+        return min(remaining, estimate), reset_at if stale else now + (parse_duration(reset) or 0)
+    if stale:
+        # From before the budget reset
+        return remaining, reset_at
+    return estimate, now + (parse_duration(reset) or 0)
+
+def ollama_parallel():
+    "How many requests the ollama server runs at once"
+    return int(os.environ.get("OLLAMA_NUM_PARALLEL", 1))
+
+def limiter(backend):
+    if backend == "ollama":
+        # Anything over what the server runs in parallel just waits in its queue
+        parallel = ollama_parallel()
+        return RateLimiter(window=parallel, min_window=1, max_window=parallel)
+    else:
+        # Start wide open. The window only shrinks once we are throttled
+        return RateLimiter()
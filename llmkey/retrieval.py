@@ -0,0 +1,212 @@
+"""Find the parts of local documents most relevant to a prompt. Files in the
+configured directories are split into chunks and embedded by a local ollama
+model. Only files that changed are embedded again"""
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+from . import config, llm, mapreduce, prompts, vectors
+
+INDEX = None
+INDEX_LOCK = threading.Lock()
+
+# Only files like these are read
+SUFFIXES = {
+    ".md", ".txt", ".rst", ".org", ".adoc", ".tex", ".html", ".py", ".sh",
+    ".json", ".yaml", ".yml", ".toml", ".ini", ".cfg", ".csv"}
+MAX_FILE_BYTES = 2_000_000
+CHUNK_TOKENS = 300
+# Chunks sent to the embedding model at once
+EMBED_BATCH = 32
+
+def get_index():
+    "The document index, or None unless directories are configured and numpy is installed"
+    global INDEX #pylint: disable=global-statement
+    conf = config.Config()
+    conf.load()
+    if not conf.retrieval_directories:
+        return None
+    if vectors.numpy is None:
+        logging.warning("Searching local documents needs numpy")
+        return None
+    with INDEX_LOCK:
+        if INDEX is None:
+            conf.io.ensure_dir()
+            backend = llm.get("ollama")
+            INDEX = DocumentIndex(
+                config.ConfigIO.dir() / "retrieval",
+                lambda texts: backend.embed(conf.embedding_model, texts),
+                conf.embedding_model)
+    INDEX.directories = [Path(d).expanduser() for d in conf.retrieval_directories]
+    return INDEX
+
+def start():
+    "Keep the index up to date in the background"
+    def run():
+        while True:
+            conf = config.Config()
+            conf.load()
+            try:
+                index = get_index()
+                if index:
+                    index.update()
+            except Exception: #pylint: disable=broad-except
+                logging.exception("Could not index local documents")
+            time.sleep(conf.retrieval_interval)
+
+    thread = threading.Thread(target=run)
+    thread.daemon = True
+    thread.start()
+
+def augment(prompt, found):
+    "prompt with the chunks found added after its documents"
+    documents = [f"From {path}:\n{text}" for path, text, _ in found]
+    return prompts.Prompt(prompt.instruction, [*prompt.documents, *documents], prompt.system)
+
+
+class DocumentIndex:
+    """Chunk i of the chunks table is vector i. The chunks of changed and deleted
+    files are freed and their rows reused"""
+
+    def __init__(self, path, embed, embedding_model):
+        self.path = path
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.embed = embed
+        self.directories = []
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(str(path / "chunks.sqlite"), check_same_thread=False)
+        self.db.execute(
+            "create table if not exists files "
+            "(path text primary key, mtime real, size integer, hash text)")
+        self.db.execute("create table if not exists chunks (row integer primary key, path text, text text)")
+        self.db.execute("create index if not exists chunks_path on chunks (path)")
+        self.db.execute("create table if not exists meta (key text primary key, value text)")
+        meta = dict(self.db.execute("select key, value from meta").fetchall())
+        if meta and meta.get("model") != embedding_model:
+            logging.info("The embedding model changed to %s. Indexing local documents again", embedding_model)
+            for table in ("files", "chunks", "meta"):
+                self.db.execute(f"delete from {table}")
+            meta = {}
+        self.db.execute("insert or replace into meta values ('model', ?)", (embedding_model,))
+        self.db.commit()
+
+        self.count = self.db.execute("select coalesce(max(row) + 1, 0) from chunks").fetchone()[0]
+        self.free = [row for row, in self.db.execute("select row from chunks where path is null")]
+        self.live = vectors.numpy.ones(max(self.count, vectors.INITIAL_CAPACITY), dtype=bool)
+        self.live[self.free] = False
+        self.index = None
+        if "dimensions" in meta:
+            self.index = vectors.VectorIndex(path, int(meta["dimensions"]), self.count)
+
+    def files(self):
+        for directory in self.directories:
+            for root, dirs, names in os.walk(directory):
+                dirs[:] = [d for d in dirs if not d.startswith(".")]
+                for name in names:
+                    if Path(name).suffix.lower() in SUFFIXES:
+                        yield os.path.join(root, name)
+
+    def update(self):
+        "Embed new and changed files, and forget deleted ones. Returns counts of what was done"
+        stats = dict(files=0, changed=0, chunks=0, removed=0)
+        with self.lock:
+            known = {
+                path: (mtime, size, hash_)
+                for path, mtime, size, hash_ in self.db.execute("select path, mtime, size, hash from files")}
+
+        for path in self.files():
+            stats["files"] += 1
+            try:
+                stat = os.stat(path)
+                old = known.pop(path, None)
+                if old and old[:2] == (stat.st_mtime, stat.st_size):
+                    continue
+                if stat.st_size > MAX_FILE_BYTES:
+                    if old:
+                        # It has grown too big since it was indexed
+                        with self.lock:
+                            self.remove(path)
+                            self.db.execute("delete from files where path = ?", (path,))
+                            self.db.commit()
+                        stats["removed"] += 1
+                    continue
+                with open(path, "rb") as f:
+                    data = f.read()
+            except OSError as e:
+                logging.info("Could not read %s: %s", path, e)
+                continue
+
+            hash_ = hashlib.sha1(data).hexdigest()
+            if old and old[2] == hash_:
+                # Touched but not changed
+                with self.lock:
+                    self.db.execute("update files set mtime = ? where path = ?", (stat.st_mtime, path))
+                    self.db.commit()
+                continue
+
+            chunks = [
+                chunk.strip() for chunk in mapreduce.split(data.decode("utf8", errors="replace"), CHUNK_TOKENS)
+                if chunk.strip()]
+            embeddings = []
+            for i in range(0, len(chunks), EMBED_BATCH):
+                embeddings.extend(self.embed(chunks[i:i + EMBED_BATCH]))
+
+            with self.lock:
+                self.remove(path)
+                for chunk, vector in zip(chunks, embeddings):
+                    self.insert(path, chunk, vector)
+                self.db.execute(
+                    "insert or replace into files values (?, ?, ?, ?)",
+                    (path, stat.st_mtime, stat.st_size, hash_))
+                self.db.commit()
+            stats["changed"] += 1
+            stats["chunks"] += len(chunks)
+
+        with self.lock:
+            for path in known:
+                self.remove(path)
+                self.db.execute("delete from files where path = ?", (path,))
+            self.db.commit()
+        stats["removed"] += len(known)
+        if stats["changed"] or stats["removed"]:
+            logging.info("Indexed local documents: %s", stats)
+        return stats
+
+    def remove(self, path):
+        rows = [row for row, in self.db.execute("select row from chunks where path = ?", (path,))]
+        self.db.execute("update chunks set path = null, text = null where path = ?", (path,))
+        self.live[rows] = False
+        self.free.extend(rows)
+
+    def insert(self, path, text, vector):
+        if self.index is None:
+            self.db.execute("insert or replace into meta values ('dimensions', ?)", (str(len(vector)),))
+            self.index = vectors.VectorIndex(self.path, len(vector))
+        if self.free:
+            row = self.free.pop()
+        else:
+            row = self.count
+            self.count += 1
+            if row == len(self.live):
+                self.live = vectors.numpy.concatenate([self.live, vectors.numpy.ones(len(self.live), dtype=bool)])
+        self.index[row] = vector
+        self.live[row] = True
+        self.db.execute("insert or replace into chunks values (?, ?, ?)", (row, path, text))
+
+    def retrieve(self, text, k):
+        "The k chunks most relevant to text, as (path, text, similarity)"
+        return self.search(self.embed([text])[0], k)
+
+    def search(self, vector, k):
+        with self.lock:
+            if self.index is None:
+                return []
+            results = []
+            for row, similarity in self.index.search(vector, self.count, k, self.live):
+                path, text = self.db.execute("select path, text from chunks where row = ?", (row,)).fetchone()
+                results.append((path, text, similarity))
+            return results
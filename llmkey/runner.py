@@ -1,36 +1,243 @@
-import threading
+import collections
 import logging
+import threading
 import traceback
 
-class LlmRunner:
-    "Single threaded worker to run queries"
+from . import breaker, ratelimit
+
+class QueryPool:
+    "Bounded pool of worker threads running queries. Work queues when the pool is full"
+
+    def __init__(self, size=4, limits=None, rate_limit=True, connect_timeout=None):
+        self.size = size
+        self.limits = limits or {}
+        self.rate_limit = rate_limit
+        self.connect_timeout = connect_timeout
+        self.limiters = {}
+        self.lock = threading.Lock()
+        self.pending = collections.deque()
+        # query id to (query, done)
+        self.active = {}
+        self.timer = None
 
-    def __init__(self, tk_root):
-        self.tk_root = tk_root
-        self.thread = None
+    def limiter(self, backend):
+        if backend not in self.limiters:
+            self.limiters[backend] = ratelimit.limiter(backend)
+        return self.limiters[backend]
 
     @property
     def running(self):
-        return self.thread is not None
+        return bool(self.active or self.pending)
+
+    @property
+    def queued(self):
+        return len(self.pending)
+
+    def submit(self, query, done):
+        """Queue query. done(query) is called from the worker thread when it finishes or fails,
+        or at once if query is already finished, like cached replies"""
+        if query.finished:
+            done(query)
+            return query
+        if getattr(query.stream, "runs_queries", False):
+            self._coordinate(query, done)
+            return query
+        with self.lock:
+            self.pending.append((query, done))
+        self._dispatch()
+        return query
+
+    def cancel(self, query):
+        "Stop query at once. Its slot is freed and done called without waiting for the stream"
+        query.cancel()
+        if getattr(query.stream, "runs_queries", False):
+            # It cancels its own queries and then calls done
+            query.stream.hang_up()
+            return
+        with self.lock:
+            item = self.active.pop(query.id, None)
+            running = item is not None
+            if not running:
+                item = next((i for i in self.pending if i[0] is query), None)
+                if item is not None:
+                    self.pending.remove(item)
+
+        if item is None:
+            return
+        if running:
+            self._interrupt(query)
+            self._dispatch()
+        _, done = item
+        done(query)
+
+    def _interrupt(self, query):
+        "Make the worker running query give up"
+        query.stream.hang_up()
+
+    def _backend_count(self, backend):
+        return sum(1 for q, _ in self.active.values() if q.backend == backend)
+
+    def _next_runnable(self):
+        for item in self.pending:
+            query, _ = item
+            if not breaker.healthy(query.backend):
+                # Skip straight to a backend which is up rather than wait to time out
+                self._fail_over(query)
+            count = self._backend_count(query.backend)
+            limit = self.limits.get(query.backend)
+            if limit is not None and count >= limit:
+                continue
+            if self.rate_limit and not self.limiter(query.backend).ready(count):
+                continue
+            return item
+        return None
+
+    def _dispatch(self):
+        with self.lock:
+            while len(self.active) < self.size:
+                item = self._next_runnable()
+                if item is None:
+                    break
+
+                self.pending.remove(item)
+                query, done = item
+                self.active[query.id] = item
+                if self.rate_limit:
+                    limiter = self.limiter(query.backend)
+                    limiter.started(query.prompt)
+                    # The budget in the headers is wanted now, not once the reply has streamed
+                    query.stream.on_connected = lambda stream, limiter=limiter, query=query: (
+                        limiter.connected(stream.headers, query.timing.started))
+                self._start(query, done)
+                self._watch(query)
+
+            self._wake_when_unblocked()
 
-    def run(self, f, event):
-        def wrapped():
+    def _wake_when_unblocked(self):
+        "Dispatch again once a throttled backend may be used"
+        waits = [
+            self.limiter(q.backend).wait() for q, _ in self.pending
+            if self.rate_limit and self.limiter(q.backend).wait() > 0]
+        if waits and self.timer is None:
+            self.timer = threading.Timer(min(waits), self._timer_fired)
+            self.timer.daemon = True
+            self.timer.start()
+
+    def _timer_fired(self):
+        self.timer = None
+        self._dispatch()
+
+    def _watch(self, query):
+        "Hang up on query if it has not connected within connect_timeout"
+        if not self.connect_timeout or not query.stream.headers_first:
+            return
+        timer = threading.Timer(
+            self.connect_timeout, self._check_connected, (query, query.stream, query.attempts))
+        timer.daemon = True
+        timer.start()
+
+    def _check_connected(self, query, stream, attempts):
+        with self.lock:
+            running = query.id in self.active
+        same_attempt = query.stream is stream and query.attempts == attempts
+        if running and same_attempt and query.timing.connected is None and not query.cancelled:
+            query.timed_out = True
+            self._interrupt(query)
+
+    def _timeout_error(self, query):
+        return TimeoutError(f"{query.backend} did not answer within {self.connect_timeout}s")
+
+    def _fail_over(self, query):
+        "Point query at its next healthy fallback. False if there is none"
+        while query.fallbacks:
+            backend, model = query.fallbacks.pop(0)
+            if breaker.healthy(backend.name):
+                logging.info("Failing over from %s to %s", query.backend, backend.name)
+                query.switch(backend, model)
+                return True
+        return False
+
+    def _coordinate(self, query, done):
+        "Run a stream which sends its queries to this pool. It takes no slot itself"
+        query.stream.pool = self
+        def run():
             try:
-                result = f()
-            except Exception: #pylint: disable=broad-except
-                logging.exception("LLM command failed")
-                message = traceback.format_exc()
-                self.tk_root.event_generate("<<failed>>", data=message)
-                self.thread = None
-            else:
-                self.thread = None
-                self.tk_root.event_generate(event, data=result)
-
-
-        if not self.thread:
-            self.thread = threading.Thread(target=wrapped)
-            self.thread.daemon = True
-            self.thread.start()
-            return True
+                query.run()
+            except Exception as e: #pylint: disable=broad-except
+                if not query.cancelled:
+                    logging.error("LLM command failed", exc_info=e)
+                    query.error = "".join(traceback.format_exception(e))
+            done(query)
+        thread = threading.Thread(target=run)
+        thread.daemon = True
+        thread.start()
+
+    def _start(self, query, done):
+        thread = threading.Thread(target=self._run, args=(query, done))
+        thread.daemon = True
+        thread.start()
+
+    def _run(self, query, done):
+        try:
+            query.run()
+        except Exception as e: #pylint: disable=broad-except
+            self._failed(query, done, e)
         else:
-            return False
+            self._succeeded(query, done)
+
+    def _succeeded(self, query, done):
+        if query.timed_out:
+            # Hanging up can look like the end of the stream
+            self._failed(query, done, self._timeout_error(query))
+            return
+        if not query.cancelled:
+            breaker.get(query.backend).success()
+        if self.rate_limit and not query.cancelled:
+            self.limiter(query.backend).success(query.stream.headers, query.timing.started)
+        if self._release(query):
+            done(query)
+
+    def _failed(self, query, done, error):
+        if query.cancelled:
+            # Hanging up usually breaks the read
+            self._release(query)
+            return
+
+        if query.timed_out:
+            error = self._timeout_error(query)
+        headers = ratelimit.throttled(error)
+        retry = (
+            self.rate_limit and headers is not None and not query.reply_buffer
+            and query.attempts < ratelimit.MAX_ATTEMPTS)
+        if retry:
+            logging.info("%s is rate limiting us. Retrying later", query.backend)
+            query.attempts += 1
+            self.limiter(query.backend).throttle(headers, query.timing.started)
+            self._requeue(query, done)
+            return
+
+        if headers is None:
+            breaker.get(query.backend).failure()
+        if not query.reply_buffer and self._fail_over(query):
+            logging.warning("Query failed. Trying %s: %s", query.backend, error)
+            self._requeue(query, done)
+            return
+
+        logging.error("LLM command failed", exc_info=error)
+        query.error = "".join(traceback.format_exception(error))
+        if self._release(query):
+            done(query)
+
+    def _requeue(self, query, done):
+        "Run query again ahead of anything else"
+        with self.lock:
+            self.active.pop(query.id, None)
+            self.pending.appendleft((query, done))
+        self._dispatch()
+
+    def _release(self, query):
+        "Free the slot of query. Returns False if cancel already did"
+        with self.lock:
+            released = self.active.pop(query.id, None) is not None
+        self._dispatch()
+        return released
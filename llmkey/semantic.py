@@ -0,0 +1,141 @@
+"""Offer replies to earlier prompts that mean nearly the same thing. Prompts are
+embedded by a local ollama model and searched by cosine similarity with numpy"""
+import logging
+import queue
+import sqlite3
+import threading
+
+from . import config, llm, vectors
+
+SEMANTIC = None
+
+TOP_K = 5
+
+# The settings, with the time the settings file was changed when they were read
+CONF = None
+CONF_MTIME = None
+
+def get_conf():
+    "The settings, only read again once the settings file has changed"
+    global CONF, CONF_MTIME #pylint: disable=global-statement
+    try:
+        mtime = config.ConfigIO().config_file().stat().st_mtime_ns
+    except FileNotFoundError:
+        mtime = None
+    if CONF is None or mtime != CONF_MTIME:
+        CONF = config.Config()
+        CONF.load()
+        CONF_MTIME = mtime
+    return CONF
+
+def get_semantic():
+    "The semantic cache, or None unless it is turned on and numpy is installed"
+    global SEMANTIC #pylint: disable=global-statement
+    conf = get_conf()
+    if not conf.semantic_cache:
+        return None
+    if vectors.numpy is None:
+        logging.warning("The semantic cache needs numpy")
+        return None
+    if SEMANTIC is None:
+        conf.io.ensure_dir()
+        backend = llm.get("ollama")
+        SEMANTIC = SemanticCache(
+            config.ConfigIO.dir() / "semantic",
+            lambda text: backend.embed(conf.embedding_model, [text])[0],
+            conf.embedding_model)
+    SEMANTIC.threshold = conf.semantic_threshold
+    return SEMANTIC
+
+
+class SemanticCache:
+    """A vector index next to an sqlite table of replies.
+    Embedding and searching happen on a thread of their own"""
+
+    def __init__(self, path, embed, embedding_model, threshold=0.95):
+        self.path = path
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.embed = embed
+        self.threshold = threshold
+        self.db = sqlite3.connect(str(path / "replies.sqlite"), check_same_thread=False)
+        self.db.execute(
+            "create table if not exists replies "
+            "(row integer primary key, backend text, model text, prompt text, reply text)")
+        self.db.execute("create table if not exists meta (key text primary key, value text)")
+        meta = dict(self.db.execute("select key, value from meta").fetchall())
+        if meta and meta.get("model") != embedding_model:
+            logging.info("The embedding model changed to %s. Starting the semantic cache again", embedding_model)
+            self.db.execute("delete from replies")
+            self.db.execute("delete from meta")
+            meta = {}
+        self.db.execute("insert or replace into meta values ('model', ?)", (embedding_model,))
+        self.db.commit()
+
+        self.count = self.db.execute("select count(*) from replies").fetchone()[0]
+        self.index = None
+        if "dimensions" in meta:
+            self.index = vectors.VectorIndex(path, int(meta["dimensions"]), self.count)
+
+        # Embeddings of recent lookups, so adding a reply does not embed its prompt again
+        self.recent = {}
+        self.jobs = queue.SimpleQueue()
+        thread = threading.Thread(target=self.work)
+        thread.daemon = True
+        thread.start()
+
+    def work(self):
+        while True:
+            job, args = self.jobs.get()
+            try:
+                job(*args)
+            except Exception: #pylint: disable=broad-except
+                logging.exception("Semantic cache job failed")
+
+    def lookup(self, query, on_hit):
+        "Calls on_hit(query, reply, similarity) from the cache's thread if a close enough reply is known"
+        self.jobs.put((self._lookup, (query, on_hit)))
+
+    def add(self, query):
+        self.jobs.put((self._add, (query.backend, query.model, str(query.prompt), query.reply)))
+
+    def vector(self, prompt):
+        vector = self.recent.pop(prompt, None)
+        if vector is None:
+            vector = self.embed(prompt)
+        return vector
+
+    def _lookup(self, query, on_hit):
+        prompt = str(query.prompt)
+        vector = self.vector(prompt)
+        self.recent[prompt] = vector
+        while len(self.recent) > 32:
+            self.recent.pop(next(iter(self.recent)))
+
+        for row, similarity in self.search(vector):
+            if similarity < self.threshold:
+                break
+            backend, model, reply = self.db.execute(
+                "select backend, model, reply from replies where row = ?", (row,)).fetchone()
+            if (backend, model) == (query.backend, query.model):
+                on_hit(query, reply, similarity)
+                return
+
+    def search(self, vector, k=TOP_K):
+        "The k most similar (row, similarity) pairs, best first"
+        if self.index is None:
+            return []
+        # Rows count from 1, and row n is vector n - 1
+        return [(i + 1, similarity) for i, similarity in self.index.search(vector, self.count, k)]
+
+    def _add(self, backend, model, prompt, reply):
+        self.insert(self.vector(prompt), backend, model, prompt, reply)
+
+    def insert(self, vector, backend, model, prompt, reply):
+        if self.index is None:
+            self.db.execute("insert or replace into meta values ('dimensions', ?)", (str(len(vector)),))
+            self.index = vectors.VectorIndex(self.path, len(vector))
+        self.index[self.count] = vector
+        self.db.execute(
+            "insert into replies values (?, ?, ?, ?, ?)", (self.count + 1, backend, model, prompt, reply))
+        self.db.commit()
+        self.count += 1
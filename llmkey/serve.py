@@ -1,38 +1,26 @@
 import logging
 import threading
-import tkinter as tk
+import time
 
 import pyperclip
 
 
 from . import (gui_first_run, gui_menu, gui_prompt, gui_reply, gui_settings,
-               gui_status, gui_tray, llm, runner, tk_tools, config, gui_first_run,
-               hotkeys, bus as bus_module)
-
-from .config import Config
-
-@config.with_config
-def one_off(conf, query):
-    backend, model = get_model_and_backend(conf)
-    logging.info("Sending one-off to %s %r", model, query)
-    return backend.query(model=model, query=query)
-
-def get_model_and_backend(conf: Config):
-    conf.load()
-    backend = llm.get(conf.backend)
-    model = conf.backend_models.get(backend.name, backend.default_model)
-    return backend, model
-
+               gui_status, gui_tray, llm, semantic, tk_tools, config,
+               breaker, windows, gui_history, gui_progress, history, hotkeys,
+               mapreduce, microbatch, prompts, retrieval, aio, daemon, timing,
+               warmup, bus as bus_module)
+from .queries import get_model_and_backend, one_off, remember
 
 class TkCallbacks:
-    def __init__(self, root, bus, tray, llm_runner):
+    def __init__(self, root, bus, tray, pool, reply_windows=20):
         self.root = root
         self.bus = bus
         self.tray = tray
-        self.llm_runner = llm_runner
-        self.query = None
-        self.reply_windows = []
-        self.display_window = None
+        self.pool = pool
+        self.queries = {}
+        self.streaming_windows = {}
+        self.reply_windows = windows.ReplyWindows(self.rebuild_reply, reply_windows)
 
     @staticmethod
     @gui_status.show_errors
@@ -42,117 +30,324 @@ class TkCallbacks:
     def quit(self, _):
         self.root.quit()
 
+    @property
+    def latest_query(self):
+        if not self.queries:
+            return None
+        return list(self.queries.values())[-1]
+
+    def chosen_query(self, event):
+        "The query picked from the menu, or the latest if none was"
+        if event.data is not None:
+            return self.queries.get(event.data)
+        return self.latest_query
+
+    def submit(self, query, event, bypass_cache=False):
+        "Run query in the pool, sending event with the query id when it is done"
+        def done(query):
+            remember(query)
+            self.bus.send("<<failed>>" if query.error else event, data=query.id)
+
+        def first_chunk(query):
+            self.bus.send("<<first_chunk>>", data=query.id)
+
+        self.queries[query.id] = query
+        if query.cached:
+            self.bus.send(event, data=query.id)
+            return
+
+        query.on_first_chunk = first_chunk
+        self.pool.submit(query, done)
+
+        # Skipping the cache skips similar replies too
+        similar = semantic.get_semantic() if not query.history and not bypass_cache else None
+        if similar:
+            similar.lookup(
+                query, lambda query, reply, similarity:
+                self.bus.send("<<similar_reply>>", data=(query.id, reply, similarity)))
+
     @gui_status.show_errors
     def one_off(self, _):
         if not ensure_settings_ready():
             return
 
-        if self.query:
-            gui_status.running(self.query.bytes, self.query.duration)
-            return
-
         conf = config.Config()
         conf.load()
 
         backend = llm.get(conf.backend)
-        model = conf.backend_models.get(conf.backend, backend.default_model)
+        model = conf.backend_models.get(conf.backend) or backend.default_model
+        if conf.warm_up:
+            warmup.start(backend, model)
 
-        query = gui_prompt.prompt_one_off(conf.backend, model)
+        @gui_status.show_errors
+        def prompted(prompt):
+            if prompt is None:
+                return
+            query, bypass_cache = prompt
+            self.submit(one_off(query, bypass_cache=bypass_cache), "<<one_off_finished>>", bypass_cache)
 
-        if query is None:
+        gui_prompt.prompt_one_off(conf.backend, model, prompted)
+
+    @gui_status.show_errors
+    def similar_reply(self, event):
+        id_, reply, similarity = event.data
+        if id_ not in self.queries:
             return
+        header = (
+            f"A prompt {similarity:.0%} like this one was answered before. This is that answer.\n"
+            "The query is still running. Cancel it from the menu if this answer will do.")
+        self.new_window(gui_reply.reply(self.bus, header, reply))
 
-        self.query = one_off(query)
-        self.llm_runner.run(self.query.run, "<<one_off_finished>>")
+    @gui_status.show_errors
+    def first_chunk(self, event):
+        query = self.queries.get(event.data)
+        if query:
+            window = gui_reply.stream_reply(self.bus, query)
+            self.streaming_windows[query.id] = window
+            self.new_window(window)
 
     @gui_status.show_errors
     def one_off_finished(self, event):
-        if self.query:
-            pyperclip.copy(event.data)
-            window = gui_reply.reply(self.bus, self.query.duration, event.data)
-            self.query = None
-            self.new_window(window)
+        query = self.queries.pop(event.data, None)
+        window = self.streaming_windows.pop(event.data, None)
+        if query and query.finished:
+            pyperclip.copy(query.reply)
+            if window:
+                window.finish(gui_reply.finished_header(query))
+            else:
+                window = gui_reply.reply(
+                    self.bus, gui_reply.finished_header(query), query.reply, query)
+                self.new_window(window)
 
     def new_window(self, window):
-        self.reply_windows.append(window)
-        self.display_window = window
+        self.reply_windows.add(window)
+
+    def rebuild_reply(self, hibernated):
+        return gui_reply.reply(self.bus, hibernated.header, hibernated.reply, hibernated.query, hibernated.id)
 
     @gui_status.show_errors
     def clipboard(self, _):
-        if self.query:
-            gui_status.running(self.query.bytes, self.query.duration)
+        if not ensure_settings_ready():
+            return
+
+        conf = config.Config()
+        backend, model = get_model_and_backend(conf)
+        if conf.warm_up:
+            warmup.start(backend, model)
+
+        clipboard = pyperclip.paste()
+        if mapreduce.oversized(clipboard, conf.chunk_tokens):
+            self.clipboard_chunked(conf, backend, model, clipboard)
+            return
+
+        @gui_status.show_errors
+        def prompted(prompt):
+            if prompt is None:
+                return
+            text, bypass_cache = prompt
+            message = prompts.from_clipboard(text, clipboard, conf.system_prompt)
+            if conf.retrieval_directories:
+                self.retrieve(message, bypass_cache, conf.retrieval_chunks)
+                return
+            self.submit(one_off(message, bypass_cache=bypass_cache), "<<clipboard_finished>>", bypass_cache)
+
+        gui_prompt.prompt_clipboard(clipboard, prompted)
+
+    def retrieve(self, message, bypass_cache, count):
+        "Search local documents on another thread, then send <<retrieved>> with the prompt to submit"
+        def run():
+            found = []
+            try:
+                index = retrieval.get_index()
+                if index:
+                    found = index.retrieve("\n\n".join([message.instruction, *message.documents]), count)
+            except Exception as e: #pylint: disable=broad-except
+                logging.warning("Could not search local documents: %s", e)
+            self.bus.send("<<retrieved>>", data=(retrieval.augment(message, found), bypass_cache))
+
+        thread = threading.Thread(target=run)
+        thread.daemon = True
+        thread.start()
+
+    @gui_status.show_errors
+    def retrieved(self, event):
+        message, bypass_cache = event.data
+        self.submit(one_off(message, bypass_cache=bypass_cache), "<<clipboard_finished>>", bypass_cache)
+
+    def clipboard_chunked(self, conf, backend, model, clipboard):
+        "Run the command on parts of the clipboard at once, then combine the answers"
+        chunks = mapreduce.split(clipboard, conf.chunk_tokens)
+        if len(chunks) > conf.max_chunks:
+            gui_status.warn(
+                f"The clipboard is about {mapreduce.tokens(clipboard)} tokens. In parts of at most "
+                f"{conf.chunk_tokens} tokens that is {len(chunks)} parts, more than max_chunks "
+                f"({conf.max_chunks}). Raise max_chunks in config.json to send it anyway.")
+            return
+
+        @gui_status.show_errors
+        def prompted(prompt):
+            if prompt is None:
+                return
+            command, _ = prompt
+            job = mapreduce.MapReduce(
+                self.pool, backend, model, command, chunks, conf.system_prompt)
+            job.start(lambda _: self.bus.send("<<reduce>>", data=job))
+            gui_progress.progress(job)
+
+        gui_prompt.prompt_clipboard_chunked(clipboard, len(chunks), prompted)
+
+    @gui_status.show_errors
+    def each_line(self, _):
+        if not ensure_settings_ready():
             return
 
-        message = gui_prompt.prompt_clipboard()
-        print("Got message: %s", message)
+        conf = config.Config()
+        backend, model = get_model_and_backend(conf)
+        lines = [line for line in pyperclip.paste().splitlines() if line.strip()]
+        if not lines:
+            gui_status.warn("The clipboard is empty")
+            return
+
+        @gui_status.show_errors
+        def prompted(prompt):
+            if prompt is None:
+                return
+            command, _ = prompt
+            job = microbatch.MicroBatch(self.pool, backend, model, command, lines, conf.micro_batch_size)
+            job.start(lambda _: self.bus.send("<<each_line_finished>>", data=job))
+            gui_progress.progress(job)
+
+        gui_prompt.prompt_each_line(len(lines), prompted)
+
+    @gui_status.show_errors
+    def each_line_finished(self, event):
+        job = event.data
+        pyperclip.copy(job.reply)
+        header = f"Answered {len(job.items)} lines in {len(job.queries)} requests."
+        if job.errors:
+            header += f" {len(job.errors)} failed and are left blank."
+        header += "\nThe answers have been written to the clipboard."
+        self.new_window(gui_reply.reply(self.bus, header, job.reply))
+
+    @gui_status.show_errors
+    def reduce(self, event):
+        job = event.data
+        if job.cancelled:
+            return
+        if job.reduce is None:
+            gui_status.failed(job.error)
+            return
+        self.submit(job.reduce, "<<clipboard_finished>>")
+
+    @gui_status.show_errors
+    def follow_up(self, event):
+        query = event.data
+        if not query.finished:
+            gui_status.warn("Wait for the reply to finish before following it up")
+            return
+
+        @gui_status.show_errors
+        def prompted(prompt):
+            if prompt is None:
+                return
+            text, _ = prompt
+            self.submit(query.follow_up(text), "<<one_off_finished>>")
 
-        self.query = one_off(message)
-        self.llm_runner.run(self.query.run, "<<clipboard_finished>>")
+        gui_prompt.prompt_follow_up(query, prompted)
 
     @gui_status.show_errors
     def clipboard_finished(self, event):
-        if self.query:
-            pyperclip.copy(event.data)
-            window = gui_reply.reply(self.bus, self.query.duration, event.data)
-            self.query = None
-            self.new_window(window)
+        self.one_off_finished(event)
 
     @gui_status.show_errors
     def failed(self, event):
-        self.query = None
-        gui_status.failed(event.data)
+        query = self.queries.pop(event.data, None)
+        window = self.streaming_windows.pop(event.data, None)
+        if window:
+            window.finish("This query failed.")
+        if query:
+            gui_status.failed(query.error)
+
+    @gui_status.show_errors
+    def status(self, event):
+        del event
+        gui_status.running(list(self.queries.values()), self.pool.queued)
 
     @gui_status.show_errors
     def close_last(self, event):
         del event
-        if self.reply_windows:
-            window = self.reply_windows.pop()
+        last = self.reply_windows.last
+        if last is not None:
+            window = self.reply_windows.remove(last)
+            if isinstance(window, windows.Hibernated):
+                return
             if not window.closed:
+                window.closed = True
                 window.destroy()
 
-            if self.reply_windows:
-                self.display_window = self.reply_windows[-1]
-            else:
-                self.display_window = None
-
     @gui_status.show_errors
     def close_reply(self, event):
-        id_ = event.data["id"]
-        i, windows = [(i, w) for i, w in enumerate(self.reply_windows) if w.id == id_]
-        if windows:
-            windows[0].destroy()
+        # The window has destroyed itself
+        self.reply_windows.remove(event.data["id"])
 
-        self.reply_windows.pop(i)
+    @gui_status.show_errors
+    def reply_streamed(self, event):
+        del event
+        # Streaming windows are kept past the cap until they finish
+        self.reply_windows.trim()
 
 
     @gui_status.show_errors
     def cycle_replies(self, event):
         del event
-        if self.display_window:
-            tk_tools.raise_window(self.display_window)
-            index, = [i for i, w in enumerate(self.reply_windows) if w.id == self.display_window.id]
-            new_index = (index - 1) % len(self.reply_windows)
-            self.display_window = self.reply_windows[new_index]
+        current = self.reply_windows.current
+        if current is not None:
+            tk_tools.raise_window(self.reply_windows.show(current))
+            self.reply_windows.current = self.reply_windows.previous(current)
 
 
     @gui_status.show_errors
     def peek(self, event):
-        del event
-        if not self.query:
+        query = self.chosen_query(event)
+        if not query:
             gui_status.not_running()
             return
 
-        pyperclip.copy(self.query.peek)
-        window = gui_reply.reply(self.bus, self.query.duration, self.query.peek)
-        self.reply_windows.append(window)
+        pyperclip.copy(query.peek)
+        window = gui_reply.reply(self.bus, gui_reply.peek_header(query), query.peek)
+        self.new_window(window)
 
     @gui_status.show_errors
-    def cancel(self, _):
+    def cancel(self, event):
         logging.info("Cancelling")
-        query = self.query
-        self.query = None
+        query = self.chosen_query(event)
         if query:
-            query.cancel()
+            self.queries.pop(query.id)
+            self.streaming_windows.pop(query.id, None)
+            self.pool.cancel(query)
+
+    @gui_status.show_errors
+    def history(self, _):
+        gui_history.search(self.bus)
+
+    @gui_status.show_errors
+    def history_open(self, event):
+        entry = history.get_history().get(event.data)
+        if entry is None:
+            return
+        pyperclip.copy(entry.reply)
+        when = time.strftime("%Y-%m-%d %H:%M", time.localtime(entry.created))
+        header = (
+            f"Asked {entry.backend} {entry.model} on {when}.\n"
+            "This answer has been written to the clipboard.")
+        self.new_window(gui_reply.reply(self.bus, header, entry.reply))
+
+    @staticmethod
+    @gui_status.show_errors
+    def export_timings(_):
+        path = config.ConfigIO.dir() / "timings.jsonl"
+        count = timing.export(path)
+        gui_status.info("Timings exported", f"Wrote {count} query timings to {path}")
 
     @gui_status.show_errors
     def about(self, _):
@@ -161,7 +356,7 @@ class TkCallbacks:
     @gui_status.show_errors
     def menu(self, event):
         del event
-        gui_menu.menu(self.bus, running=bool(self.query), conf=config.Config())
+        gui_menu.menu(self.bus, running=list(self.queries.values()), conf=config.Config())
 
 
 
@@ -192,20 +387,28 @@ def main():
         conf.first_run = False
         conf.save()
 
-    tk_root = tk.Tk()
+    if conf.backend:
+        # Bring the model list up to date before it is needed
+        llm.get(conf.backend).catalog.refresh()
+
+    tk_root = tk_tools.root()
+    # Built now so the first hotkey shows a prompt at once
+    gui_prompt.prebuild()
 
-    tk_root.withdraw()
+    bus = bus_module.Bus(tk_root)
 
-    tray = gui_tray.Tray(tk_root)
+    tray = gui_tray.Tray(bus)
     tray_thread = threading.Thread(target=tray.run)
     tray_thread.daemon = True
     tray_thread.start()
+    breaker.LISTENERS.append(lambda: tray.set_health(breaker.summary()))
 
 
-    llm_runner = runner.LlmRunner(tk_root)
+    pool = aio.engine(conf)
+    retrieval.start()
 
-    bus = bus_module.Bus(tk_root)
-    callbacks = TkCallbacks(tk_root, bus, tray, llm_runner)
+    callbacks = TkCallbacks(tk_root, bus, tray, pool, conf.reply_windows)
+    server = daemon.start(pool, bus)
 
     bus.bind("<<one_off>>", callbacks.one_off)
     bus.bind("<<quit>>", callbacks.quit)
@@ -215,13 +418,25 @@ def main():
     bus.bind("<<peek>>", callbacks.peek)
     bus.bind("<<about>>", callbacks.about)
     bus.bind("<<cancel>>", callbacks.cancel)
+    bus.bind("<<status>>", callbacks.status)
+    bus.bind("<<export_timings>>", callbacks.export_timings)
+    bus.bind("<<history>>", callbacks.history)
+    bus.bind("<<history_open>>", callbacks.history_open)
 
+    bus.bind("<<first_chunk>>", callbacks.first_chunk)
+    bus.bind("<<similar_reply>>", callbacks.similar_reply)
     bus.bind("<<one_off_finished>>", callbacks.one_off_finished)
     bus.bind("<<clipboard_finished>>", callbacks.clipboard_finished)
     bus.bind("<<failed>>", callbacks.failed)
     bus.bind("<<close_last>>", callbacks.close_last)
     bus.bind("<<reply_closed>>", callbacks.close_reply)
+    bus.bind("<<reply_streamed>>", callbacks.reply_streamed)
     bus.bind("<<cycle_replies>>", callbacks.cycle_replies)
+    bus.bind("<<follow_up>>", callbacks.follow_up)
+    bus.bind("<<reduce>>", callbacks.reduce)
+    bus.bind("<<retrieved>>", callbacks.retrieved)
+    bus.bind("<<each_line>>", callbacks.each_line)
+    bus.bind("<<each_line_finished>>", callbacks.each_line_finished)
 
 
     with hotkeys.KeyBinder({
@@ -229,4 +444,7 @@ def main():
         "<ctrl>+<alt>+c": lambda: bus.send("<<clipboard>>"),
         "<ctrl>+<alt>+m": lambda: bus.send("<<menu>>")
         }):
-        tk_root.mainloop()
+        try:
+            tk_root.mainloop()
+        finally:
+            server.server_close()
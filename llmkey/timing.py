@@ -0,0 +1,168 @@
+"Timings for each query, kept in a ring buffer"
+import array
+import collections
+import json
+import time
+
+# The most recent query timings
+RECORDS = collections.deque(maxlen=1000)
+
+def percentile(values, p):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))]
+
+def since(start, end):
+    if start is None or end is None:
+        return None
+    return end - start
+
+
+class Timing:
+    "Counters for a query. Updated as chunks arrive"
+
+    def __init__(self, backend=None, model=None):
+        self.backend = backend
+        self.model = model
+        self.created = time.time()
+        self.started = None
+        self.connected = None
+        self.first_chunk = None
+        self.last_chunk = None
+        self.finished = None
+        self.cancelled = None
+        # Who won, for raced and hedged queries
+        self.race = None
+        # Streamed chunks are roughly one token each
+        self.tokens = 0
+        self.bytes = 0
+        # Reported by openai compatible backends
+        self.prompt_tokens = None
+        self.cached_tokens = None
+        # Reported by ollama. Only the part of the prompt it did not have cached counts
+        self.prefill_tokens = None
+        self.prefill = None
+        self.gaps = array.array("d")
+        self.recorded = False
+
+    def start(self):
+        "Start an attempt. Retries and failovers start again, as nothing has arrived"
+        self.started = time.time()
+        self.connected = self.first_chunk = self.last_chunk = self.finished = None
+        self.prompt_tokens = self.cached_tokens = self.prefill_tokens = self.prefill = None
+        self.tokens = self.bytes = 0
+        self.gaps = array.array("d")
+
+    def connect(self):
+        self.connected = time.time()
+
+    def chunk(self, chunk):
+        now = time.time()
+        if self.first_chunk is None:
+            self.first_chunk = now
+        else:
+            self.gaps.append(now - self.last_chunk)
+        self.last_chunk = now
+        self.tokens += 1
+        self.bytes += len(chunk)
+
+    def prefilled(self, tokens, seconds):
+        self.prefill_tokens = tokens
+        self.prefill = seconds
+
+    def prompt_usage(self, tokens, cached):
+        self.prompt_tokens = tokens
+        self.cached_tokens = cached
+
+    def cancel(self):
+        self.cancelled = time.time()
+
+    def finish(self):
+        self.finished = time.time()
+        # Once for all attempts. The record shows the last
+        if not self.recorded:
+            self.recorded = True
+            RECORDS.append(self)
+
+    @property
+    def queue_wait(self):
+        return since(self.created, self.started)
+
+    @property
+    def connect_time(self):
+        return since(self.started, self.connected)
+
+    @property
+    def time_to_first_token(self):
+        return since(self.started, self.first_chunk)
+
+    @property
+    def cancel_latency(self):
+        "How long the stream took to stop after a cancel"
+        return since(self.cancelled, self.finished)
+
+    @property
+    def tokens_per_second(self):
+        duration = since(self.first_chunk, self.last_chunk)
+        if not duration:
+            return None
+        return (self.tokens - 1) / duration
+
+    def as_dict(self):
+        return dict(
+            backend=self.backend,
+            model=self.model,
+            created=self.created,
+            queue_wait=self.queue_wait,
+            connect_time=self.connect_time,
+            time_to_first_token=self.time_to_first_token,
+            duration=since(self.started, self.finished),
+            tokens=self.tokens,
+            bytes=self.bytes,
+            prompt_tokens=self.prompt_tokens,
+            cached_tokens=self.cached_tokens,
+            prefill_tokens=self.prefill_tokens,
+            prefill=self.prefill,
+            tokens_per_second=self.tokens_per_second,
+            cancel_latency=self.cancel_latency,
+            race=self.race,
+            gap_p50=percentile(self.gaps, 50),
+            gap_p90=percentile(self.gaps, 90),
+            gap_p99=percentile(self.gaps, 99),
+            gap_max=max(self.gaps, default=None))
+
+    def summary(self):
+        parts = []
+        if self.race:
+            won = f"{self.race['winner']} won the {self.race['mode']}"
+            if self.race["margin"] is not None:
+                won += f" by about {self.race['margin']:.2f}s"
+            parts.append(won)
+        if self.queue_wait and self.queue_wait >= 0.05:
+            parts.append(f"queued {self.queue_wait:.1f}s")
+        if self.connect_time is not None:
+            parts.append(f"connected in {self.connect_time:.2f}s")
+        if self.time_to_first_token is not None:
+            parts.append(f"first token after {self.time_to_first_token:.2f}s")
+        if self.prefill is not None:
+            parts.append(f"read {self.prefill_tokens} new prompt tokens in {self.prefill:.2f}s")
+        if self.cached_tokens:
+            parts.append(f"{self.cached_tokens} of {self.prompt_tokens} prompt tokens cached")
+        parts.append(f"{self.tokens} tokens, {self.bytes} bytes")
+        if self.tokens_per_second:
+            parts.append(f"{self.tokens_per_second:.1f} tokens/s")
+        if self.gaps:
+            parts.append(
+                f"gaps p50 {percentile(self.gaps, 50) * 1000:.0f}ms"
+                f" p99 {percentile(self.gaps, 99) * 1000:.0f}ms")
+        return ", ".join(parts)
+
+
+def export(path):
+    "Write the recorded timings to path as JSONL"
+    records = list(RECORDS)
+    with open(path, "w") as f:
+        for record in records:
+            f.write(json.dumps(record.as_dict()) + "\n")
+    return len(records)
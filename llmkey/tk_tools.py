@@ -1,4 +1,23 @@
 import time
+import tkinter as tk
+
+ROOT = None
+
+def root():
+    "The one tk interpreter. It stays hidden and every window is a Toplevel on it"
+    global ROOT #pylint: disable=global-statement
+    if ROOT is None:
+        ROOT = tk.Tk()
+        ROOT.withdraw()
+    return ROOT
+
+def window():
+    "A new top level window"
+    return tk.Toplevel(root())
+
+def wait(window_):
+    "Handle events, for every window, until window_ is closed"
+    window_.wait_window()
 
 def bind_click(button, callback):
     "Bind a click event for a button"
@@ -26,20 +45,6 @@ def drop_args(f):
         return f()
     return inner
 
-def my_bind(widget, sequence, func):
-    # Hack to include data
-    # https://stackoverflow.com/questions/16369947/python-tkinterhow-can-i-fetch-the-value-of-data-which-was-set-in-function-eve
-    def _substitute(*args):
-        e = lambda: None #simplest object with __dict__
-        e.data = args[0]
-        e.widget = widget
-        return (e,)
-
-    funcid = widget._register(func, _substitute, needcleanup=1) #pylint: disable=protected-access
-    cmd = 'if {{"[{} %d]" == "break"}} break\n'.format(funcid)
-    widget.tk.call('bind', widget._w, sequence, cmd) #pylint: disable=protected-access
-
-
 def fill_menu(menu, var, new: list[str], callback):
     "Populate a dropdown menu with new."
     options = menu["menu"]
@@ -0,0 +1,81 @@
+"Embedding vectors in memory mapped files, searched by cosine similarity with numpy"
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Cosine similarity over vectors squeezed to SKETCH dimensions picks CANDIDATES,
+# which are then compared in full. Squeezing keeps similarities to within about
+# 0.1, so this finds the same close match while reading a tenth of the memory.
+# Weak matches can be lost, so fewer than EXACT vectors are all compared in full
+SKETCH = 64
+CANDIDATES = 100
+EXACT = 20000
+INITIAL_CAPACITY = 1024
+
+def normalised(vector):
+    vector = numpy.asarray(vector, dtype=numpy.float32)
+    return vector / (numpy.linalg.norm(vector) or 1)
+
+
+class VectorIndex:
+    "Vector i is row i of vectors.f32 in path. The files grow as needed"
+
+    def __init__(self, path, dimensions, capacity=INITIAL_CAPACITY):
+        self.path = path
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.dimensions = dimensions
+        # Fixed, so sketches stay comparable between runs
+        projection = numpy.random.default_rng(0).standard_normal((dimensions, SKETCH))
+        self.projection = (projection / numpy.sqrt(SKETCH)).astype(numpy.float32)
+        self.vectors = self.sketches = None
+        self.open(max(capacity, INITIAL_CAPACITY))
+
+    def open(self, capacity):
+        "Map the files with room for capacity vectors"
+        if self.vectors is not None:
+            self.vectors.flush()
+            self.sketches.flush()
+        self.vectors = self.map("vectors.f32", capacity, self.dimensions)
+        self.sketches = self.map("sketches.f32", capacity, SKETCH)
+
+    def map(self, name, capacity, width):
+        path = self.path / name
+        size = capacity * width * 4
+        with open(path, "ab") as f:
+            if f.tell() < size:
+                f.truncate(size)
+        return numpy.memmap(path, dtype=numpy.float32, mode="r+", shape=(capacity, width))
+
+    def __setitem__(self, i, vector):
+        if i >= len(self.vectors):
+            self.open(max(i + 1, len(self.vectors) * 2))
+        vector = normalised(vector)
+        self.vectors[i] = vector
+        self.sketches[i] = vector @ self.projection
+
+    def __getitem__(self, i):
+        return self.vectors[i]
+
+    def search(self, vector, count, k, live=None, candidates=CANDIDATES):
+        """The k vectors among the first count most similar to vector, as (i, similarity)
+        pairs, best first. live is a mask of the vectors to consider"""
+        vector = normalised(vector)
+        if not count or len(vector) != self.dimensions:
+            return []
+        if count <= max(EXACT, candidates):
+            # A slice of the map is read in place. Indexing with every row would copy it
+            similarities = self.vectors[:count] @ vector
+            if live is not None:
+                similarities[~live[:count]] = -numpy.inf
+            chosen = numpy.arange(count)
+        else:
+            scores = self.sketches[:count] @ (vector @ self.projection)
+            if live is not None:
+                scores[~live[:count]] = -numpy.inf
+            chosen = numpy.argpartition(-scores, candidates)[:candidates]
+            if live is not None:
+                chosen = chosen[live[chosen]]
+            similarities = self.vectors[chosen] @ vector
+        best = numpy.argsort(-similarities)[:k]
+        return [(int(chosen[i]), float(similarities[i])) for i in best if similarities[i] > -numpy.inf]
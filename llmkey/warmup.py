@@ -0,0 +1,37 @@
+"Warm up a backend while the user is typing a prompt"
+import logging
+import threading
+import time
+
+# Do not warm the same model again within this many seconds
+WARM_INTERVAL = 30
+
+last_warmed = {}
+
+def start(backend, model):
+    key = (backend.name, model)
+    if time.time() - last_warmed.get(key, 0) < WARM_INTERVAL:
+        return
+    last_warmed[key] = time.time()
+
+    thread = threading.Thread(target=warm, args=(backend, model))
+    thread.daemon = True
+    thread.start()
+
+def warm(backend, model):
+    try:
+        start_time = time.time()
+        model = model or backend.wait_default_model()
+        backend.warm(model)
+        logging.info("Warmed %s %s in %.2fs", backend.name, model, time.time() - start_time)
+    except Exception: #pylint: disable=broad-except
+        logging.exception("Could not warm up %s %s", backend.name, model)
+
+
+def time_to_first_chunk(backend, model, prompt):
+    query = backend.query(model, prompt)
+    start_time = time.time()
+    for _ in query.stream:
+        break
+    query.stream.close()
+    return time.time() - start_time
@@ -0,0 +1,113 @@
+"""Reply windows in the order they were opened, indexed by id. Past a cap, the least
+recently viewed are hibernated: destroyed, keeping just enough to build them again"""
+import collections
+import zlib
+
+
+class Hibernated:
+    "A destroyed reply window's header and compressed text"
+
+    def __init__(self, window):
+        self.id = window.id
+        self.header = window.header["text"]
+        self.query = window.query
+        self.text = zlib.compress(window.reply_text.get("1.0", "end-1c").encode("utf8"))
+        if self.query is not None and self.query.finished:
+            # Thousands of streamed chunks become one string
+            self.query.reply_buffer = [self.query.reply]
+
+    @property
+    def reply(self):
+        return zlib.decompress(self.text).decode("utf8")
+
+
+class ReplyWindows:
+    "build(hibernated) makes a window again with the same id"
+
+    def __init__(self, build, cap):
+        self.build = build
+        self.cap = cap
+        self.entries = {}
+        # Links in the order windows were opened, so cycling and closing the last are O(1)
+        self.before = {}
+        self.after = {}
+        self.last = None
+        # Ids of live windows, least recently viewed first
+        self.live = collections.OrderedDict()
+        # The window cycling shows next
+        self.current = None
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, id_):
+        return id_ in self.entries
+
+    def add(self, window):
+        id_ = window.id
+        self.entries[id_] = window
+        self.before[id_] = self.last
+        self.after[id_] = None
+        if self.last is not None:
+            self.after[self.last] = id_
+        self.last = id_
+        self.live[id_] = None
+        self.current = id_
+        self.trim(keep=id_)
+
+    def remove(self, id_):
+        "Forget id_, returning its window or Hibernated, or None if it is unknown"
+        entry = self.entries.pop(id_, None)
+        if entry is None:
+            return None
+        before, after = self.before.pop(id_), self.after.pop(id_)
+        if before is not None:
+            self.after[before] = after
+        if after is not None:
+            self.before[after] = before
+        if self.last == id_:
+            self.last = before
+        self.live.pop(id_, None)
+        if self.current == id_:
+            self.current = before if before is not None else self.last
+        return entry
+
+    def previous(self, id_):
+        "The window opened before id_, wrapping round to the last"
+        before = self.before[id_]
+        return before if before is not None else self.last
+
+    def show(self, id_):
+        "The window for id_, built again if it was hibernated. It counts as viewed"
+        entry = self.entries[id_]
+        if isinstance(entry, Hibernated):
+            entry = self.build(entry)
+            self.entries[id_] = entry
+            self.live[id_] = None
+            self.trim(keep=id_)
+        self.live.move_to_end(id_)
+        return entry
+
+    def trim(self, keep=None):
+        "Hibernate the least recently viewed windows past the cap. Streaming windows are left alone"
+        excess = len(self.live) - self.cap
+        for id_ in list(self.live):
+            if excess <= 0:
+                break
+            window = self.entries[id_]
+            if window.closed:
+                # Destroyed itself. Its <<reply_closed>> may not have arrived yet
+                self.remove(id_)
+                excess -= 1
+                continue
+            if id_ == keep or window.streaming:
+                continue
+            self.entries[id_] = Hibernated(window)
+            del self.live[id_]
+            window.closed = True
+            window.destroy()
+            excess -= 1
+
+    @property
+    def hibernated(self):
+        return len(self.entries) - len(self.live)
@@ -29,6 +29,6 @@ setuptools.setup(
     ],
     long_description=open('README.md').read(),
     entry_points={
-        'console_scripts': ['llm-key=llmkey.serve:main']
+        'console_scripts': ['llm-key=llmkey.cli:main']
     },
 )
@@ -0,0 +1,50 @@
+"""Threads against asyncio at 1, 10 and 100 streams from a fake server.
+Each measurement runs in a new process so memory use is not shared"""
+import resource
+import subprocess
+import sys
+import threading
+import time
+
+import fake
+from llmkey import aio, runner
+
+def measure(kind, count, port):
+    backend = fake.FakeOpenaiBackend(port)
+    pool = aio.AsyncEngine(count) if kind == "asyncio" else runner.QueryPool(count)
+    finished = threading.Semaphore(0)
+    before = resource.getrusage(resource.RUSAGE_SELF)
+    start = time.time()
+    peak_threads = 0
+    queries = [
+        pool.submit(backend.query("fake", f"question {i}"), lambda _: finished.release())
+        for i in range(count)]
+    for _ in range(count):
+        peak_threads = max(peak_threads, threading.active_count())
+        finished.acquire()
+    after = resource.getrusage(resource.RUSAGE_SELF)
+    switches = (after.ru_nvcsw + after.ru_nivcsw) - (before.ru_nvcsw + before.ru_nivcsw)
+    print(
+        f"{kind:8} {count:4d} streams: {time.time() - start:5.2f}s"
+        f" max rss {after.ru_maxrss / 1024:6.1f}MB"
+        f" context switches {switches:7d} threads {peak_threads}"
+        f" failed {sum(1 for q in queries if q.error)}")
+
+def main():
+    if sys.argv[1:2] == ["measure"]:
+        measure(sys.argv[2], int(sys.argv[3]), int(sys.argv[4]))
+        return
+
+    server, port = fake.serve_process(latency=0.2, chunks=200, chunk_delay=0.005)
+    try:
+        for count in (1, 10, 100):
+            for kind in ("threads", "asyncio"):
+                subprocess.run(
+                    [sys.executable, __file__, "measure", kind, str(count), str(port)],
+                    check=True)
+    finally:
+        server.kill()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,39 @@
+"Events/s and dispatch latency of the bus with several threads sending at once"
+import threading
+import time
+import tkinter as tk
+
+from llmkey import bus, timing
+
+def main():
+    root = tk.Tk()
+    root.withdraw()
+    events = bus.Bus(root)
+    threads = 8
+    per_thread = 20000
+    latencies = []
+    payload = "x" * 100000
+
+    def received(event):
+        latencies.append(time.time() - event.sent)
+        if len(latencies) == threads * per_thread:
+            root.quit()
+
+    def send():
+        for _ in range(per_thread):
+            events.send("<<stress>>", data=payload)
+
+    events.bind("<<stress>>", received)
+    start = time.time()
+    for _ in range(threads):
+        threading.Thread(target=send, daemon=True).start()
+    root.mainloop()
+    duration = time.time() - start
+
+    print(f"{len(latencies) / duration:.0f} events/s from {threads} threads")
+    for p in (50, 90, 99):
+        print(f"dispatch latency p{p}: {timing.percentile(latencies, p) * 1000:.1f}ms")
+
+
+if __name__ == '__main__':
+    main()
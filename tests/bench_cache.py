@@ -0,0 +1,23 @@
+"Lookup times for cache hits held in memory and read from disk"
+import tempfile
+import time
+from pathlib import Path
+
+from llmkey import cache
+
+def main():
+    with tempfile.TemporaryDirectory() as d:
+        store = cache.ResponseCache(Path(d) / "cache.sqlite", memory_entries=10, max_entries=1000)
+        for i in range(2000):
+            store.put("fake", "fake", f"prompt {i}", "reply " * 100)
+
+        for label, prompts in [("memory", range(1990, 2000)), ("disk", range(1000, 1990))]:
+            start = time.time()
+            for i in prompts:
+                assert store.get("fake", "fake", f"prompt {i}  \n") is not None
+            print(f"{label} hit: {(time.time() - start) / len(prompts) * 1000:.3f}ms")
+        print(store.stats)
+
+
+if __name__ == '__main__':
+    main()
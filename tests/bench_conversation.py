@@ -0,0 +1,28 @@
+"""Time ollama spends reading the prompt at each turn of a conversation.
+With the earlier turns cached it stays flat. Unloading the model before
+each turn drops the cache, so the whole history is read every time.
+Needs a running ollama. The model is the first argument"""
+import sys
+
+from llmkey import llm
+
+def main():
+    backend = llm.OllamaBackend()
+    model = sys.argv[1] if len(sys.argv) > 1 else backend.default_model
+
+    for reuse in (True, False):
+        history = ()
+        for turn in range(1, 9):
+            if not reuse:
+                backend.cool(model)
+            query = backend.query(model, f"Write a paragraph about the number {turn}.", history)
+            query.run()
+            history = query.history + ((query.prompt, query.reply),)
+            length = sum(len(p) + len(r) for p, r in query.history)
+            print(
+                f"reuse={reuse!s:5} turn {turn}: {length:6d} characters of history,"
+                f" read {query.timing.prefill_tokens} prompt tokens in {query.timing.prefill:.2f}s")
+
+
+if __name__ == '__main__':
+    main()
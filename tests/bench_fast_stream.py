@@ -0,0 +1,44 @@
+"Chunks/s for parsing streams into model objects and parsing them raw"
+import json
+import time
+
+from openai.types.chat import ChatCompletionChunk
+
+import fake
+from llmkey import fast_stream
+
+def rate(label, count, duration):
+    print(f"{label:40} {count / duration:10.0f} chunks/s")
+
+def main():
+    count = 20000
+    sse = [fake.openai_event(f"word{i} ").decode("utf8").strip() for i in range(count)]
+    ndjson = [fake.ollama_line(f"word{i} ").decode("utf8").strip() for i in range(count)]
+
+    start = time.time()
+    for line in sse:
+        ChatCompletionChunk.model_validate(json.loads(line[5:])).choices[0].delta.content
+    rate("parse sse with ChatCompletionChunk", count, time.time() - start)
+
+    start = time.time()
+    for _ in fast_stream.sse_content(sse):
+        pass
+    rate("parse sse raw", count, time.time() - start)
+
+    start = time.time()
+    for _ in fast_stream.ndjson_content(ndjson):
+        pass
+    rate("parse ndjson raw", count, time.time() - start)
+
+    server = fake.serve(latency=0, chunks=count, chunk_delay=0)
+    backend = fake.FakeOpenaiBackend(server.server_address[1])
+    for fast in (False, True):
+        backend.fast_stream = fast
+        query = backend.query("fake", "question")
+        start = time.time()
+        query.run()
+        rate(f"fake server fast_stream={fast}", query.timing.tokens, time.time() - start)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,30 @@
+"""Time from the hotkey to a focused text box, building a dialog each time
+and reusing a hidden one. Needs a display, so run it under xvfb-run"""
+import time
+
+from llmkey import gui_prompt, tk_tools
+
+def main():
+    root = tk_tools.root()
+    for name, reuse in [("build each time", False), ("reuse hidden", True)]:
+        gui_prompt.prebuild()
+        durations = []
+        for i in range(30):
+            if not reuse:
+                gui_prompt.FREE_DIALOGS.clear()
+            focused = []
+            start = time.time()
+            dialog = gui_prompt.prompt(f"Prompt {i}", "One-off LLM Prompt", "", lambda _: None)
+            dialog.ui.textArea.bind("<FocusIn>", lambda _: focused.append(time.time()))
+            while not focused and time.time() - start < 5:
+                root.update()
+            durations.append((focused[0] if focused else time.time()) - start)
+            dialog.callback_ui(dialog.ui, "cancel", "")
+            if not reuse:
+                dialog.ui.boxRoot.destroy()
+        durations.sort()
+        print(f"{name:16} p50 {durations[15] * 1000:.1f}ms max {durations[-1] * 1000:.1f}ms")
+
+
+if __name__ == '__main__':
+    main()
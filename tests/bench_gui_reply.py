@@ -0,0 +1,59 @@
+"""Streaming a fast fake reply into a window, to check that tk keeps up.
+With the argument windows, memory and time for each open reply window as a
+Toplevel on the shared root and as a tk.Tk of its own. Needs a display"""
+import os
+import subprocess
+import sys
+import threading
+import time
+import tkinter as tk
+
+import fake
+from llmkey import bus, gui_reply, tk_tools
+
+def stream():
+    backend = fake.FakeBackend(latency=0.2, chunks=20000, chunk_delay=0.0002)
+    query = backend.query("fake", "question")
+    window = gui_reply.stream_reply(bus.MockBus(), query)
+
+    def run():
+        query.run()
+        window.after(0, window.finish, gui_reply.finished_header(query))
+
+    threading.Thread(target=run, daemon=True).start()
+    tk_tools.wait(window)
+
+def rss():
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+def windows(kind=None, count=50):
+    # Each kind runs in a process of its own
+    if kind is None:
+        for kind in ("toplevel", "tk"):
+            subprocess.run([sys.executable, __file__, "windows", kind], check=True)
+        return
+
+    if kind == "tk":
+        tk_tools.window = tk.Tk
+    tk_tools.root().update()
+    before = rss()
+    durations = []
+    opened = []
+    for i in range(count):
+        start = time.time()
+        window = gui_reply.reply(bus.MockBus(), "header", f"reply {i}\n" * 100)
+        window.update()
+        durations.append(time.time() - start)
+        opened.append(window)
+    print(
+        f"{kind:8} {(rss() - before) / count / 1e6:.2f}MB a window,"
+        f" opened in p50 {sorted(durations)[count // 2] * 1000:.1f}ms"
+        f" max {max(durations) * 1000:.1f}ms")
+
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ["windows"]:
+        windows(*sys.argv[2:3])
+    else:
+        stream()
@@ -0,0 +1,51 @@
+"""Time to first token for a backend that sometimes hangs, alone, raced
+against a steady one, and hedged with it"""
+import random
+import threading
+
+import fake
+from llmkey import hedge, runner, timing
+
+
+class Flaky(fake.FakeBackend):
+    "Usually fast, but one query in ten hangs"
+    name = "flaky"
+    def __init__(self): #pylint: disable=super-init-not-called
+        self.chunks = 5
+        self.chunk_delay = 0.01
+
+    @property
+    def latency(self):
+        return 3 if random.random() < 0.1 else random.uniform(0.05, 0.15)
+
+
+def main():
+    flaky = Flaky()
+    steady = fake.FakeBackend(latency=0.3, chunks=5)
+    count = 100
+
+    def measure(make):
+        # Room for both candidates of every query
+        pool = runner.QueryPool(2 * count, rate_limit=False)
+        finished = threading.Semaphore(0)
+        queries = [make(i) for i in range(count)]
+        for q in queries:
+            pool.submit(q, lambda _: finished.release())
+        for _ in range(count):
+            finished.acquire()
+        return [q.timing.time_to_first_token for q in queries]
+
+    # Learn flaky's times to first token
+    measure(lambda i: flaky.query("fake", f"question {i}"))
+    for name, make in [
+            ("alone", lambda i: flaky.query("fake", f"question {i}")),
+            ("race", lambda i: hedge.query(flaky, "fake", f"question {i}", [(steady, "fake")], "race")),
+            ("hedge", lambda i: hedge.query(flaky, "fake", f"question {i}", [(steady, "fake")], "hedge"))]:
+        ttfts = measure(make)
+        print(
+            f"{name:6} first token p50 {timing.percentile(ttfts, 50):.2f}s"
+            f" p99 {timing.percentile(ttfts, 99):.2f}s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,35 @@
+"Search times over a hundred thousand history entries"
+import random
+import tempfile
+import time
+from pathlib import Path
+
+from llmkey import history, llm
+
+def main():
+    words = "apple banana cherry docker python kernel invoice email french summary".split()
+    with tempfile.TemporaryDirectory() as d:
+        store = history.HistoryStore(Path(d) / "history.sqlite")
+        start = time.time()
+        for i in range(100000):
+            text = " ".join(random.choice(words) for _ in range(30))
+            query = llm.LlmQuery.from_reply(
+                f"reply {i} {text}", backend="fake", model="fake", prompt=f"prompt {i} {text}")
+            store.add(query)
+        store.flush()
+        print(f"wrote {store.count()} entries in {time.time() - start:.1f}s")
+
+        for text in ["", "docker", "pyth kern", "prompt 99999", "nothing matches this"]:
+            start = time.time()
+            for _ in range(20):
+                results = store.search(text)
+            duration = (time.time() - start) / 20
+            print(f"search {text!r:24} {len(results):2d} results in {duration * 1000:.1f}ms")
+
+        start = time.time()
+        store.get(results[0].id if results else 1)
+        print(f"open an entry in {(time.time() - start) * 1000:.2f}ms")
+
+
+if __name__ == '__main__':
+    main()
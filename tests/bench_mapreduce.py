@@ -0,0 +1,35 @@
+"""A few megabytes of log sent as one prompt, and mapped over chunks in
+parallel then reduced, against a fake server that reads prompts serially"""
+import threading
+import time
+
+import fake
+from llmkey import mapreduce, prompts, runner
+
+def main():
+    server = fake.serve(latency=0.05, chunks=20, chunk_delay=0.01, prefill_per_token=0.00001)
+    backend = fake.FakeOpenaiBackend(server.server_address[1])
+    text = "".join(f"12:00:{i % 60:02d} worker {i % 7} handled request {i}\n" for i in range(60000))
+    pool = runner.QueryPool(8)
+    print(f"{len(text) / 1e6:.1f}MB, about {mapreduce.tokens(text)} tokens")
+
+    start = time.time()
+    query = backend.query("fake", prompts.Prompt("Summarise this log", [text]))
+    query.run()
+    print(f"one prompt: {time.time() - start:.2f}s")
+
+    for chunk_tokens in (4000, 16000):
+        start = time.time()
+        finished = threading.Event()
+        chunks = mapreduce.split(text, chunk_tokens)
+        job = mapreduce.MapReduce(pool, backend, "fake", "Summarise this log", chunks)
+        job.start(lambda reduce: pool.submit(reduce, lambda _: finished.set()))
+        finished.wait()
+        print(
+            f"map reduce over {len(job.maps)} chunks of {chunk_tokens} tokens"
+            f" with a pool of 8: {time.time() - start:.2f}s")
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
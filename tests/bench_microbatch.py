@@ -0,0 +1,32 @@
+"""Items one request each, and packed into batches, against a fake server
+with a quota of 20 requests a second which answers in the packed format.
+Items with a ! are left out of packed answers so they are retried"""
+import threading
+import time
+
+import fake
+from llmkey import microbatch, runner
+
+def main():
+    server = fake.serve(latency=0.2, chunk_delay=0.001, requests_per_second=20, echo=True)
+    backend = fake.FakeOpenaiBackend(server.server_address[1])
+    items = [f"item {i}" + ("!" if i % 50 == 7 else "") for i in range(200)]
+
+    for size in (1, 20):
+        pool = runner.QueryPool(8)
+        finished = threading.Event()
+        job = microbatch.MicroBatch(pool, backend, "fake", "Shout this", items, size)
+        start = time.time()
+        job.start(lambda _: finished.set())
+        finished.wait()
+        duration = time.time() - start
+        wrong = sum(1 for item, answer in zip(items, job.answers) if answer != item.upper())
+        print(
+            f"{size:2d} items a request: {len(job.queries):3d} requests in {duration:5.2f}s,"
+            f" {len(job.queries) / duration:5.1f} requests/s, {len(items) / duration:6.1f} items/s,"
+            f" {job.retried} retried, {wrong} wrong")
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,30 @@
+"""Several commands over one long clipboard, with the command first and with
+the clipboard first, against a fake server that caches prefixes like openai"""
+import fake
+from llmkey import prompts
+
+def main():
+    server = fake.serve(latency=0.05, chunks=3, prefill_per_token=0.0001)
+    backend = fake.FakeOpenaiBackend(server.server_address[1])
+    clipboard = " ".join(f"Line {i} of a long document." for i in range(1500))
+    commands = ["Summarise this", "List the names in this", "Translate this to French",
+                "Find the mistakes in this", "Give this a title"]
+
+    for name, make in [
+            ("command first", lambda c: f"{c}\n\n{clipboard}"),
+            ("clipboard first", lambda c: prompts.from_clipboard(f"{c}\n\n{clipboard}", clipboard))]:
+        for command in commands:
+            query = backend.query("fake", make(command))
+            query.run()
+            timing = query.timing
+            # Cached input tokens are billed at half price
+            cost = (timing.prompt_tokens - timing.cached_tokens / 2) / timing.prompt_tokens
+            print(
+                f"{name:16} first token after {timing.time_to_first_token:.2f}s,"
+                f" {timing.cached_tokens:5d} of {timing.prompt_tokens} prompt tokens cached,"
+                f" input cost {cost:.0%}")
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
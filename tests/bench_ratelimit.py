@@ -0,0 +1,32 @@
+"A burst of queries against a fake server with a quota, with and without limiting"
+import threading
+import time
+
+import fake
+from llmkey import runner
+
+def main():
+    quota = 20
+    count = 200
+    for rate_limit in (False, True):
+        server = fake.serve(latency=0.05, chunks=5, chunk_delay=0.01, requests_per_second=quota)
+        backend = fake.FakeOpenaiBackend(server.server_address[1])
+        pool = runner.QueryPool(32, rate_limit=rate_limit)
+        finished = threading.Semaphore(0)
+        start = time.time()
+        queries = [
+            pool.submit(backend.query("fake", f"question {i}"), lambda _: finished.release())
+            for i in range(count)]
+        for _ in queries:
+            finished.acquire()
+        duration = time.time() - start
+        answered = sum(1 for q in queries if q.finished)
+        print(
+            f"rate_limit={rate_limit}: {answered}/{count} answered in {duration:.1f}s,"
+            f" {answered / duration:.1f}/s against a quota of {quota}/s,"
+            f" {server.throttled} 429s from the server")
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
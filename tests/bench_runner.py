@@ -0,0 +1,65 @@
+"Replies per minute as the query pool grows, and how fast cancelling frees a slot"
+import os
+import threading
+import time
+
+import fake
+from llmkey import aio, llm, runner
+
+def cancel_latency():
+    # Cancel streams stalled waiting for a chunk. Released is when done is
+    # called and the slot is free. Stopped is when the worker's read gave up
+    server = fake.serve(latency=0.05, chunks=3, chunk_delay=30)
+    port = server.server_address[1]
+    os.environ["OLLAMA_HOST"] = f"127.0.0.1:{port}"
+    fast_ollama = llm.OllamaBackend()
+    fast_ollama.fast_stream = True
+    fast_openai = fake.FakeOpenaiBackend(port)
+    fast_openai.fast_stream = True
+    backends = dict(
+        ollama=llm.OllamaBackend(), ollama_fast=fast_ollama,
+        openai=fake.FakeOpenaiBackend(port), openai_fast=fast_openai)
+
+    for engine in ("threads", "asyncio"):
+        pool = aio.AsyncEngine(4) if engine == "asyncio" else runner.QueryPool(4)
+        for name, backend in backends.items():
+            released, stopped = [], []
+            for i in range(5):
+                done = threading.Event()
+                query = backend.query("fake", f"question {i}")
+                pool.submit(query, lambda _, done=done: done.set())
+                while query.timing.started is None:
+                    time.sleep(0.001)
+                # Past the fake server's latency, so the reply has stalled
+                time.sleep(0.2)
+                start = time.time()
+                pool.cancel(query)
+                done.wait()
+                released.append(time.time() - start)
+                while query.timing.finished is None:
+                    time.sleep(0.001)
+                stopped.append(query.timing.cancel_latency)
+            print(
+                f"{engine:8} {name:12} cancel to release {max(released) * 1000:6.2f}ms"
+                f" stopped {max(stopped) * 1000:6.2f}ms (worst of 5)")
+    server.shutdown()
+
+def main():
+    # Replies per minute against a fake backend as the pool grows
+    backend = fake.FakeBackend(latency=0.5, chunks=20, chunk_delay=0.01)
+    count = 32
+    for size in (1, 2, 4, 8, 16):
+        pool = runner.QueryPool(size)
+        finished = threading.Semaphore(0)
+        start = time.time()
+        for i in range(count):
+            pool.submit(backend.query("fake", f"question {i}"), lambda _: finished.release())
+        for _ in range(count):
+            finished.acquire()
+        duration = time.time() - start
+        print(f"pool size {size:2d}: {count / duration * 60:7.1f} replies/min")
+    cancel_latency()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,44 @@
+"""Lookups among a hundred thousand vectors the size of nomic-embed-text's,
+for near duplicates at a cosine of 0.9"""
+import tempfile
+import time
+from pathlib import Path
+
+from llmkey import vectors
+
+def main():
+    numpy = vectors.numpy
+    rng = numpy.random.default_rng(1)
+    dimensions = 768
+    count = 100000
+    with tempfile.TemporaryDirectory() as d:
+        index = vectors.VectorIndex(Path(d), dimensions)
+        start = time.time()
+        added = rng.standard_normal((count, dimensions)).astype(numpy.float32)
+        for i, vector in enumerate(added):
+            index[i] = vector
+        print(f"added {count} vectors in {time.time() - start:.1f}s")
+
+        found = 0
+        durations = []
+        for _ in range(200):
+            i = int(rng.integers(count))
+            noise = vectors.normalised(rng.standard_normal(dimensions))
+            near = 0.9 * index[i] + numpy.sqrt(1 - 0.9 ** 2) * noise
+            start = time.time()
+            results = index.search(near, count, 5)
+            durations.append(time.time() - start)
+            found += results[0][0] == i
+
+        full = time.time()
+        similarities = index.vectors[:count] @ vectors.normalised(near)
+        numpy.argpartition(-similarities, 5)[:5]
+        full = time.time() - full
+        print(
+            f"lookup p50 {sorted(durations)[100] * 1000:.1f}ms"
+            f" p99 {sorted(durations)[198] * 1000:.1f}ms,"
+            f" found {found} of 200 near duplicates. Comparing every vector takes {full * 1000:.1f}ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,23 @@
+"""Time to first token with and without warm up for the configured backend,
+or the backend given as the first argument"""
+import sys
+
+from llmkey import config, llm, warmup
+
+def main():
+    conf = config.Config()
+    conf.load()
+    name = sys.argv[1] if len(sys.argv) > 1 else conf.backend
+    for warm_first in (False, True):
+        # A new backend object has no open connection
+        backend = llm.MODEL_CLASSES[name]()
+        model = conf.backend_models.get(name, backend.default_model)
+        backend.cool(model)
+        if warm_first:
+            backend.warm(model)
+        ttft = warmup.time_to_first_chunk(backend, model, "Say hello")
+        print(f"{name} {model} warm={warm_first}: first token after {ttft:.2f}s")
+
+
+if __name__ == '__main__':
+    main()
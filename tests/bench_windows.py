@@ -0,0 +1,35 @@
+"""Resident memory while opening hundreds of replies, all kept open and
+with all but 20 hibernated. Needs a display, so run it under xvfb-run"""
+import os
+import subprocess
+import sys
+
+from llmkey import bus, gui_reply, tk_tools, windows
+
+def rss():
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+def main():
+    if len(sys.argv) < 2:
+        for cap in ("1000", "20"):
+            subprocess.run([sys.executable, __file__, cap], check=True)
+        return
+
+    root = tk_tools.root()
+    root.update()
+    mock = bus.MockBus()
+    replies = windows.ReplyWindows(
+        lambda h: gui_reply.reply(mock, h.header, h.reply, h.query, h.id), int(sys.argv[1]))
+    start = rss()
+    for i in range(1, 501):
+        replies.add(gui_reply.reply(mock, "header", f"reply {i} " * 2000))
+        root.update()
+        if i % 100 == 0:
+            print(
+                f"cap {replies.cap:4d}: {i} replies, {replies.hibernated:3d} hibernated,"
+                f" {(rss() - start) / 1e6:6.1f}MB more resident")
+
+
+if __name__ == '__main__':
+    main()
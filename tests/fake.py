@@ -0,0 +1,304 @@
+"A local fake backend and server for benchmarks"
+import argparse
+import collections
+import hashlib
+import http.server
+import json
+import re
+import subprocess
+import sys
+import threading
+import time
+
+from llmkey import llm
+
+
+class FakeBackend(llm.Backend):
+    name = "fake"
+    needs_credentials = False
+
+    class Stream(llm.ResponseStream):
+        def __init__(self, model, query, backend, history=()):
+            self.model = model
+            self.query = query
+            self.backend = backend
+            self.history = history
+            self.closed = threading.Event()
+
+        def __iter__(self):
+            if self.closed.wait(self.backend.latency):
+                return
+            self.connected()
+            for i in range(self.backend.chunks):
+                if self.closed.wait(self.backend.chunk_delay):
+                    return
+                yield f"word{i} "
+
+        def close(self):
+            self.closed.set()
+
+        def hang_up(self):
+            self.closed.set()
+
+    def __init__(self, latency=0.5, chunks=20, chunk_delay=0.01):
+        self.latency = latency
+        self.chunks = chunks
+        self.chunk_delay = chunk_delay
+
+    def fetch_models(self):
+        return ["fake"]
+
+    @property
+    def models(self):
+        return self.fetch_models()
+
+    @property
+    def default_model(self):
+        return "fake"
+
+    def next_model(self, current):
+        return llm.list_next(self.models, current)
+
+    def query(self, model, query, history=()):
+        return llm.LlmQuery(
+            self.Stream(model, query, self, history),
+            backend=self.name, model=model, prompt=query, history=history)
+
+
+class FakeOpenaiBackend(llm.OpenaiBackend):
+    "The openai backend pointed at a FakeServer"
+    name = "fake-openai"
+
+    class Stream(llm.OpenaiBackend.Stream):
+        pass
+
+    class FastStream(llm.OpenaiBackend.FastStream):
+        pass
+
+    def __init__(self, port):
+        super().__init__()
+        self.base_url = f"http://127.0.0.1:{port}/v1"
+
+    def key(self):
+        return "fake"
+
+
+def openai_event(content):
+    chunk = dict(
+        id="fake", object="chat.completion.chunk", created=0, model="fake",
+        choices=[dict(index=0, delta=dict(content=content), finish_reason=None)])
+    return b"data: " + json.dumps(chunk).encode("utf8") + b"\n\n"
+
+def openai_usage(prompt_tokens, cached_tokens):
+    chunk = dict(
+        id="fake", object="chat.completion.chunk", created=0, model="fake", choices=[],
+        usage=dict(
+            prompt_tokens=prompt_tokens, completion_tokens=0, total_tokens=prompt_tokens,
+            prompt_tokens_details=dict(cached_tokens=cached_tokens)))
+    return b"data: " + json.dumps(chunk).encode("utf8") + b"\n\n"
+
+def ollama_line(content, done=False, **stats):
+    chunk = dict(
+        model="fake", created_at="2024-01-01T00:00:00Z",
+        message=dict(role="assistant", content=content), done=done, **stats)
+    return json.dumps(chunk).encode("utf8") + b"\n"
+
+def echo(prompt):
+    """Shout the prompt back. Prompts packed by microbatch get an answer per item,
+    leaving out items with a ! so they look malformed"""
+    items = re.findall(r"^### (\d+)\n(.*)$", prompt, re.M)
+    if not items:
+        return prompt.rsplit("\n\n", 1)[-1].upper()
+    return "".join(f"### {n}\n{item.upper()}\n" for n, item in items if "!" not in item)
+
+# Prompts are cached in blocks of this many tokens, once they are at least CACHE_MIN long. Like openai
+CACHE_BLOCK = 128
+CACHE_MIN = 1024
+
+
+class FakeHandler(http.server.BaseHTTPRequestHandler):
+    "Streams fake replies in the openai SSE and ollama NDJSON formats"
+    protocol_version = "HTTP/1.1"
+    latency = 0.5
+    chunks = 20
+    chunk_delay = 0.01
+    # Quota enforced on chat requests. 0 for no quota
+    requests_per_second = 0
+    # Time to read each prompt token that is not cached
+    prefill_per_token = 0
+    # Answer with the prompt rather than word0 word1...
+    echo = False
+
+    def log_message(self, *_): #pylint: disable=arguments-differ
+        pass
+
+    def do_GET(self): #pylint: disable=invalid-name
+        if self.path.startswith("/v1/models"):
+            model = dict(id="fake", object="model", created=0, owned_by="fake")
+            self.send_json(dict(object="list", data=[model]))
+        elif self.path == "/api/tags":
+            self.send_json(dict(models=[dict(model="fake", name="fake")]))
+        elif self.path == "/stats":
+            self.send_json(dict(served=self.server.served, throttled=self.server.throttled))
+        else:
+            self.send_error(404)
+
+    def do_POST(self): #pylint: disable=invalid-name
+        length = int(self.headers.get("Content-Length", 0))
+        request = json.loads(self.rfile.read(length) or b"{}")
+        if self.path not in ("/v1/chat/completions", "/api/chat"):
+            self.send_error(404)
+            return
+
+        remaining, reset = self.take_quota()
+        headers = {}
+        if self.requests_per_second:
+            headers = {
+                "x-ratelimit-limit-requests": str(self.requests_per_second),
+                "x-ratelimit-remaining-requests": str(remaining),
+                "x-ratelimit-reset-requests": f"{reset * 1000:.0f}ms"}
+
+        if remaining < 0:
+            headers["x-ratelimit-remaining-requests"] = "0"
+            headers["retry-after"] = f"{reset:.3f}"
+            self.send_json(dict(error=dict(message="Rate limit reached", type="requests")), 429, headers)
+            return
+
+        messages = request.get("messages", [])
+        tokens, cached = self.prefix_cache(messages)
+        prefill = (tokens - cached) * self.prefill_per_token
+        if self.echo and messages:
+            words = re.findall(r"\S*\s*", echo(messages[-1]["content"]))
+        else:
+            words = [f"word{i} " for i in range(self.chunks)]
+        if self.path == "/v1/chat/completions":
+            last = b"data: [DONE]\n\n"
+            if request.get("stream_options", {}).get("include_usage"):
+                last = openai_usage(tokens, cached) + last
+            self.stream("text/event-stream", openai_event, last, headers, prefill, words)
+        else:
+            last = ollama_line(
+                "", done=True, prompt_eval_count=tokens - cached,
+                prompt_eval_duration=int(prefill * 1e9))
+            self.stream("application/x-ndjson", ollama_line, last, headers, prefill, words)
+
+    def prefix_cache(self, messages):
+        "Returns the prompt's tokens and how many of them were cached, taking four characters as a token"
+        text = "".join(f"<{m.get('role')}>{m.get('content')}" for m in messages)
+        block = CACHE_BLOCK * 4
+        digest = hashlib.sha256()
+        cached = 0
+        with self.server.lock:
+            for end in range(block, len(text) + 1, block):
+                digest.update(text[end - block:end].encode("utf8"))
+                key = digest.copy().digest()
+                if key in self.server.prefixes and end >= CACHE_MIN * 4:
+                    cached = end // 4
+                self.server.prefixes.add(key)
+        return len(text) // 4, cached
+
+    def take_quota(self):
+        "Returns requests remaining this second (negative if over quota) and seconds until reset"
+        if not self.requests_per_second:
+            return 1, 0
+
+        with self.server.lock:
+            now = time.time()
+            recent = self.server.recent
+            while recent and recent[0] < now - 1:
+                recent.popleft()
+            reset = recent[0] + 1 - now if recent else 1
+            if len(recent) >= self.requests_per_second:
+                self.server.throttled += 1
+                return -1, reset
+            recent.append(now)
+            self.server.served += 1
+            return self.requests_per_second - len(recent), reset
+
+    def send_json(self, data, status=200, headers=None):
+        body = json.dumps(data).encode("utf8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def stream(self, content_type, encode, last, headers, prefill, words):
+        time.sleep(self.latency + prefill)
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Transfer-Encoding", "chunked")
+        for k, v in headers.items():
+            self.send_header(k, v)
+        self.end_headers()
+        try:
+            for word in words:
+                if not word:
+                    continue
+                time.sleep(self.chunk_delay)
+                self.write_chunk(encode(word))
+            self.write_chunk(last)
+            self.write_chunk(b"")
+        except (BrokenPipeError, ConnectionResetError):
+            self.close_connection = True
+
+    def write_chunk(self, data):
+        self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+
+class FakeServer(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+    # The default backlog of 5 refuses connections when a benchmark opens hundreds at once
+    request_queue_size = 1024
+
+    def __init__(self, *args):
+        super().__init__(*args)
+        self.lock = threading.Lock()
+        self.recent = collections.deque()
+        self.prefixes = set()
+        self.served = 0
+        self.throttled = 0
+
+    def handle_error(self, request, client_address):
+        # Clients hang up on us when they are cancelled
+        pass
+
+
+def serve(port=0, **settings):
+    "Start a FakeServer in a thread. Returns the server"
+    handler = type("Handler", (FakeHandler,), settings)
+    server = FakeServer(("127.0.0.1", port), handler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+def serve_process(**settings):
+    "Run a FakeServer in another process, so it does not count towards our benchmarks"
+    args = [f"--{k.replace('_', '-')}={v}" for k, v in settings.items()]
+    process = subprocess.Popen(
+        [sys.executable, __file__, *args],
+        stdout=subprocess.PIPE, text=True)
+    port = int(process.stdout.readline())
+    return process, port
+
+
+if __name__ == '__main__':
+    def main():
+        parser = argparse.ArgumentParser(description="Run a fake LLM server")
+        parser.add_argument("--port", type=int, default=0)
+        parser.add_argument("--latency", type=float, default=FakeHandler.latency)
+        parser.add_argument("--chunks", type=int, default=FakeHandler.chunks)
+        parser.add_argument("--chunk-delay", type=float, default=FakeHandler.chunk_delay)
+        parser.add_argument("--requests-per-second", type=int, default=0)
+        parser.add_argument("--prefill-per-token", type=float, default=0)
+        args = parser.parse_args()
+        server = serve(
+            args.port, latency=args.latency, chunks=args.chunks, chunk_delay=args.chunk_delay,
+            requests_per_second=args.requests_per_second, prefill_per_token=args.prefill_per_token)
+        print(server.server_address[1], flush=True)
+        threading.Event().wait()
+    main()
@@ -0,0 +1,27 @@
+import threading
+
+import pytest
+
+import fake
+from llmkey import aio, llm
+
+
+@pytest.mark.parametrize("fast", [False, True])
+@pytest.mark.parametrize("kind", ["openai", "ollama"])
+def test_engine_streams_reply(monkeypatch, kind, fast):
+    server = fake.serve(latency=0.05, chunks=5, chunk_delay=0)
+    port = server.server_address[1]
+    if kind == "ollama":
+        monkeypatch.setenv("OLLAMA_HOST", f"127.0.0.1:{port}")
+        backend = llm.OllamaBackend()
+    else:
+        backend = fake.FakeOpenaiBackend(port)
+    backend.fast_stream = fast
+    pool = aio.AsyncEngine(4)
+    done = threading.Event()
+    query = pool.submit(backend.query("fake", "question"), lambda _: done.set())
+    assert done.wait(5)
+    assert not query.error
+    assert query.reply == "".join(f"word{i} " for i in range(5))
+    assert query.timing.connected is not None
+    server.shutdown()
@@ -0,0 +1,28 @@
+import time
+
+import fake
+from llmkey import catalog, llm
+
+
+def slow_models():
+    time.sleep(0.3)
+    return ["first", "second"]
+
+def test_default_model_does_not_wait_for_models(monkeypatch):
+    monkeypatch.setattr(catalog, "load_all", dict)
+    monkeypatch.setattr(catalog, "save", lambda *_: None)
+    backend = llm.OllamaBackend()
+    backend._catalog = catalog.ModelCatalog("test-cold", slow_models) #pylint: disable=protected-access
+    start = time.time()
+    assert backend.default_model is None
+    assert time.time() - start < 0.1
+    assert backend.wait_default_model() == "first"
+
+def test_query_without_model_uses_default_when_run(monkeypatch):
+    backend = fake.FakeBackend(latency=0, chunks=1, chunk_delay=0)
+    monkeypatch.setattr(backend, "wait_default_model", lambda: "chosen")
+    monkeypatch.setitem(llm.model_cache, backend.name, backend)
+    query = backend.query(None, "question")
+    query.run()
+    assert query.finished
+    assert query.model == query.timing.model == query.stream.model == "chosen"
@@ -0,0 +1,14 @@
+from llmkey import mapreduce
+
+
+def test_chunks_never_grow_past_chunk_tokens():
+    text = "".join(f"line {i} of a long log\n" for i in range(20000))
+    chunks = mapreduce.split(text, 1000)
+    assert "".join(chunks) == text
+    assert len(chunks) > 16
+    assert all(mapreduce.tokens(chunk) <= 1000 for chunk in chunks)
+
+def test_chunks_break_at_paragraphs():
+    text = ("word " * 300 + "\n\n") * 4
+    chunks = mapreduce.split(text, 500)
+    assert all(chunk.endswith("\n\n") for chunk in chunks)
@@ -0,0 +1,23 @@
+from llmkey import microbatch
+
+
+def split(reply, count):
+    answers = {}
+    splitter = microbatch.Splitter(count, answers.__setitem__)
+    for i in range(0, len(reply), 7):
+        splitter.feed(reply[i:i + 7])
+    splitter.finish()
+    return answers
+
+def test_multi_line_answers_stay_with_their_item():
+    reply = "### 1\nfirst\nstill first\n### 2\nsecond\n### 3\n\nthird\n"
+    assert split(reply, 3) == {0: "first\nstill first", 1: "second", 2: "third"}
+
+def test_malformed_answers_are_left_out():
+    reply = "### 1\none\n### 1\nagain\n### 5\nfive\n### 2\n\n"
+    assert split(reply, 3) == {0: "one"}
+
+def test_reply_has_a_line_for_each_item():
+    job = microbatch.MicroBatch(None, None, None, "command", ["a", "b", "c"])
+    job.answers = ["first\nstill first", None, "third"]
+    assert job.reply.split("\n") == ["first still first", "", "third"]
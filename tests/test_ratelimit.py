@@ -0,0 +1,64 @@
+import time
+
+from llmkey import ratelimit
+
+
+def headers(remaining, reset="1s"):
+    return {"x-ratelimit-remaining-requests": str(remaining), "x-ratelimit-reset-requests": reset}
+
+def test_headers_do_not_give_back_requests_started_since():
+    limiter = ratelimit.RateLimiter()
+    limiter.started("first")
+    sent = time.time()
+    for _ in range(5):
+        limiter.started("later")
+    # The server counted the first request but not the five after it
+    limiter.success(headers(10), sent)
+    assert limiter.requests_remaining == 5
+
+def test_older_headers_are_ignored():
+    limiter = ratelimit.RateLimiter()
+    limiter.started("first")
+    first = time.time()
+    limiter.started("second")
+    second = time.time()
+    limiter.success(headers(3), second)
+    limiter.success(headers(4), first)
+    assert limiter.requests_remaining == 3
+
+def test_older_headers_can_lower_the_budget():
+    limiter = ratelimit.RateLimiter()
+    limiter.started("first")
+    first = time.time()
+    limiter.started("second")
+    second = time.time()
+    # The server counted the second request before the first
+    limiter.success(headers(1), second)
+    limiter.success(headers(0), first)
+    assert limiter.requests_remaining == 0
+
+def test_first_burst_waits_for_headers():
+    limiter = ratelimit.RateLimiter(probes=2)
+    limiter.started("first")
+    sent = time.time()
+    limiter.started("second")
+    assert not limiter.ready(2)
+    limiter.connected(headers(10), sent)
+    assert limiter.ready(2)
+
+def test_spent_budget_waits_for_reset():
+    limiter = ratelimit.RateLimiter()
+    limiter.started("first")
+    limiter.connected(headers(1, "500ms"), time.time())
+    assert limiter.ready(0)
+    limiter.started("second")
+    assert not limiter.ready(0)
+    assert 0.4 < limiter.wait() <= 0.5
+
+def test_throttle_halves_window_once_per_burst():
+    limiter = ratelimit.RateLimiter(window=32)
+    sent = time.time()
+    limiter.throttle({"retry-after": "0"}, sent)
+    limiter.throttle({"retry-after": "0"}, sent)
+    assert limiter.window == 16
+    assert limiter.throttles == 2
@@ -0,0 +1,96 @@
+import threading
+import time
+
+import httpx
+
+import fake
+from llmkey import llm, runner
+
+
+def test_cancel_frees_slot_and_stops_read():
+    server = fake.serve(latency=0.05, chunks=3, chunk_delay=30)
+    backend = fake.FakeOpenaiBackend(server.server_address[1])
+    pool = runner.QueryPool(2)
+    done = threading.Event()
+    query = pool.submit(backend.query("fake", "question"), lambda _: done.set())
+    # Past the fake server's latency, so the reply has stalled
+    time.sleep(0.3)
+    start = time.time()
+    pool.cancel(query)
+    assert done.wait(1)
+    assert time.time() - start < 0.05
+    deadline = time.time() + 1
+    while query.timing.finished is None and time.time() < deadline:
+        time.sleep(0.001)
+    assert query.timing.cancel_latency < 0.5
+    server.shutdown()
+
+def test_cached_replies_are_done_at_once():
+    pool = runner.QueryPool(2)
+    query = llm.LlmQuery.from_reply("reply", backend="fake", model="fake", prompt="question")
+    done = []
+    pool.submit(query, done.append)
+    assert done == [query]
+    pool.cancel(query)
+
+def test_rate_limit_keeps_within_quota():
+    quota = 20
+    count = 60
+    server = fake.serve(latency=0.05, chunks=5, chunk_delay=0.01, requests_per_second=quota)
+    backend = fake.FakeOpenaiBackend(server.server_address[1])
+    pool = runner.QueryPool(16)
+    finished = threading.Semaphore(0)
+    queries = [
+        pool.submit(backend.query("fake", f"question {i}"), lambda _: finished.release())
+        for i in range(count)]
+    for _ in queries:
+        assert finished.acquire(timeout=30)
+    assert all(q.finished and not q.error for q in queries)
+    assert server.throttled < count // 4
+    server.shutdown()
+
+def test_fails_over_when_backend_does_not_answer():
+    server = fake.serve(latency=30)
+    primary = fake.FakeOpenaiBackend(server.server_address[1])
+    primary.timeout = httpx.Timeout(None, connect=0.5)
+    fallback = fake.FakeBackend(latency=0.05, chunks=3, chunk_delay=0)
+    pool = runner.QueryPool(2, connect_timeout=0.5)
+    done = threading.Event()
+    query = primary.query("fake", "question")
+    query.fallbacks = [(fallback, "fake")]
+    start = time.time()
+    pool.submit(query, lambda _: done.set())
+    assert done.wait(5)
+    assert time.time() - start < 2
+    assert query.backend == "fake"
+    assert not query.error
+    assert query.reply_buffer
+    server.shutdown()
+
+def test_slow_chunks_are_not_timed_out():
+    server = fake.serve(latency=0.05, chunks=2, chunk_delay=1)
+    backend = fake.FakeOpenaiBackend(server.server_address[1])
+    backend.timeout = httpx.Timeout(None, connect=0.5)
+    pool = runner.QueryPool(2, connect_timeout=0.5)
+    done = threading.Event()
+    query = pool.submit(backend.query("fake", "question"), lambda _: done.set())
+    assert done.wait(5)
+    assert not query.error
+    assert query.reply_buffer
+    server.shutdown()
+
+def test_ollama_can_take_its_time_over_the_first_token(monkeypatch):
+    # Ollama only sends its headers with the first chunk
+    server = fake.serve(latency=1, chunks=2, chunk_delay=0)
+    monkeypatch.setenv("OLLAMA_HOST", f"127.0.0.1:{server.server_address[1]}")
+    backend = llm.OllamaBackend()
+    backend.timeout = httpx.Timeout(None, connect=0.3)
+    pool = runner.QueryPool(2, connect_timeout=0.3)
+    done = threading.Event()
+    query = backend.query("fake", "question")
+    query.fallbacks = [(fake.FakeBackend(latency=0, chunks=1, chunk_delay=0), "fake")]
+    pool.submit(query, lambda _: done.set())
+    assert done.wait(5)
+    assert query.backend == "ollama"
+    assert not query.error
+    server.shutdown()